@@ -0,0 +1,228 @@
+"""
+Benchmark the mapping pipeline end to end without OpenAI: read_target_file,
+process_target_table, create_excel_file and df_to_sql run on synthetic target
+workbooks, with `get_qa_chain` building its chain around a local fake model
+(benchmarks/fake_llm.py).
+
+Wall time, peak traced memory and rows/sec are reported for every stage and size.
+Results can be saved with --output and compared against an earlier run with
+--baseline, which exits with status 1 when a stage got slower than --tolerance.
+
+Usage:
+    python benchmarks/bench_pipeline.py [--sizes 10 100 1000 10000] [--latency 0.05]
+        [--jitter 0.05] [--error-rate 0.02] [--output bench.json] [--baseline old.json]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+from types import SimpleNamespace
+
+import numpy as np
+import orjson
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_llm import fake_chat_openai
+from utils.constants import (
+    target_table_chunk_size,
+    model_max_tokens,
+    llm_max_concurrency,
+    llm_max_retries,
+    llm_max_invalid_retries,
+    sql_rows_per_insert,
+    excel_title_height,
+    excel_header_height,
+    excel_data_height,
+    max_header_weight,
+    min_header_weight,
+)
+from utils.file_handling import read_target_file, source_table_to_markdown
+from utils.processing import get_qa_chain, process_target_table, create_excel_file
+from utils.df_to_sql import df_to_sql, sql_dialects
+from utils.telemetry import RunMetrics
+
+column_words = ["Claim", "Policy", "Loss", "Payment", "Reserve", "Insured", "Agent", "Vendor", "Status", "Date"]
+datatypes = ["Varchar(100)", "Int", "Date", "Decimal(18,2)", "Bit"]
+
+
+def make_target_workbook(num_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    words = rng.choice(column_words, (num_rows, 2))
+    target_df = pd.DataFrame({
+        "Target Column Name": [f"{first}{second}{i}" for i, (first, second) in enumerate(words)],
+        "Target Column DataType": rng.choice(datatypes, num_rows),
+        "Description": [f"Synthetic target column {i}" for i in range(num_rows)],
+    })
+    workbook = BytesIO()
+    target_df.to_excel(workbook, index=False)
+    workbook.seek(0)
+    workbook.name = f"target_{num_rows}.xlsx"
+    return workbook
+
+
+def make_source_table(num_columns, num_rows, seed):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        f"{rng.choice(column_words)}{rng.choice(column_words)}{i}": rng.integers(0, 10 ** 6, num_rows)
+        for i in range(num_columns)
+    })
+
+
+def fake_streamlit(uploaded_file):
+    # read_target_file only needs the sidebar file uploader
+    return SimpleNamespace(sidebar=SimpleNamespace(file_uploader=lambda *args, **kwargs: uploaded_file))
+
+
+def run_stage(metrics, results, num_rows, name, func, trace_memory):
+    if trace_memory:
+        tracemalloc.reset_peak()
+        start_memory = tracemalloc.get_traced_memory()[0]
+    with metrics.span(name, rows=num_rows):
+        started_at = time.perf_counter()
+        value = func()
+        seconds = time.perf_counter() - started_at
+    peak_mb = (tracemalloc.get_traced_memory()[1] - start_memory) / 2 ** 20 if trace_memory else float("nan")
+    results.append({
+        "rows": num_rows,
+        "stage": name,
+        "seconds": seconds,
+        "peak_mb": peak_mb,
+        "rows_per_second": num_rows / seconds if seconds > 0 else float("inf"),
+    })
+    return value
+
+
+def benchmark_size(num_rows, source_markdowns, options, results):
+    metrics = RunMetrics(options.model)
+    uploaded_file = make_target_workbook(num_rows, options.seed)
+
+    target_table_markdowns, _, _, _ = run_stage(
+        metrics, results, num_rows, "read target",
+        lambda: read_target_file(fake_streamlit(uploaded_file), target_table_chunk_size),
+        options.trace_memory,
+    )
+    with fake_chat_openai(
+        latency=options.latency, jitter=options.jitter, error_rate=options.error_rate, seed=options.seed
+    ):
+        qa_chain = get_qa_chain("", options.model, model_max_tokens, options.structured_output)
+    combined_df, _ = run_stage(
+        metrics, results, num_rows, "map chunks",
+        lambda: process_target_table(
+            source_markdowns, target_table_markdowns,
+            qa_chain, target_table_chunk_size,
+            max_workers=options.concurrency,
+            max_retries=llm_max_retries,
+            progress_callback=lambda count, total, res: None,
+            rows_callback=(lambda rows: None) if options.stream else None,
+            structured_output=options.structured_output,
+            max_invalid_retries=llm_max_invalid_retries,
+            metrics=metrics,
+        ),
+        options.trace_memory,
+    )
+    if len(combined_df) != num_rows:
+        raise RuntimeError(f"Expected {num_rows} mapped rows, got {len(combined_df)}")
+
+    run_stage(
+        metrics, results, num_rows, "excel export",
+        lambda: create_excel_file(
+            combined_df, SimpleNamespace(), excel_title_height, excel_header_height,
+            excel_data_height, max_header_weight, min_header_weight, "bench",
+            fast_export=options.fast_excel
+        ),
+        options.trace_memory,
+    )
+    run_stage(
+        metrics, results, num_rows, "sql export",
+        lambda: df_to_sql(combined_df, "bench", True, sql_rows_per_insert, options.sql_dialect),
+        options.trace_memory,
+    )
+    return metrics.summary()
+
+
+def compare_to_baseline(results, baseline_path, tolerance):
+    """
+    Returns:
+        list: A message for every stage whose rows/sec dropped by more than `tolerance`.
+    """
+    with open(baseline_path, "rb") as baseline_file:
+        baseline = {(r["rows"], r["stage"]): r for r in orjson.loads(baseline_file.read())["results"]}
+    regressions = []
+    for result in results:
+        before = baseline.get((result["rows"], result["stage"]))
+        if before is None:
+            continue
+        ratio = result["rows_per_second"] / before["rows_per_second"]
+        if ratio < 1 - tolerance:
+            regressions.append(
+                f"{result['stage']} at {result['rows']} rows: {before['rows_per_second']:,.0f} -> "
+                f"{result['rows_per_second']:,.0f} rows/s ({ratio:.0%})"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--model", default="gpt-3.5-turbo", choices=["gpt-3.5-turbo", "gpt-4o"])
+    parser.add_argument("--latency", type=float, default=0.05, help="Base seconds of every fake reply.")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Extra random seconds of every fake reply.")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="Probability a fake request fails with a 429.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--concurrency", type=int, default=llm_max_concurrency)
+    parser.add_argument("--source-columns", type=int, default=60, help="Columns of each synthetic source table.")
+    parser.add_argument("--stream", action="store_true", help="Stream the fake replies row by row.")
+    parser.add_argument("--structured-output", action="store_true", help="Have the fake model reply in JSON.")
+    parser.add_argument("--styled-excel", dest="fast_excel", action="store_false",
+                        help="Benchmark the cell-by-cell styled Excel export instead of the fast one.")
+    parser.add_argument("--sql-dialect", default="ansi", choices=sql_dialects)
+    parser.add_argument("--no-memory", dest="trace_memory", action="store_false",
+                        help="Skip tracemalloc, which slows the Python-heavy stages down.")
+    parser.add_argument("--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="A JSON file written by --output to compare against.")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed rows/sec drop against the baseline before failing.")
+    options = parser.parse_args()
+
+    source_markdowns = [
+        source_table_to_markdown(make_source_table(options.source_columns, 20, seed))
+        for seed in (options.seed + 1, options.seed + 2)
+    ]
+    if options.trace_memory:
+        tracemalloc.start()
+
+    results = []
+    print(f"{'rows':>8}  {'stage':<14}{'seconds':>10}{'peak MB':>10}{'rows/s':>14}")
+    for num_rows in options.sizes:
+        summary = benchmark_size(num_rows, source_markdowns, options, results)
+        for result in results[-4:]:
+            print(
+                f"{result['rows']:>8}  {result['stage']:<14}{result['seconds']:>10.3f}"
+                f"{result['peak_mb']:>10.1f}{result['rows_per_second']:>14,.0f}"
+            )
+        print(
+            f"{'':>8}  {summary['chunks']} chunks, {summary['retries']} retries, "
+            f"mean call {summary['mean_call_seconds']:.3f}s, p95 {summary['p95_call_seconds']:.3f}s, "
+            f"{summary['prompt_tokens'] + summary['completion_tokens']} tokens"
+        )
+
+    if options.output:
+        with open(options.output, "wb") as output_file:
+            output_file.write(orjson.dumps(
+                {"options": vars(options), "results": results},
+                option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY,
+            ))
+    if options.baseline:
+        regressions = compare_to_baseline(results, options.baseline, options.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
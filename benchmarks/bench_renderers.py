@@ -0,0 +1,112 @@
+"""
+Benchmark the vectorised df_to_markdown / df_to_sql renderers against the
+original iterrows() implementations and check the output is byte-identical.
+
+Usage:
+    python benchmarks/bench_renderers.py [--sizes 1000 10000 100000]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.file_handling import df_to_markdown
+from utils.df_to_sql import df_to_sql, clean_string
+
+
+def legacy_df_to_markdown(df):
+    df = df.replace(np.nan, '', regex=True)
+    header = "| " + " | ".join(df.columns) + " |"
+    separator = "|---" * len(df.columns) + "|"
+    rows = []
+    for _, row in df.iterrows():
+        formatted_row = "| " + " | ".join(str(x) if x != 'nan' else '-' for x in row) + " |"
+        rows.append(formatted_row)
+    return "\n".join([header, separator] + rows)
+
+
+def legacy_df_to_sql(df, table_name, drop_existing_table=False):
+    sql_commands = []
+    if drop_existing_table:
+        sql_commands.append("-- Drop the table if it already exists to avoid duplication errors")
+        sql_commands.append(f"DROP TABLE IF EXISTS {table_name};\n")
+    create_table = "-- Create a new table\n"
+    create_table += f"CREATE TABLE {table_name} (\n"
+    columns = []
+    for col, dtype in zip(df.columns, df.dtypes):
+        if dtype == 'int64':
+            sql_type = 'INTEGER'
+        elif dtype == 'float64':
+            sql_type = 'REAL'
+        elif dtype == 'bool':
+            sql_type = 'BOOLEAN'
+        else:
+            sql_type = 'TEXT'
+        columns.append(f'    "{col}" {sql_type} NOT NULL')
+    create_table += ',\n'.join(columns) + "\n);\n"
+    sql_commands.append(create_table)
+    sql_commands.append("-- Insert records into the table")
+    column_names = ', '.join(f'\"{col}\"' for col in df.columns)
+    insert_into = f"INSERT INTO {table_name} ({column_names}) VALUES\n"
+    values_list = []
+    for _, row in df.iterrows():
+        values = ', '.join([f"'{clean_string(x)}'" if isinstance(x, str) else clean_string(str(x)) for x in row])
+        values_list.append(f"    ({values})")
+    insert_into += ',\n'.join(values_list) + ";\n"
+    sql_commands.append(insert_into)
+    sql_commands.append("-- Select all records from the table to verify insertion")
+    sql_commands.append(f"SELECT * FROM {table_name};")
+    return '\n'.join(sql_commands)
+
+
+def make_mapping_df(num_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    names = np.array(["ClaimNumber", "PolicyNumber", "Loss Date", "O'Brien\\Notes", "nan", "Amount|Paid"])
+    df = pd.DataFrame({
+        "Target Column Name": rng.choice(names, num_rows),
+        "Target Column DataType": rng.choice(["Varchar(100)", "Date", "Decimal(18,2)"], num_rows),
+        "Source1 Column Name": rng.choice(names, num_rows),
+        "Source1 Mapping": rng.choice(["Direct", "Isnull(ClaimType, LossType)", ""], num_rows),
+        "Source2 Column Name": rng.choice(names, num_rows),
+        "Source2 Mapping": rng.choice(["Direct", "-", "Convert to 'YYYY-MM-DD'"], num_rows),
+        "Amount": rng.normal(1000, 500, num_rows).round(2),
+        "Sequence": rng.integers(0, 10 ** 6, num_rows),
+    })
+    df.loc[df.sample(frac=0.1, random_state=seed).index, "Amount"] = np.nan
+    df.loc[df.sample(frac=0.1, random_state=seed + 1).index, "Source1 Mapping"] = np.nan
+    return df
+
+
+def time_call(func, *args, **kwargs):
+    started_at = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - started_at
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    print(f"{'renderer':<16}{'rows':>10}{'before rows/s':>16}{'after rows/s':>16}{'speedup':>10}  identical")
+    for num_rows in args.sizes:
+        df = make_mapping_df(num_rows)
+        for name, legacy, current in [
+            ("df_to_markdown", legacy_df_to_markdown, df_to_markdown),
+            ("df_to_sql", lambda d: legacy_df_to_sql(d, "bench", True), lambda d: df_to_sql(d, "bench", True)),
+        ]:
+            before, before_seconds = time_call(legacy, df)
+            after, after_seconds = time_call(current, df)
+            print(
+                f"{name:<16}{num_rows:>10}{num_rows / before_seconds:>16,.0f}"
+                f"{num_rows / after_seconds:>16,.0f}{before_seconds / after_seconds:>9.1f}x  {before == after}"
+            )
+
+
+if __name__ == "__main__":
+    main()
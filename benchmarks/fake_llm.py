@@ -0,0 +1,145 @@
+"""
+A local stand-in for ChatOpenAI that answers mapping prompts with correctly shaped
+markdown (or JSON) tables, with configurable latency, jitter and error rate.
+
+Delays and failures are seeded from the prompt and the attempt number, so a run
+gets the same ones whatever order the worker threads send the prompts in.
+"""
+import random
+import re
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+import httpx
+import openai
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.pydantic_v1 import PrivateAttr
+import orjson
+
+import utils.processing
+from utils.processing import get_mapping_columns, get_table_cells, is_separator_row, is_header_row
+from utils.rate_limit import estimate_tokens
+
+target_table_marker = "**Target Table:**"
+source_table_marker = re.compile(r"\*\*Source\d+ Table:\*\*")
+
+
+def get_target_rows(prompt):
+    # The target table is the last part of the human message
+    lines = prompt.split(target_table_marker, 1)[-1].splitlines()
+    rows = []
+    for line in lines:
+        cells = get_table_cells(line)
+        if cells is None or is_separator_row(cells) or is_header_row(cells):
+            continue
+        rows.append(cells[:2])
+    return rows
+
+
+def build_reply(target_rows, num_sources, structured_output):
+    # Every target column is "mapped" to a source column of the same name
+    mapping_columns = get_mapping_columns(num_sources)
+    rows = [
+        [name, datatype] + [cell for number in range(1, num_sources + 1) for cell in (f"{name}_{number}", "Direct")]
+        for name, datatype in target_rows
+    ]
+    if structured_output:
+        return orjson.dumps({"rows": [dict(zip(mapping_columns, row)) for row in rows]}).decode()
+    lines = ["| " + " | ".join(mapping_columns) + " |", "|---" * len(mapping_columns) + "|"]
+    lines += ["| " + " | ".join(row) + " |" for row in rows]
+    return "\n".join(lines)
+
+
+def rate_limit_error():
+    request = httpx.Request("POST", "https://fake-llm.local/v1/chat/completions")
+    # A short Retry-After keeps the backoff of the harness in milliseconds
+    response = httpx.Response(429, headers={"retry-after-ms": "50"}, request=request)
+    return openai.RateLimitError("Fake rate limit", response=response, body=None)
+
+
+class FakeChatOpenAI(BaseChatModel):
+    """
+    Accepts the keyword arguments of ChatOpenAI, so `get_qa_chain` can build its chain
+    around it unchanged.
+
+    Args:
+        latency (float): The base seconds every reply takes.
+        jitter (float): Extra seconds added, uniformly between 0 and `jitter`.
+        error_rate (float): The probability that a request fails with a 429.
+        seed (int): Seeds the replies, delays and failures.
+    """
+    model_name: str = "gpt-3.5-turbo"
+    temperature: float = 0.3
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    seed: int = 0
+    model_kwargs: dict = {}
+    _attempts: dict = PrivateAttr(default_factory=dict)
+    _lock: object = PrivateAttr(default_factory=threading.Lock)
+
+    def __init__(self, model=None, **kwargs):
+        kwargs = {key: value for key, value in kwargs.items() if key in type(self).__fields__}
+        if model is not None:
+            kwargs["model_name"] = model
+        super().__init__(**kwargs)
+
+    @property
+    def _llm_type(self):
+        return "fake-openai"
+
+    def get_rng(self, prompt):
+        # Retries of the same prompt draw again, so a request is not doomed to fail forever
+        with self._lock:
+            attempt = self._attempts.get(prompt, 0)
+            self._attempts[prompt] = attempt + 1
+        return random.Random(f"{self.seed}-{zlib.crc32(prompt.encode('utf-8'))}-{attempt}")
+
+    def prepare(self, messages):
+        prompt = "\n".join(str(message.content) for message in messages)
+        structured_output = "response_format" in self.model_kwargs
+        num_sources = len(source_table_marker.findall(prompt))
+        content = build_reply(get_target_rows(prompt), num_sources, structured_output)
+        usage = {
+            "input_tokens": estimate_tokens(prompt),
+            "output_tokens": estimate_tokens(content),
+        }
+        usage["total_tokens"] = usage["input_tokens"] + usage["output_tokens"]
+        rng = self.get_rng(prompt)
+        return content, usage, rng.random() < self.error_rate, self.latency + rng.uniform(0, self.jitter)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        content, usage, fails, delay = self.prepare(messages)
+        time.sleep(delay)
+        if fails:
+            raise rate_limit_error()
+        message = AIMessage(content=content, usage_metadata=usage)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        content, usage, fails, delay = self.prepare(messages)
+        lines = content.splitlines(keepends=True)
+        for i, line in enumerate(lines):
+            time.sleep(delay / len(lines))
+            # Failing halfway exercises the reset of the rows streamed so far
+            if fails and i == len(lines) // 2:
+                raise rate_limit_error()
+            yield ChatGenerationChunk(message=AIMessageChunk(content=line))
+        yield ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=usage))
+
+
+@contextmanager
+def fake_chat_openai(**options):
+    """
+    Make `get_qa_chain` build its chains around FakeChatOpenAI with `options`.
+    """
+    original = utils.processing.ChatOpenAI
+    utils.processing.ChatOpenAI = lambda **kwargs: FakeChatOpenAI(**{**kwargs, **options})
+    try:
+        yield
+    finally:
+        utils.processing.ChatOpenAI = original
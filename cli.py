@@ -0,0 +1,383 @@
+"""
+Run mappings headlessly over many target workbooks.
+
+Usage:
+    python cli.py --source1 S1.xlsx --source2 S2.xlsx "targets/*.xlsx" [options]
+    python cli.py --source S1.xlsx --source S2.csv --source S3.parquet targets/ [options]
+
+Each target workbook is mapped in its own worker process, and the mapped
+Excel/SQL outputs are written next to it.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from types import SimpleNamespace
+
+import pandas as pd
+
+from utils.constants import (
+    target_table_chunk_size,
+    model_max_tokens,
+    model_max_output_tokens,
+    max_source_tables,
+    min_target_tokens_per_request,
+    source_profile_sample_values,
+    source_profile_sample_rows,
+    llm_max_concurrency,
+    llm_requests_per_minute,
+    llm_tokens_per_minute,
+    llm_max_retries,
+    llm_max_invalid_retries,
+    llm_cache_dir,
+    llm_cache_ttl_seconds,
+    llm_cache_max_entries,
+    checkpoint_dir,
+    checkpoint_ttl_seconds,
+    prematch_top_k,
+    prematch_min_score,
+    prematch_num_features,
+    mapping_memory_dir,
+    mapping_memory_fuzzy_min_score,
+    model_token_prices,
+    sql_rows_per_insert,
+    excel_fast_export,
+    excel_title_height,
+    excel_header_height,
+    excel_data_height,
+    max_header_weight,
+    min_header_weight,
+)
+from utils.file_handling import load_source_table, load_target_table, source_table_to_markdown
+from utils.ingestion import table_formats
+from utils.processing import get_qa_chain, process_target_table, create_excel_file
+from utils.multi_source import plan_mapping_requests, merge_fan_out_results
+from utils.prematching import prematch_source_markdowns, match_offline
+from utils.mapping_memory import MappingMemory, load_approved_mappings
+from utils.rules import load_rules, origin_column
+from utils.incremental import merge_incremental_results
+from utils.rate_limit import RateLimiter
+from utils.llm_cache import ResponseCache, CachedChain
+from utils.checkpoints import CheckpointStore, get_run_id
+from utils.df_to_sql import write_sql_file, sql_dialects
+from utils.telemetry import RunMetrics, timed, write_report
+
+output_suffix = "_mapped"
+
+
+def expand_targets(patterns):
+    target_paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = [
+                path for table_format in table_formats
+                for path in glob.glob(os.path.join(pattern, f"*.{table_format}"))
+            ]
+        else:
+            matches = glob.glob(pattern)
+        # Skip outputs of previous runs when a whole directory is given
+        target_paths.extend(
+            path for path in sorted(matches)
+            if f"{output_suffix}_" not in os.path.basename(path)
+        )
+    return list(dict.fromkeys(target_paths))
+
+
+def map_with_model(target_table_clean_df, source_tables, options, summary, metrics):
+    """
+    Map the target rows of one workbook with the model, filling the chunk and token
+    counts of `summary` on the way.
+
+    Args:
+        target_table_clean_df (pandas.DataFrame): The target rows.
+        source_tables (list): The (markdown, DataFrame) pair of each source table.
+
+    Returns:
+        pandas.DataFrame: The mapped rows.
+    """
+    name = os.path.basename(summary["target"])
+    max_tokens = model_max_output_tokens.get(options.model, model_max_tokens)
+    # Worker processes share the account limits
+    rate_limiter = RateLimiter(
+        llm_requests_per_minute / options.workers, llm_tokens_per_minute / options.workers
+    )
+
+    def prematch_sources(k, target_chunk_dfs):
+        render_source_table = lambda source_df: source_table_to_markdown(
+            source_df, options.source_payload, source_profile_sample_values, source_profile_sample_rows
+        )
+        with timed(metrics, "prematch source columns"):
+            return prematch_source_markdowns(
+                source_tables[k][1], target_chunk_dfs, render_source_table,
+                prematch_top_k, prematch_num_features, source_profile_sample_values
+            )
+
+    # Pre-matched prompts are much smaller than the planner assumes, so they use fixed chunks
+    with timed(metrics, "plan requests", rows=len(target_table_clean_df)):
+        plan = plan_mapping_requests(
+            target_table_clean_df,
+            [source_table_markdown for source_table_markdown, _ in source_tables],
+            options.model,
+            max_tokens,
+            target_table_chunk_size,
+            options.token_budgeting and options.prematch == "off",
+            options.structured_output,
+            min_target_tokens_per_request,
+            prematch_sources if options.prematch == "topk" else None,
+        )
+    if plan["fan_out"]:
+        print(f"[{name}] the {len(source_tables)} source tables do not fit in one request, mapping each on its own", flush=True)
+
+    # Fanned-out requests carry a single source table each
+    qa_chain = get_qa_chain(
+        options.api_key, options.model, max_tokens, options.structured_output,
+        1 if plan["fan_out"] else plan["num_sources"]
+    )
+    llm_chain = CachedChain(qa_chain, ResponseCache(llm_cache_dir, llm_cache_ttl_seconds, llm_cache_max_entries)) \
+        if options.cache else qa_chain
+
+    # Finished chunks are checkpointed so a failed workbook can be rerun with --resume
+    checkpoint_store = CheckpointStore(checkpoint_dir, checkpoint_ttl_seconds)
+    run_id = get_run_id(
+        options.model, options.structured_output, *plan["source_table_markdowns"], plan["target_table_markdowns"]
+    )
+    checkpoint_store.start_run(run_id, len(plan["target_table_markdowns"]), resume=options.resume)
+
+    def report_progress(count, total, res):
+        usage = getattr(res, "usage_metadata", None) or {}
+        summary["prompt_tokens"] += usage.get("input_tokens", 0)
+        summary["completion_tokens"] += usage.get("output_tokens", 0)
+        summary["cached_chunks"] += bool(res.response_metadata.get("cached"))
+        print(f"[{name}] chunk {count}/{total} done", flush=True)
+
+    with timed(metrics, "map chunks", chunks=len(plan["target_table_markdowns"])):
+        combined_df, _ = process_target_table(
+            plan["source_table_markdowns"], plan["target_table_markdowns"],
+            llm_chain, target_table_chunk_size,
+            max_workers=options.concurrency,
+            rate_limiter=rate_limiter,
+            model_max_tokens=max_tokens,
+            max_retries=llm_max_retries,
+            progress_callback=report_progress,
+            structured_output=options.structured_output,
+            max_invalid_retries=llm_max_invalid_retries,
+            checkpoint_store=checkpoint_store,
+            run_id=run_id,
+            metrics=metrics,
+        )
+    if plan["fan_out"]:
+        with timed(metrics, "merge source tables"):
+            combined_df = merge_fan_out_results(target_table_clean_df, combined_df, plan)
+    checkpoint_store.finish_run(run_id)
+    summary["invalid_chunks"] = combined_df.attrs.get("invalid_chunks", [])
+    summary["chunks"] = len(plan["target_table_markdowns"])
+    return combined_df
+
+
+def map_workbook(target_path, source_tables, options, rule_set=None):
+    """
+    Map a single target workbook and write its outputs next to it.
+
+    Returns:
+        dict: The per-file summary (rows, chunks, tokens, timings and output paths).
+    """
+    started_at = time.perf_counter()
+    name = os.path.basename(target_path)
+    summary = {
+        "target": target_path, "rows": 0, "chunks": 0, "cached_chunks": 0,
+        "prompt_tokens": 0, "completion_tokens": 0, "seconds": 0.0, "outputs": [], "error": "",
+        "invalid_chunks": [], "remembered": 0, "ruled": 0, "metrics": None,
+    }
+    metrics = RunMetrics(options.model, model_token_prices)
+    try:
+        with timed(metrics, "read target"):
+            _, _, target_table_clean_df = load_target_table(target_path, target_table_chunk_size, len(source_tables))
+        target_rows_df, carried_df = target_table_clean_df, None
+        # The mapping memory holds mappings of exactly two source tables
+        if options.memory and len(source_tables) == 2:
+            # Approved mappings from earlier projects are reused, only the rest is matched
+            with timed(metrics, "resolve from memory", rows=len(target_table_clean_df)):
+                remembered_df, target_rows_df = MappingMemory(mapping_memory_dir).resolve(
+                    target_table_clean_df,
+                    [source_df.columns for _, source_df in source_tables],
+                    mapping_memory_fuzzy_min_score,
+                    prematch_num_features,
+                )
+            summary["remembered"] = len(remembered_df)
+            carried_df = remembered_df.assign(**{origin_column: "memory"})
+        if rule_set is not None:
+            # Target columns the standardization and definition sheets settle are never sent to the model
+            with timed(metrics, "resolve from rules", rows=len(target_rows_df)):
+                ruled_df, target_rows_df = rule_set.resolve(target_rows_df, [source_df for _, source_df in source_tables])
+            summary["ruled"] = len(ruled_df)
+            carried_df = ruled_df if carried_df is None else pd.concat([carried_df, ruled_df], ignore_index=True)
+
+        if target_rows_df.empty:
+            combined_df = target_rows_df
+        elif options.prematch == "offline":
+            # Only high-confidence name matches are filled, without any model call
+            with timed(metrics, "match offline", rows=len(target_rows_df)):
+                combined_df = match_offline(
+                    target_rows_df, [source_df for _, source_df in source_tables],
+                    prematch_min_score, prematch_num_features, source_profile_sample_values
+                )
+            combined_df[origin_column] = "offline match"
+        else:
+            combined_df = map_with_model(target_rows_df, source_tables, options, summary, metrics)
+            combined_df[origin_column] = "model"
+        if carried_df is not None:
+            with timed(metrics, "merge results"):
+                combined_df = merge_incremental_results(target_table_clean_df, carried_df, combined_df)
+        summary["rows"] = len(combined_df)
+
+        output_dir = os.path.dirname(os.path.abspath(target_path))
+        output_stem = os.path.splitext(name)[0] + output_suffix
+        if "xlsx" in options.formats and not combined_df.empty:
+            excel_state = SimpleNamespace()
+            with timed(metrics, "excel export", rows=len(combined_df)):
+                create_excel_file(
+                    combined_df, excel_state, excel_title_height, excel_header_height,
+                    excel_data_height, max_header_weight, min_header_weight, output_stem,
+                    fast_export=excel_fast_export
+                )
+            excel_path = os.path.join(output_dir, excel_state.download_filename)
+            with open(excel_path, "wb") as excel_file:
+                excel_file.write(excel_state.excel_data)
+            summary["outputs"].append(excel_path)
+        if "sql" in options.formats and not combined_df.empty:
+            sql_path = os.path.join(output_dir, f"{output_stem}.sql")
+            with timed(metrics, "sql export", rows=len(combined_df)), open(sql_path, "w", encoding="utf-8") as sql_file:
+                write_sql_file(
+                    combined_df, "migration_ai_mapped_data", sql_file,
+                    drop_existing_table=True, rows_per_insert=sql_rows_per_insert, dialect=options.sql_dialect
+                )
+            summary["outputs"].append(sql_path)
+    except Exception as e:
+        summary["error"] = f"{type(e).__name__}: {e}"
+    summary["seconds"] = time.perf_counter() - started_at
+    # A plain dict, so it can be sent back from the worker process
+    summary["metrics"] = metrics.to_dict()
+    return summary
+
+
+def print_summary(summaries, total_seconds):
+    print()
+    print(f"{'target':<40}{'rows':>7}{'chunks':>8}{'cached':>8}{'prompt tok':>12}{'compl tok':>11}{'seconds':>9}")
+    for summary in summaries:
+        print(
+            f"{os.path.basename(summary['target'])[:39]:<40}{summary['rows']:>7}{summary['chunks']:>8}"
+            f"{summary['cached_chunks']:>8}{summary['prompt_tokens']:>12}{summary['completion_tokens']:>11}"
+            f"{summary['seconds']:>9.1f}"
+        )
+        if summary["error"]:
+            print(f"    error: {summary['error']}")
+        if summary["remembered"]:
+            print(f"    {summary['remembered']} rows resolved from the mapping memory")
+        if summary["ruled"]:
+            print(f"    {summary['ruled']} rows resolved from the mapping rules")
+        if summary["invalid_chunks"]:
+            print(f"    row count mismatch in chunk(s): {', '.join(map(str, summary['invalid_chunks']))}")
+        for output in summary["outputs"]:
+            print(f"    wrote {output}")
+    print(
+        f"{len(summaries)} workbook(s), "
+        f"{sum(s['prompt_tokens'] for s in summaries)} prompt + "
+        f"{sum(s['completion_tokens'] for s in summaries)} completion tokens, "
+        f"{total_seconds:.1f}s wall time"
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("targets", nargs="+", help="Target workbooks (xlsx, csv or parquet), directories or glob patterns.")
+    parser.add_argument("--source1", help="The first TPA source table (xlsx, csv or parquet).")
+    parser.add_argument("--source2", help="The second TPA source table (xlsx, csv or parquet).")
+    parser.add_argument("--source", action="append", default=[], metavar="PATH",
+                        help="A further TPA source table (repeatable), numbered after --source1 and --source2.")
+    parser.add_argument("--model", default="gpt-3.5-turbo", choices=["gpt-3.5-turbo", "gpt-4o"])
+    parser.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY", ""),
+                        help="OpenAI API key (defaults to $OPENAI_API_KEY).")
+    parser.add_argument("--workers", type=int, default=4, help="Workbooks mapped in parallel.")
+    parser.add_argument("--concurrency", type=int, default=llm_max_concurrency,
+                        help="Concurrent chunk requests per workbook.")
+    parser.add_argument("--formats", default="xlsx,sql", help="Comma separated outputs: xlsx, sql.")
+    parser.add_argument("--sql-dialect", default="ansi", choices=sql_dialects)
+    parser.add_argument("--source-payload", default="table", choices=["table", "profile"],
+                        help="Send full source tables or one-line column profiles.")
+    parser.add_argument("--prematch", default="off", choices=["off", "topk", "offline"],
+                        help=f"topk: send each chunk only the {prematch_top_k} most similar source columns per "
+                             "target column. offline: fill confident name matches locally, without the model.")
+    parser.add_argument("--fixed-chunks", dest="token_budgeting", action="store_false",
+                        help=f"Split targets in fixed chunks of {target_table_chunk_size} rows instead of by token budget.")
+    parser.add_argument("--structured-output", action="store_true",
+                        help="Ask the model for JSON rows instead of a markdown table.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Reuse the checkpointed chunks of earlier failed runs on the same inputs.")
+    parser.add_argument("--learn", action="append", default=[], metavar="WORKBOOK",
+                        help="Add the approved mappings of this workbook to the mapping memory first (repeatable).")
+    parser.add_argument("--rules", action="append", default=[], metavar="WORKBOOK",
+                        help="Resolve target columns from this mapping standardization or column definition "
+                             "workbook before the model (repeatable).")
+    parser.add_argument("--no-memory", dest="memory", action="store_false",
+                        help="Do not resolve target columns from the mapping memory.")
+    parser.add_argument("--no-cache", dest="cache", action="store_false", help="Bypass the LLM response cache.")
+    parser.add_argument("--report", metavar="PATH",
+                        help="Write per-stage timings, chunk latencies and token costs to PATH (.json or .csv).")
+    options = parser.parse_args(argv)
+    options.formats = [f.strip() for f in options.formats.split(",") if f.strip()]
+    options.sources = [path for path in (options.source1, options.source2) if path] + options.source
+    if not options.sources:
+        parser.error("at least one source table is required (--source1/--source2 or --source)")
+    if len(options.sources) > max_source_tables:
+        parser.error(f"at most {max_source_tables} source tables are supported")
+    return options
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    if not options.api_key and options.prematch != "offline":
+        print("An OpenAI API key is required (--api-key or $OPENAI_API_KEY).", file=sys.stderr)
+        return 2
+
+    target_paths = expand_targets(options.targets)
+    if not target_paths:
+        print("No target workbooks found.", file=sys.stderr)
+        return 2
+
+    for mapping_path in options.learn:
+        saved = MappingMemory(mapping_memory_dir).save(load_approved_mappings(mapping_path))
+        print(f"Added {saved} approved mappings from {mapping_path}")
+    try:
+        rule_set = load_rules(options.rules)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    options.workers = max(1, min(options.workers, len(target_paths)))
+
+    started_at = time.perf_counter()
+    source_tables = [
+        load_source_table(source_path, options.source_payload, source_profile_sample_values, source_profile_sample_rows)
+        for source_path in options.sources
+    ]
+
+    summaries = []
+    with ProcessPoolExecutor(max_workers=options.workers) as executor:
+        futures = [
+            executor.submit(map_workbook, path, source_tables, options, rule_set)
+            for path in target_paths
+        ]
+        for future in as_completed(futures):
+            summaries.append(future.result())
+
+    summaries.sort(key=lambda summary: target_paths.index(summary["target"]))
+    print_summary(summaries, time.perf_counter() - started_at)
+    if options.report:
+        write_report(options.report, [{"run": summary["target"], **summary["metrics"]} for summary in summaries])
+        print(f"Wrote run report to {options.report}")
+    return 1 if any(summary["error"] for summary in summaries) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,13 @@
+import os
+import tempfile
+
 import streamlit as st
 import pandas as pd
 
 from utils.file_handling import (
-    read_source1_file,
-    read_source2_file,
+    source_table_to_markdown,
+    get_dataframe_fingerprint,
+    read_numbered_source_file,
     read_target_file,
 )
 from utils.processing import (
@@ -14,6 +18,38 @@ from utils.processing import (
 from utils.constants import (
     target_table_chunk_size,
     model_max_tokens,
+    model_max_output_tokens,
+    max_source_tables,
+    min_target_tokens_per_request,
+    source_profile_sample_values,
+    source_profile_sample_rows,
+    ingest_cache_max_bytes,
+    llm_max_concurrency,
+    llm_max_concurrency_per_api_key,
+    llm_requests_per_minute,
+    llm_tokens_per_minute,
+    llm_max_retries,
+    llm_max_invalid_retries,
+    model_token_prices,
+    llm_cache_dir,
+    llm_cache_ttl_seconds,
+    llm_cache_max_entries,
+    checkpoint_dir,
+    checkpoint_ttl_seconds,
+    jobs_dir,
+    job_max_workers,
+    job_max_resumable,
+    job_poll_seconds,
+    job_ttl_seconds,
+    prematch_top_k,
+    prematch_min_score,
+    prematch_num_features,
+    mapping_memory_dir,
+    mapping_memory_fuzzy_min_score,
+    sql_rows_per_insert,
+    preview_page_size,
+    sql_preview_chars,
+    excel_fast_export,
     excel_title_height,
     excel_header_height,
     excel_data_height,
@@ -22,14 +58,69 @@ from utils.constants import (
 )
 
 from utils.openai_api import get_openai_api_key, display_api_key
-
-from utils.df_to_sql import df_to_sql
+from utils.rate_limit import RateLimiter
+from utils.llm_cache import ResponseCache, CachedChain
+from utils.coalescing import RequestCoalescer, get_api_key_id
+from utils.ingest_cache import IngestCache
+from utils.checkpoints import CheckpointStore, get_run_id
+from utils.incremental import diff_target_table, merge_incremental_results
+from utils.token_budget import ContextWindowError
+from utils.multi_source import plan_mapping_requests, merge_fan_out_results, merge_fan_out_chunks
+from utils.prematching import prematch_source_markdowns, match_offline
+from utils.mapping_memory import MappingMemory, load_approved_mappings
+from utils.rules import load_rules, origin_column
+from utils.preview import filter_rows, count_pages, get_page, read_text_preview
+from utils.telemetry import RunMetrics, timed, report_to_json, report_to_csv
+from utils.jobs import JobStore, JobRunner, JobError
+
+from utils.df_to_sql import write_sql_file, validate_sql_script
 
 st.set_page_config(
     page_title="Migration AI", 
     initial_sidebar_state="auto"
 )
 
+@st.cache_resource
+def get_response_cache():
+    return ResponseCache(llm_cache_dir, llm_cache_ttl_seconds, llm_cache_max_entries)
+
+@st.cache_resource
+def get_ingest_cache():
+    return IngestCache(ingest_cache_max_bytes)
+
+@st.cache_resource
+def get_checkpoint_store():
+    return CheckpointStore(checkpoint_dir, checkpoint_ttl_seconds)
+
+@st.cache_resource
+def get_mapping_memory():
+    return MappingMemory(mapping_memory_dir)
+
+@st.cache_resource
+def get_job_store():
+    return JobStore(jobs_dir, job_ttl_seconds)
+
+@st.cache_resource
+def get_job_runner():
+    return JobRunner(get_job_store(), job_max_workers, job_max_resumable)
+
+# The resources below are shared by every session, so identical requests are sent once,
+# connections are pooled and sessions using the same API key share its limits
+
+@st.cache_resource
+def get_request_coalescer():
+    return RequestCoalescer()
+
+@st.cache_resource
+def get_rate_limiter(api_key_id):
+    # `api_key_id` only keys the cache: one limiter per API key
+    return RateLimiter(llm_requests_per_minute, llm_tokens_per_minute, llm_max_concurrency_per_api_key)
+
+@st.cache_resource
+def get_shared_qa_chain(openai_api_key, ai_model_name, model_max_tokens, structured_output, num_sources):
+    # The chain's ChatOpenAI keeps its HTTP client, and with it the open connections
+    return get_qa_chain(openai_api_key, ai_model_name, model_max_tokens, structured_output, num_sources)
+
 def initialize_session_state():
     if 'output_display_title' not in st.session_state:
         st.session_state.output_display_title = st.empty()
@@ -47,74 +138,556 @@ def initialize_session_state():
         st.session_state.combined_df = pd.DataFrame()
     if 'OPENAI_API_KEY_Session' not in st.session_state:
         st.session_state.OPENAI_API_KEY_Session = ""
-    
-def handle_file_uploads():
-    source1_table_markdown, source1_table_data, source1_table_df = read_source1_file(st)
-    source2_table_markdown, source2_table_data, source2_table_df = read_source2_file(st)
+    if 'excel_data_fingerprint' not in st.session_state:
+        st.session_state.excel_data_fingerprint = ""
+    if 'sql_file_path' not in st.session_state:
+        st.session_state.sql_file_path = ""
+    if 'sql_dir' not in st.session_state:
+        # Removed with its scripts when the session ends and its state is garbage collected
+        st.session_state.sql_dir = tempfile.TemporaryDirectory(prefix="migration_ai_sql_")
+    if 'sql_file_fingerprint' not in st.session_state:
+        st.session_state.sql_file_fingerprint = ""
+    if 'invalid_chunks' not in st.session_state:
+        st.session_state.invalid_chunks = []
+    if 'job_id' not in st.session_state:
+        st.session_state.job_id = st.query_params.get("job")
+    if 'loaded_job_id' not in st.session_state:
+        st.session_state.loaded_job_id = None
+    if 'job_ids' not in st.session_state:
+        st.session_state.job_ids = []
+    if 'result_fingerprint' not in st.session_state:
+        st.session_state.result_fingerprint = (None, "")
+    if 'previews' not in st.session_state:
+        st.session_state.previews = {}
+    if 'sql_download_path' not in st.session_state:
+        st.session_state.sql_download_path = ""
+    if 'run_metrics' not in st.session_state:
+        st.session_state.run_metrics = None
+    if 'upload_metrics' not in st.session_state:
+        st.session_state.upload_metrics = RunMetrics()
+
+def get_result_fingerprint(combined_df):
+    # Hashing a large result on every rerun is not free, so it is done once per result object
+    cached_df, fingerprint = st.session_state.result_fingerprint
+    if cached_df is not combined_df:
+        fingerprint = get_dataframe_fingerprint(combined_df)
+        st.session_state.result_fingerprint = (combined_df, fingerprint)
+    return fingerprint
+
+def display_table_preview(label, df, key):
+    """
+    Show one page of a table with a column filter and a search box. Only the visible
+    page is sent to the browser, and the matching rows are kept per table until the
+    table, the columns or the search change, so a rerun costs the same for any table size.
+    """
+    st.caption(label)
+    if df.empty:
+        st.dataframe(df)
+        return
 
-    source1_file_col, source2_file_col, target_file_col = st.columns([1,1,1])
+    all_columns = df.columns.tolist()
+    columns_col, search_col, page_col = st.columns([2, 2, 1])
+    with columns_col:
+        columns = st.multiselect(
+            "Columns", all_columns, key=f"{key}_columns", format_func=str, placeholder="All columns"
+        ) or all_columns
+    with search_col:
+        search = st.text_input("Search", key=f"{key}_search")
+
+    preview = st.session_state.previews.get(key)
+    if preview is None or preview["df"] is not df or preview["columns"] != columns or preview["search"] != search:
+        preview = {"df": df, "columns": columns, "search": search, "rows": filter_rows(df, columns, search)}
+        st.session_state.previews[key] = preview
+    rows = preview["rows"]
+
+    num_pages = count_pages(len(rows), preview_page_size)
+    page_key = f"{key}_page"
+    # A new filter can leave fewer pages than the one shown
+    if st.session_state.get(page_key, 1) > num_pages:
+        st.session_state[page_key] = num_pages
+    with page_col:
+        page = st.number_input(f"Page (of {num_pages})", min_value=1, max_value=num_pages, step=1, key=page_key)
+
+    start = (page - 1) * preview_page_size
+    st.dataframe(get_page(df, rows, columns, page, preview_page_size))
+    filtered = f" (filtered from {len(df)})" if len(rows) != len(df) else ""
+    if len(rows) == 0:
+        st.caption(f"No matching rows{filtered}")
+    else:
+        st.caption(f"Rows {start + 1}-{min(start + preview_page_size, len(rows))} of {len(rows)}{filtered}")
+
+def prepare_excel_download(combined_df, target_filename):
+    # The workbook is built once per result, and only in the use case that downloads it
+    fingerprint = get_result_fingerprint(combined_df)
+    if st.session_state.excel_data_fingerprint == fingerprint and st.session_state.excel_data:
+        return
 
-    with source1_file_col:
-        if len(source1_table_data) > 0 and source1_table_data[0] and source1_table_data[1] and source1_table_data[2]:
-            st.text_input(label="Source1 File", value=source1_table_data[0], disabled=True)
-            info_message = (f"""({source1_table_data[1]} row x {source1_table_data[2]} column)""")
-            st.caption(info_message)
-        else:
-            st.info('Please Upload Source1 File', icon="ℹ️")
+    with timed(st.session_state.run_metrics, "excel export", rows=len(combined_df)):
+        create_excel_file(
+          combined_df, st.session_state, excel_title_height, excel_header_height, 
+          excel_data_height, max_header_weight, min_header_weight, target_filename,
+          fast_export=excel_fast_export
+        )
+    st.session_state.excel_data_fingerprint = fingerprint
+
+def clear_sql_file():
+    if st.session_state.sql_file_path and os.path.exists(st.session_state.sql_file_path):
+        os.remove(st.session_state.sql_file_path)
+    st.session_state.sql_file_path = ""
+
+def get_sql_file(combined_df, sql_dialect):
+    # The script is streamed to a temp file once per result instead of on every rerun
+    fingerprint = f"{sql_dialect}-{get_result_fingerprint(combined_df)}"
+    if st.session_state.sql_file_fingerprint == fingerprint and os.path.exists(st.session_state.sql_file_path):
+        return st.session_state.sql_file_path
+
+    clear_sql_file()
+    with timed(st.session_state.run_metrics, "sql export", rows=len(combined_df)), \
+            tempfile.NamedTemporaryFile(
+                "w", suffix=".sql", dir=st.session_state.sql_dir.name, delete=False, encoding="utf-8"
+            ) as sql_file:
+        write_sql_file(
+            combined_df,
+            "migration_ai_mapped_data",
+            sql_file,
+            drop_existing_table=True,
+            rows_per_insert=sql_rows_per_insert,
+            dialect=sql_dialect,
+        )
+    st.session_state.sql_file_path = sql_file.name
+    st.session_state.sql_file_fingerprint = fingerprint
+    return sql_file.name
+
+def display_sql_validation(combined_df, sql_file_path):
+    with timed(st.session_state.run_metrics, "sql validation"), open(sql_file_path, encoding="utf-8") as sql_file:
+        report = validate_sql_script(combined_df, "migration_ai_mapped_data", sql_file)
+
+    timings = f"parse {report['parse_seconds']:.2f}s, insert {report['execute_seconds']:.2f}s"
+    if report["ok"]:
+        st.success(
+            f"The script ran in SQLite: {report['statements']} statements, "
+            f"{report['inserted_rows']} of {report['expected_rows']} rows inserted ({timings}).",
+            icon="✅"
+        )
+    else:
+        st.error(f"The script failed in SQLite: {report['error']} ({timings})", icon="🚨")
+        if report["failing_statement"]:
+            st.code(report["failing_statement"], language="sql")
+    
+def handle_file_uploads(source_table_mode="table", num_sources=2):
+    ingest_cache = get_ingest_cache()
+    upload_metrics = st.session_state.upload_metrics
+    sources = [
+        read_numbered_source_file(
+            st, number, source_table_mode, source_profile_sample_values, source_profile_sample_rows, ingest_cache, upload_metrics
+        )
+        for number in range(1, num_sources + 1)
+    ]
+    target_table_markdowns, target_filename, target_table_data, target_table_clean_df = read_target_file(
+        st, target_table_chunk_size, ingest_cache, upload_metrics, num_sources
+    )
+
+    # The uploaded files are listed three per row
+    files = [(f"Source{number}", table_data) for number, (_, table_data, _) in enumerate(sources, start=1)]
+    files.append(("Target", target_table_data))
+    for start in range(0, len(files), 3):
+        for file_col, (label, table_data) in zip(st.columns([1,1,1]), files[start:start + 3]):
+            with file_col:
+                if len(table_data) > 0 and table_data[0] and table_data[1] and table_data[2]:
+                    st.text_input(label=f"{label} File", value=table_data[0], disabled=True)
+                    info_message = (f"""({table_data[1]} row x {table_data[2]} column)""")
+                    st.caption(info_message)
+                elif label == "Target":
+                    st.info('Please Upload a Target File', icon="ℹ️")
+                else:
+                    st.info(f'Please Upload {label} File', icon="ℹ️")
+
+    source_table_markdowns = [source_table_markdown for source_table_markdown, _, _ in sources]
+    source_dfs = [source_table_df for _, _, source_table_df in sources]
+    return source_table_markdowns, target_table_markdowns, target_filename, source_dfs, target_table_clean_df
+
+def resolve_from_memory(mapping_memory, target_rows_df, source_dfs, carried_df, metrics=None, notify=st.toast):
+    # Mappings approved in earlier projects are reused as they are, the rest goes on to matching
+    with timed(metrics, "resolve from memory", rows=len(target_rows_df)):
+        remembered_df, target_rows_df = mapping_memory.resolve(
+            target_rows_df,
+            [source_df.columns for source_df in source_dfs],
+            mapping_memory_fuzzy_min_score,
+            prematch_num_features,
+        )
+    if not remembered_df.empty:
+        notify(f"{len(remembered_df)} rows resolved from the mapping memory")
+        remembered_df = remembered_df.assign(**{origin_column: "memory"})
+        carried_df = remembered_df if carried_df is None else pd.concat([carried_df, remembered_df], ignore_index=True)
+    return target_rows_df, carried_df
+
+def resolve_from_rules(rule_set, target_rows_df, source_dfs, carried_df, metrics=None, notify=st.toast):
+    # Target columns the standardization and definition sheets settle are never sent to the model
+    with timed(metrics, "resolve from rules", rows=len(target_rows_df)):
+        ruled_df, target_rows_df = rule_set.resolve(target_rows_df, source_dfs)
+    if not ruled_df.empty:
+        notify(f"{len(ruled_df)} rows resolved from the mapping rules")
+        carried_df = ruled_df if carried_df is None else pd.concat([carried_df, ruled_df], ignore_index=True)
+    return target_rows_df, carried_df
+
+def display_run_metrics():
+    metrics = st.session_state.run_metrics
+    with st.expander("Run metrics"):
+        upload_stages = st.session_state.upload_metrics.get_stage_totals()
+        if upload_stages:
+            st.caption("File parsing (cache misses only):")
+            st.dataframe(pd.DataFrame(upload_stages), hide_index=True)
+        if metrics is None:
+            st.caption("No mapping run yet.")
+            return
+
+        summary = metrics.summary()
+        tokens_col, cost_col, latency_col, retries_col = st.columns(4)
+        tokens_col.metric("Tokens (prompt / completion)", f"{summary['prompt_tokens']} / {summary['completion_tokens']}")
+        cost_col.metric("Estimated cost", f"${summary['estimated_cost_usd']:.4f}")
+        latency_col.metric("Call latency (mean / p95)", f"{summary['mean_call_seconds']:.1f}s / {summary['p95_call_seconds']:.1f}s")
+        retries_col.metric("Retries / invalid replies", f"{summary['retries']} / {summary['invalid_replies']}")
+        st.caption(
+            f"{summary['chunks']} chunks ({summary['cached_chunks']} cached, {summary['resumed_chunks']} resumed, "
+            f"{summary['coalesced_chunks']} shared with other sessions), "
+            f"{summary['pool_wait_seconds']:.1f}s waiting for a worker, "
+            f"{summary['rate_limit_wait_seconds']:.1f}s waiting on rate limits"
+        )
+        st.caption("Stages:")
+        st.dataframe(pd.DataFrame(metrics.get_stage_totals()), hide_index=True)
+        if metrics.calls:
+            st.caption("Chunk calls:")
+            st.dataframe(pd.DataFrame(metrics.calls), hide_index=True)
+
+        runs = [{"run": "upload", **st.session_state.upload_metrics.to_dict()}, {"run": "mapping", **metrics.to_dict()}]
+        json_col, csv_col = st.columns(2)
+        json_col.download_button("Download report (JSON)", report_to_json(runs), "run_report.json", "application/json")
+        csv_col.download_button("Download report (CSV)", report_to_csv(runs), "run_report.csv", "text/csv")
+
+def get_offline_response(target_table_clean_df, source_dfs, incremental=False, use_memory=False, rule_set=None):
+    # Only high-confidence name matches are filled, without any model call
+    metrics = RunMetrics("offline", model_token_prices)
+    st.session_state.run_metrics = metrics
+    previous_df = st.session_state["combined_df"]
+    target_rows_df, carried_df = target_table_clean_df, None
+    if incremental and not previous_df.empty:
+        with timed(metrics, "diff target table"):
+            target_rows_df, carried_df = diff_target_table(target_table_clean_df, previous_df)
+    if use_memory:
+        target_rows_df, carried_df = resolve_from_memory(get_mapping_memory(), target_rows_df, source_dfs, carried_df, metrics)
+    if rule_set is not None:
+        target_rows_df, carried_df = resolve_from_rules(rule_set, target_rows_df, source_dfs, carried_df, metrics)
+
+    with timed(metrics, "offline matching", rows=len(target_rows_df)):
+        combined_df = match_offline(
+            target_rows_df, source_dfs, prematch_min_score, prematch_num_features, source_profile_sample_values
+        )
+    combined_df[origin_column] = "offline match"
+    if carried_df is not None:
+        with timed(metrics, "merge results"):
+            combined_df = merge_incremental_results(target_table_clean_df, carried_df, combined_df)
 
-    with source2_file_col:
-        if len(source2_table_data) > 0 and source2_table_data[0] and source2_table_data[1] and source2_table_data[2]:
-            st.text_input(label="Source2 File", value=source2_table_data[0], disabled=True)
-            info_message = (f"""({source2_table_data[1]} row x {source2_table_data[2]} column)""")
-            st.caption(info_message)
-        else:
-            st.info('Please Upload Source2 File', icon="ℹ️")
+    st.session_state.invalid_chunks = []
+    st.session_state["combined_df"] = combined_df
+    open_job(None)
+    st.rerun()
 
-    target_table_markdowns, target_filename, target_table_data, target_table_clean_df = read_target_file(st, target_table_chunk_size)
+def get_response(source_table_markdowns, target_table_markdowns, target_filename, ai_model_name, model_max_tokens, openai_api_key, target_table_clean_df=None, incremental=False, token_budgeting=False, streaming=False, structured_output=False, resume=False, source_dfs=None, source_table_mode="table", prematch_mode="off", use_memory=False, rule_files=None):
+    error_msg = st.empty()
+    if not all(source_table_markdowns) or (not target_table_markdowns) or (len(target_table_markdowns) == 0):
+        error_msg.write(f"Please upload all {len(source_table_markdowns) + 1} necessary files to continue...")
+        return
+    num_sources = len(source_table_markdowns)
+    # The mapping memory holds mappings of exactly two source tables
+    use_memory = use_memory and num_sources == 2
+    try:
+        rule_set = load_rules(rule_files)
+    except ValueError as e:
+        error_msg.error(str(e), icon="🚨")
+        return
 
-    with target_file_col:
-        if len(target_table_data) > 0 and target_table_data[0] and target_table_data[1] and target_table_data[2]:
-            st.text_input(label="Target File", value=target_table_data[0], disabled=True)
-            info_message = (f"""({target_table_data[1]} row x {target_table_data[2]} column)""")
-            st.caption(info_message)
-        else:
-            st.info('Please Upload a Target File', icon="ℹ️")
+    if prematch_mode == "offline" and not resume:
+        get_offline_response(target_table_clean_df, source_dfs, incremental, use_memory, rule_set)
+        return
 
-    return source1_table_markdown, source2_table_markdown, target_table_markdowns, target_filename, [source1_table_df, source2_table_df, target_table_clean_df]
+    # The job's thread has no Streamlit session, so everything it needs is looked up here
+    rate_limiter = get_rate_limiter(get_api_key_id(openai_api_key))
+    checkpoint_store = get_checkpoint_store()
+    response_cache = get_response_cache()
+    coalescer = get_request_coalescer()
+    mapping_memory = get_mapping_memory() if use_memory else None
+    # Fanned-out requests carry a single source table each
+    qa_chains = {
+        n: get_shared_qa_chain(openai_api_key, ai_model_name, model_max_tokens, structured_output, n)
+        for n in {1, num_sources}
+    }
+    resume_run = get_resume_run() if resume else None
+    previous_df = st.session_state["combined_df"]
+    incremental = incremental and not previous_df.empty
+
+    def map_in_background(job):
+        metrics = RunMetrics(ai_model_name, model_token_prices)
+        job.metrics = metrics
+        run_id = None
+        plan = None
+        target_rows_df = target_table_clean_df
+        # Rows that are not sent to the model (carried over from the last run or remembered)
+        carried_df = None
+
+        def prematch_sources(k, target_chunk_dfs):
+            # Each chunk only sees the source columns most similar to its target columns
+            render_source_table = lambda source_df: source_table_to_markdown(
+                source_df, source_table_mode, source_profile_sample_values, source_profile_sample_rows
+            )
+            with timed(metrics, "prematch source columns"):
+                return prematch_source_markdowns(
+                    source_dfs[k], target_chunk_dfs, render_source_table,
+                    prematch_top_k, prematch_num_features, source_profile_sample_values
+                )
 
-def get_response(source1_table_markdown, source2_table_markdown, target_table_markdowns, target_filename, ai_model_name, model_max_tokens, openai_api_key):
-    error_msg = st.empty()
-    if (not source1_table_markdown) or (source1_table_markdown == "") \
-        or (not source2_table_markdown) or (source2_table_markdown == "") \
-        or (not target_table_markdowns) or (len(target_table_markdowns) == 0):
-        error_msg.write("Please upload all 3 necessary files to continue...")
-        return
+        try:
+            if resume_run is not None:
+                # A resumed run sends exactly the requests of the failed attempt
+                plan = resume_run["plan"]
+                target_rows_df = resume_run["target_rows_df"]
+                carried_df = resume_run["carried_df"]
+            else:
+                if incremental:
+                    # Only new or modified target rows are sent, the rest is carried over from the last run
+                    with timed(metrics, "diff target table"):
+                        target_rows_df, carried_df = diff_target_table(target_table_clean_df, previous_df)
+                if mapping_memory is not None:
+                    target_rows_df, carried_df = resolve_from_memory(
+                        mapping_memory, target_rows_df, source_dfs, carried_df, metrics, notify=job.notify
+                    )
+                if rule_set is not None:
+                    target_rows_df, carried_df = resolve_from_rules(
+                        rule_set, target_rows_df, source_dfs, carried_df, metrics, notify=job.notify
+                    )
 
-    llm_chain = get_qa_chain(openai_api_key, ai_model_name, model_max_tokens)
+                # Pre-matched prompts are much smaller than the planner assumes, so they use fixed chunks
+                with timed(metrics, "plan requests", rows=len(target_rows_df)):
+                    plan = plan_mapping_requests(
+                        target_rows_df,
+                        source_table_markdowns,
+                        ai_model_name,
+                        model_max_tokens,
+                        target_table_chunk_size,
+                        token_budgeting and prematch_mode == "off",
+                        structured_output,
+                        min_target_tokens_per_request,
+                        prematch_sources if prematch_mode == "topk" else None,
+                    )
+                if plan["fan_out"]:
+                    job.notify(f"The {num_sources} source tables do not fit in one request, each is mapped on its own.")
 
-    try:
-        combined_df, progress_bar = process_target_table(
-          source1_table_markdown, source2_table_markdown, target_table_markdowns, 
-          llm_chain, target_table_chunk_size
+            llm_chain = CachedChain(qa_chains[1 if plan["fan_out"] else plan["num_sources"]], response_cache)
+            run_id = get_run_id(
+                ai_model_name, structured_output, *plan["source_table_markdowns"], plan["target_table_markdowns"]
+            )
+            checkpoint_store.start_run(run_id, len(plan["target_table_markdowns"]), resume=resume_run is not None)
+            job.resume_run = {
+                "run_id": run_id,
+                "plan": plan,
+                "target_rows_df": target_rows_df,
+                "carried_df": carried_df,
+            }
+
+            with timed(metrics, "map chunks", chunks=len(plan["target_table_markdowns"])):
+                combined_df, _ = process_target_table(
+                  plan["source_table_markdowns"], plan["target_table_markdowns"],
+                  llm_chain, target_table_chunk_size,
+                  max_workers=llm_max_concurrency,
+                  rate_limiter=rate_limiter,
+                  model_max_tokens=model_max_tokens,
+                  max_retries=llm_max_retries,
+                  progress_callback=job.progress,
+                  # Rows of fanned-out requests only hold one source, so they are shown once merged
+                  rows_callback=job.show_rows if streaming and not plan["fan_out"] else None,
+                  structured_output=structured_output,
+                  max_invalid_retries=llm_max_invalid_retries,
+                  checkpoint_store=checkpoint_store,
+                  run_id=run_id,
+                  metrics=metrics,
+                  coalescer=coalescer,
+                )
+            if plan["fan_out"]:
+                with timed(metrics, "merge source tables"):
+                    combined_df = merge_fan_out_results(target_rows_df, combined_df, plan)
+            combined_df[origin_column] = "model"
+            checkpoint_store.finish_run(run_id)
+            job.resume_run = None
+
+            if carried_df is not None:
+                invalid_chunks = combined_df.attrs.get("invalid_chunks", [])
+                with timed(metrics, "merge results"):
+                    combined_df = merge_incremental_results(target_table_clean_df, carried_df, combined_df)
+                combined_df.attrs["invalid_chunks"] = invalid_chunks
+            return combined_df
+        except ContextWindowError as e:
+            # Raised while planning, before anything was mapped
+            raise JobError(str(e)) from e
+        except Exception as e:
+            # Keep whatever was mapped before the failure, the finished chunks stay checkpointed for "Resume run"
+            partial_df = pd.DataFrame(job.rows)
+            if partial_df.empty and run_id is not None:
+                if plan["fan_out"]:
+                    completed_chunks = checkpoint_store.load_chunks(run_id)
+                    if completed_chunks:
+                        partial_df = merge_fan_out_chunks(target_rows_df, completed_chunks, plan)
+                else:
+                    partial_df = checkpoint_store.load_run(run_id)
+            if not partial_df.empty:
+                partial_df[origin_column] = "model"
+            if not partial_df.empty and carried_df is not None:
+                partial_df = merge_incremental_results(target_table_clean_df, carried_df, partial_df)
+            raise JobError("Sorry, there was an error, please try again", partial_df) from e
+
+    job_id = get_job_runner().submit(f"{target_filename} ({ai_model_name})", map_in_background)
+    st.session_state.job_ids.append(job_id)
+    open_job(job_id)
+    st.rerun()
+
+def open_job(job_id):
+    # The job id is kept in the URL so a reloaded page picks the job back up
+    st.session_state.job_id = job_id
+    st.session_state.loaded_job_id = None
+    if job_id:
+        st.query_params["job"] = job_id
+    elif "job" in st.query_params:
+        del st.query_params["job"]
+
+def get_resume_run():
+    job_id = st.session_state.job_id
+    job = get_job_runner().get(job_id) if job_id else None
+    if job is None or job.resume_run is None:
+        return None
+    job_info = get_job_store().get_job(job_id)
+    return job.resume_run if job_info is not None and job_info["status"] == "failed" else None
+
+def display_job_picker():
+    # Jobs started by this session, plus the one opened from the URL
+    job_ids = st.session_state.job_ids[::-1]
+    if st.session_state.job_id and st.session_state.job_id not in job_ids:
+        job_ids.insert(0, st.session_state.job_id)
+    job_store = get_job_store()
+
+    def format_job(job_id):
+        job_info = job_store.get_job(job_id)
+        return f"{job_id}: {job_info['label']}" if job_info else f"{job_id} (expired)"
+
+    if job_ids:
+        st.session_state.selected_job_id = st.session_state.job_id
+        st.selectbox(
+            "Mapping Jobs",
+            job_ids,
+            format_func=format_job,
+            key="selected_job_id",
+            on_change=lambda: open_job(st.session_state.selected_job_id),
         )
+    st.text_input(
+        "Open a job by id",
+        key="typed_job_id",
+        help="Finished results stay available by job id, also from another browser.",
+        on_change=lambda: open_job(st.session_state.typed_job_id.strip() or None),
+    )
+
+@st.experimental_fragment(run_every=job_poll_seconds)
+def poll_job(job_id):
+    # Only this part of the page reruns while the job is queued or running
+    job_info = get_job_store().get_job(job_id)
+    if job_info is None or job_info["status"] in ("done", "failed"):
+        st.rerun()
+    job = get_job_runner().get(job_id)
+
+    completed, total = job_info["completed_chunks"], job_info["total_chunks"]
+    progress_text = (
+        f"Job {job_id} ({job_info['label']}) is {job_info['status']}: {completed} of {total or '?'} chunks mapped. "
+        "It keeps running if you leave or reload this page."
+    )
+    st.progress(min(1.0, completed / total) if total else 0, text=progress_text)
+    if job is not None:
+        for notice in job.notices:
+            st.info(notice, icon="ℹ️")
+        rows = job.rows
+        if rows:
+            # Only the latest rows are rendered, the full table is shown once the job is done
+            st.caption(f"Mapped rows so far: {len(rows)} (showing the last {min(len(rows), preview_page_size)})")
+            st.dataframe(pd.DataFrame(rows[-preview_page_size:]))
+
+def display_job():
+    job_id = st.session_state.job_id
+    if not job_id:
+        return
+    job_info = get_job_store().get_job(job_id)
+    if job_info is None:
+        st.warning(f"Job {job_id} was not found, it may have expired.", icon="⚠️")
+        open_job(None)
+        return
+    if job_info["status"] in ("queued", "running"):
+        poll_job(job_id)
+        return
 
-        progress_bar.empty()
+    if job_info["status"] == "failed":
+        st.error(job_info["error"], icon="🚨")
+    if st.session_state.loaded_job_id == job_id:
+        return
+    # The result is loaded into the session once, then used like any other mapping result
+    result_df = get_job_store().load_result(job_id)
+    job = get_job_runner().get(job_id)
+    st.session_state["combined_df"] = result_df
+    st.session_state.invalid_chunks = job_info["invalid_chunks"]
+    st.session_state.run_metrics = job.metrics if job is not None else None
+    st.session_state.loaded_job_id = job_id
+    if job_info["status"] == "done" and job_id in st.session_state.job_ids:
         st.balloons()
-        
-        st.session_state["combined_df"] = combined_df
-        st.rerun()
-    except Exception as e:
-        st.error('Sorry, there was an error, please try again', icon="🚨")
-        st.session_state["combined_df"] = pd.DataFrame()
-    
+    elif job_info["status"] == "failed" and not result_df.empty:
+        st.warning(f"Kept the {len(result_df)} rows mapped before the error.", icon="⚠️")
+
 def main():
     genre_name = ["Mapping Generator", "Mapping SQL Code Generator"]
+    sql_dialect_labels = {"ANSI": "ansi", "SQLite": "sqlite", "PostgreSQL": "postgresql", "MySQL": "mysql"}
+    prematch_labels = {"Off": "off", "Top candidates only": "topk", "Offline (no model)": "offline"}
     with st.sidebar:
         genre = st.sidebar.radio(
             "Select Use Case",
             genre_name,
             index=0,
         )
+        source_table_payload = st.sidebar.radio(
+            "Source Table Payload",
+            ["Full Table", "Column Profile"],
+            index=0,
+            horizontal=True,
+            help="Column Profile sends one line per source column (dtype, null %, distinct count, sample values) instead of every source row.",
+        )
+        num_sources = st.sidebar.number_input(
+            "Number of Source Tables",
+            min_value=1,
+            max_value=max_source_tables,
+            value=2,
+            step=1,
+            help="All source tables are mapped in one run into a single wide mapping table. "
+                 "The mapping memory is only used with two source tables.",
+        )
+        prematch_label = st.sidebar.selectbox(
+            "Source Column Pre-matching",
+            list(prematch_labels),
+            index=0,
+            help=f"Top candidates only sends each chunk the {prematch_top_k} most similar source columns per target column. "
+                 "Offline fills only confident name matches locally, without calling the model.",
+        )
+        if genre == genre_name[1]:
+            sql_dialect_label = st.sidebar.selectbox(
+                "SQL Dialect",
+                list(sql_dialect_labels),
+                index=0,
+            )
+        else:
+            sql_dialect_label = list(sql_dialect_labels)[0]
+    source_table_mode = "profile" if source_table_payload == "Column Profile" else "table"
+    sql_dialect = sql_dialect_labels[sql_dialect_label]
+    prematch_mode = prematch_labels[prematch_label]
     st.markdown('<h2 style="text-align:center">Migration Generation AI</h2>', unsafe_allow_html=True)
     st.divider()
 
@@ -122,52 +695,80 @@ def main():
 
     initialize_session_state()
 
-    source1_table_markdown, source2_table_markdown, target_table_markdowns, target_filename, dfs = handle_file_uploads()
+    source_table_markdowns, target_table_markdowns, target_filename, source_dfs, target_table_clean_df = handle_file_uploads(
+        source_table_mode, num_sources
+    )
     
     st.divider()
 
-    process_btn_col, _, download_btn_col = st.columns([1,1,1])
+    display_job()
 
-    if not st.session_state["combined_df"].empty:
-        create_excel_file(
-          st.session_state["combined_df"], st.session_state, excel_title_height, excel_header_height, 
-          excel_data_height, max_header_weight, min_header_weight, target_filename
-        )
+    process_btn_col, resume_btn_col, download_btn_col = st.columns([1,1,1])
 
-        full_sql_script = df_to_sql(
-            st.session_state["combined_df"], 
-            "migration_ai_mapped_data", 
-            drop_existing_table=True
-        )
+    if st.session_state["combined_df"].empty:
+        clear_sql_file()
+    else:
+        if genre == genre_name[0]:
+            prepare_excel_download(st.session_state["combined_df"], target_filename)
 
         if genre == genre_name[1]:
+            sql_file_path = get_sql_file(st.session_state["combined_df"], sql_dialect)
+            # Only the start of the script is rendered, the full script is in the download
+            sql_preview, truncated = read_text_preview(sql_file_path, sql_preview_chars)
+
             st.caption("SQL Script of the Mapped Data:")
             st.text_area(
                 "SQL Script of the Mapped Data:", 
-                full_sql_script, 
+                sql_preview, 
                 label_visibility="collapsed",
                 height=150
             )
-
-        st.caption("Your Mapped Data:")
-        st.dataframe(st.session_state["combined_df"])
-
-        if st.session_state.show_download:
-            with download_btn_col:
-                if genre == genre_name[0]:
-                    download_btn = st.download_button(
-                        label="Download the Data (in Excel)",
-                        data=st.session_state.excel_data,
-                        file_name=st.session_state.download_filename,
-                        mime="application/vnd.ms-excel",
-                    )
-                elif genre == genre_name[1]:
-                    st.download_button(
-                        label="Download the Data (in SQL)",
-                        data=full_sql_script,
-                        file_name='migration_ai_mapped_data_db.sql',
-                        mime='text/plain'
-                    )
+            if truncated:
+                st.caption(
+                    f"Showing the first {sql_preview_chars} characters of the "
+                    f"{os.path.getsize(sql_file_path) / 1024 / 1024:.1f} MB script. Download it for the full script."
+                )
+            if st.button(
+                "Validate SQL in SQLite",
+                help="Runs the script in an in-memory SQLite database and checks every row is inserted. "
+                     "SQLite reads MySQL's backslash escapes literally, so for MySQL only the syntax and row count are checked.",
+            ):
+                display_sql_validation(st.session_state["combined_df"], sql_file_path)
+
+        if st.session_state.invalid_chunks:
+            st.warning(
+                f"The replies for chunk(s) {', '.join(map(str, st.session_state.invalid_chunks))} did not have "
+                "one row per target row, even after retrying. Please review those rows.",
+                icon="⚠️"
+            )
+        display_table_preview("Your Mapped Data:", st.session_state["combined_df"], "combined_preview")
+        if num_sources == 2 and st.button("Save to Mapping Memory", help="Store these mappings as approved so later runs reuse them without the model."):
+            saved = get_mapping_memory().save(st.session_state["combined_df"])
+            st.success(f"Saved {saved} approved mappings to the mapping memory.", icon="✅")
+        display_run_metrics()
+
+        with download_btn_col:
+            if genre == genre_name[0] and st.session_state.show_download:
+                download_btn = st.download_button(
+                    label="Download the Data (in Excel)",
+                    data=st.session_state.excel_data,
+                    file_name=st.session_state.download_filename,
+                    mime="application/vnd.ms-excel",
+                )
+            elif genre == genre_name[1]:
+                # The full script is only read and sent to the browser once it is asked for
+                if st.session_state.sql_download_path != sql_file_path:
+                    if st.button("Prepare SQL Download"):
+                        st.session_state.sql_download_path = sql_file_path
+                        st.rerun()
+                else:
+                    with open(sql_file_path, "rb") as sql_file:
+                        st.download_button(
+                            label="Download the Data (in SQL)",
+                            data=sql_file,
+                            file_name='migration_ai_mapped_data_db.sql',
+                            mime='text/plain'
+                        )
 
     with st.sidebar:
         model_name = st.sidebar.radio(
@@ -177,9 +778,68 @@ def main():
             horizontal=True,
         )
 
+        incremental_mode = st.checkbox(
+            "Incremental re-mapping",
+            value=False,
+            help="Only send new or modified target rows to the model and keep the mappings of the previous run for the rest.",
+        )
+        token_budgeting_mode = st.checkbox(
+            "Token-aware chunking",
+            value=True,
+            help="Pack as many target rows per request as fit in the model's context window instead of a fixed number of rows.",
+        )
+        streaming_mode = st.checkbox(
+            "Stream results",
+            value=True,
+            help="Show mapped rows as soon as the model writes them.",
+        )
+        memory_mode = st.checkbox(
+            "Use mapping memory",
+            value=True,
+            help="Fill target columns from previously approved mappings before anything is sent to the model.",
+        )
+        structured_output_mode = st.checkbox(
+            "Structured output (JSON)",
+            value=False,
+            help="Ask the model for JSON rows instead of a markdown table. Rows are shown once each chunk is complete.",
+        )
+
         st.divider()
         get_openai_api_key()
         display_api_key()
+        display_job_picker()
+
+        cache_stats = get_response_cache().stats()
+        st.caption(
+            f"Response cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses "
+            f"({cache_stats['entries']} cached responses)"
+        )
+        memory_stats = get_mapping_memory().stats()
+        st.caption(f"Mapping memory: {memory_stats['entries']} approved mappings")
+        approved_mapping_file = st.file_uploader(
+            "Import approved mappings",
+            type=["xlsx"],
+            help="An Excel export of this app or a mapping standardization sheet.",
+        )
+        if approved_mapping_file is not None and st.button("Add to Mapping Memory"):
+            try:
+                saved = get_mapping_memory().save(load_approved_mappings(approved_mapping_file))
+                st.success(f"Added {saved} approved mappings.", icon="✅")
+            except ValueError as e:
+                st.error(str(e), icon="🚨")
+        rule_files = st.file_uploader(
+            "Mapping rules",
+            type=["xlsx"],
+            accept_multiple_files=True,
+            help="Mapping standardization and column definition workbooks. Target columns they settle "
+                 "are filled before anything is sent to the model.",
+        )
+        ingest_stats = get_ingest_cache().stats()
+        st.caption(
+            f"Upload cache: {ingest_stats['hits']} hits / {ingest_stats['misses']} misses, "
+            f"{ingest_stats['hit_rate']:.0%} hit rate "
+            f"({ingest_stats['entries']} files, {ingest_stats['bytes'] / 1024 / 1024:.1f} MB)"
+        )
 
         OPENAI_API_KEY_Session = st.session_state.get('OPENAI_API_KEY_Session', "<your OpenAI API key if not set as an env var>")
 
@@ -195,33 +855,46 @@ def main():
             submitted = st.button(
                     "Start Processing Data", 
                     type="primary",
-                    disabled = not OPENAI_API_KEY_Session or not source1_table_markdown or not source2_table_markdown or not target_table_markdowns
+                    disabled = (not OPENAI_API_KEY_Session and prematch_mode != "offline") or not all(source_table_markdowns) or not target_table_markdowns
                     )
-            if submitted:
+            resumed = False
+            with resume_btn_col:
+                if get_resume_run() is not None:
+                    resumed = st.button(
+                        "Resume run",
+                        help="Map only the chunks the last run did not finish.",
+                        disabled=not OPENAI_API_KEY_Session,
+                    )
+            if submitted or resumed:
                 get_response(
-                    source1_table_markdown, 
-                    source2_table_markdown, 
+                    source_table_markdowns, 
                     target_table_markdowns, 
                     target_filename, 
                     ai_model_name_input,
-                    model_max_tokens,
-                    OPENAI_API_KEY_Session
+                    model_max_output_tokens.get(ai_model_name_input, model_max_tokens),
+                    OPENAI_API_KEY_Session,
+                    target_table_clean_df=target_table_clean_df,
+                    incremental=incremental_mode,
+                    token_budgeting=token_budgeting_mode,
+                    streaming=streaming_mode,
+                    structured_output=structured_output_mode,
+                    resume=resumed,
+                    source_dfs=source_dfs,
+                    source_table_mode=source_table_mode,
+                    prematch_mode=prematch_mode,
+                    use_memory=memory_mode,
+                    rule_files=rule_files,
                 )
 
-    if not dfs[0].empty or not dfs[1].empty or not dfs[2].empty:
+    if any(not source_df.empty for source_df in source_dfs) or not target_table_clean_df.empty:
         st.divider()
 
-        if not dfs[0].empty:
-            st.caption("1. Source1 Table Data:")
-            st.dataframe(dfs[0])
-
-        if not dfs[1].empty:
-            st.caption("2. Source2 Table Data:")
-            st.dataframe(dfs[1])
+        for number, source_df in enumerate(source_dfs, start=1):
+            if not source_df.empty:
+                display_table_preview(f"{number}. Source{number} Table Data:", source_df, f"source{number}_preview")
         
-        if not dfs[2].empty:
-            st.caption("3. Target Table Data:")
-            st.dataframe(dfs[2])
+        if not target_table_clean_df.empty:
+            display_table_preview(f"{num_sources + 1}. Target Table Data:", target_table_clean_df, "target_preview")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,107 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+import orjson
+import pandas as pd
+
+
+def get_run_id(*parts):
+    """
+    Build the id of a mapping run from everything that decides its chunk replies
+    (model, output mode, source tables and target chunks), so the same inputs
+    always resume the same run.
+    """
+    return hashlib.sha256(orjson.dumps(parts)).hexdigest()[:16]
+
+
+class CheckpointStore:
+    """
+    Persist the parsed result of every chunk of a mapping run in SQLite as soon as
+    it completes, so a failed run can be resumed without paying for those chunks again.
+
+    Runs untouched for more than `ttl_seconds` are purged when a new run starts.
+
+    Args:
+        checkpoint_dir (str): The directory where the SQLite file is created.
+        ttl_seconds (int): How long the checkpoints of an unfinished run are kept.
+    """
+    def __init__(self, checkpoint_dir, ttl_seconds):
+        os.makedirs(checkpoint_dir, exist_ok=True)
+        self.path = os.path.join(checkpoint_dir, "checkpoints.sqlite3")
+        self.ttl_seconds = ttl_seconds
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                " run_id TEXT PRIMARY KEY,"
+                " total_chunks INTEGER NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                " run_id TEXT NOT NULL,"
+                " chunk_index INTEGER NOT NULL,"
+                " rows BLOB NOT NULL,"
+                " valid INTEGER NOT NULL,"
+                " completed_at REAL NOT NULL,"
+                " PRIMARY KEY (run_id, chunk_index))"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def start_run(self, run_id, total_chunks, resume=False):
+        """
+        Register a run. Unless `resume` is set, the checkpoints of an earlier run
+        with the same id are dropped so every chunk is mapped again.
+        """
+        now = time.time()
+        with self._connect() as conn:
+            expired = "SELECT run_id FROM runs WHERE updated_at < ?"
+            conn.execute(f"DELETE FROM chunks WHERE run_id IN ({expired})", (now - self.ttl_seconds,))
+            conn.execute("DELETE FROM runs WHERE updated_at < ?", (now - self.ttl_seconds,))
+            if not resume:
+                conn.execute("DELETE FROM chunks WHERE run_id = ?", (run_id,))
+            conn.execute(
+                "INSERT OR REPLACE INTO runs (run_id, total_chunks, updated_at) VALUES (?, ?, ?)",
+                (run_id, total_chunks, now),
+            )
+
+    def save_chunk(self, run_id, chunk_index, chunk_df, valid=True):
+        rows = orjson.dumps({"columns": chunk_df.columns.tolist(), "data": chunk_df.values.tolist()})
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO chunks (run_id, chunk_index, rows, valid, completed_at) VALUES (?, ?, ?, ?, ?)",
+                (run_id, chunk_index, rows, int(valid), now),
+            )
+            conn.execute("UPDATE runs SET updated_at = ? WHERE run_id = ?", (now, run_id))
+
+    def load_chunks(self, run_id, valid_only=True):
+        """
+        Returns:
+            dict: The checkpointed chunk DataFrames keyed by chunk index.
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT chunk_index, rows FROM chunks WHERE run_id = ? AND valid >= ? ORDER BY chunk_index",
+                (run_id, int(valid_only)),
+            ).fetchall()
+        chunks = {}
+        for chunk_index, payload in rows:
+            payload = orjson.loads(payload)
+            chunks[chunk_index] = pd.DataFrame(payload["data"], columns=payload["columns"])
+        return chunks
+
+    def load_run(self, run_id, valid_only=True):
+        # All checkpointed chunks are combined with a single concat, in chunk order
+        chunks = self.load_chunks(run_id, valid_only)
+        if not chunks:
+            return pd.DataFrame()
+        return pd.concat(chunks.values(), ignore_index=True)
+
+    def finish_run(self, run_id):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM chunks WHERE run_id = ?", (run_id,))
+            conn.execute("DELETE FROM runs WHERE run_id = ?", (run_id,))
@@ -0,0 +1,68 @@
+import hashlib
+import threading
+from concurrent.futures import Future
+
+from utils.llm_cache import get_cache_key, describe_chain
+
+
+class RequestCoalescer:
+    """
+    Share one LLM request among identical requests in flight at the same time, e.g.
+    several sessions mapping the same workbooks. The first request of a key is sent;
+    the others wait on its future and get the same response.
+
+    A coalescer is meant to be shared by the whole process (see `st.cache_resource`).
+    """
+    def __init__(self):
+        self.in_flight = {}
+        self.shared = 0
+        self.lock = threading.Lock()
+
+    def run(self, key, request):
+        """
+        Call `request()`, unless an identical request is already in flight.
+
+        Returns:
+            tuple: The response and whether it was shared from another request.
+        """
+        with self.lock:
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self.in_flight[key] = Future()
+
+        if not leader:
+            try:
+                res = future.result()
+            except Exception:
+                # The failure may be the other request's own (its API key, its cancelled run)
+                return request(), False
+            with self.lock:
+                self.shared += 1
+            return res, True
+
+        try:
+            res = request()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(res)
+            return res, False
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+
+    def stats(self):
+        with self.lock:
+            return {"in_flight": len(self.in_flight), "shared": self.shared}
+
+
+def get_request_key(chain, input_vars):
+    # The same content hash as the response cache: model, prompt, temperature and inputs
+    return get_cache_key(*describe_chain(chain), input_vars)
+
+
+def get_api_key_id(openai_api_key):
+    # Limits are looked up per API key without keeping the key itself around
+    return hashlib.sha256((openai_api_key or "").encode("utf-8")).hexdigest()[:16]
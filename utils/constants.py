@@ -1,9 +1,85 @@
+import os
 import streamlit as st
 
 target_table_chunk_size = 30
 
 model_max_tokens = 3900
 
+# Token budgeting for dynamic target chunk sizing
+model_context_windows = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4o": 128000,
+}
+model_max_output_tokens = {
+    "gpt-3.5-turbo": 4096,
+    "gpt-4o": 16384,
+}
+# Tokens the model adds to each reply row per source table (its column name and mapping)
+mapping_tokens_per_source = 20
+max_target_rows_per_chunk = 300
+
+# Source tables of a single run; past the context window the requests fan out per source table
+max_source_tables = 8
+min_target_tokens_per_request = 2000
+
+# Column profiles sent instead of the full source tables in "profile" mode
+source_profile_sample_values = 3
+source_profile_sample_rows = 10000
+
+# Memory cap of the in-process cache of parsed uploads
+ingest_cache_max_bytes = 512 * 1024 * 1024
+
+# Concurrent chunk dispatch and OpenAI rate limits
+llm_max_concurrency = 4
+# Requests in flight at once per API key, across every session of the app
+llm_max_concurrency_per_api_key = 8
+llm_requests_per_minute = 500
+llm_tokens_per_minute = 60000
+llm_max_retries = 5
+# Extra requests for a chunk whose reply does not have one row per target row
+llm_max_invalid_retries = 2
+
+# USD per million (input, output) tokens, used to estimate the cost of a run
+model_token_prices = {
+    "gpt-3.5-turbo": (0.5, 1.5),
+    "gpt-4o": (5.0, 15.0),
+}
+
+# On-disk cache of LLM responses
+llm_cache_dir = os.environ.get("MIGRATION_AI_CACHE_DIR", os.path.join(".cache", "migration_ai"))
+llm_cache_ttl_seconds = 30 * 24 * 60 * 60
+llm_cache_max_entries = 5000
+
+# Local pre-matching of target columns against source columns (hashed character n-gram TF-IDF)
+prematch_top_k = 5
+prematch_min_score = 0.9
+prematch_num_features = 4096
+
+# Approved mappings reused across projects, kept outside the cache directory so clearing it keeps them
+mapping_memory_dir = os.environ.get("MIGRATION_AI_MEMORY_DIR", "mapping_memory")
+mapping_memory_fuzzy_min_score = 0.85
+
+# Per-chunk checkpoints of mapping runs, kept until the run finishes or expires
+checkpoint_dir = os.path.join(llm_cache_dir, "runs")
+checkpoint_ttl_seconds = 7 * 24 * 60 * 60
+
+# Background mapping jobs: runs in parallel, failed runs kept resumable, seconds between status polls, and how long results are kept
+jobs_dir = os.path.join(llm_cache_dir, "jobs")
+job_max_workers = 4
+job_max_resumable = 20
+job_poll_seconds = 1
+job_ttl_seconds = 7 * 24 * 60 * 60
+
+# Rows per INSERT statement in the generated SQL script
+sql_rows_per_insert = 500
+
+# Table previews only render one page of rows, and the SQL preview only the start of the script
+preview_page_size = 100
+sql_preview_chars = 20000
+
+# Build the Excel download with openpyxl's write-only mode and shared named styles
+excel_fast_export = True
+
 excel_title_height = 40
 excel_header_height = 20
 excel_data_height = 20
@@ -1,6 +1,14 @@
 import sqlite3
+import time
+
+import numpy as np
 import pandas as pd
 
+sql_dialects = ["ansi", "sqlite", "postgresql", "mysql"]
+# The original output (unquoted table name, backslash escaping, no NULLs), kept as the default for
+# existing callers but not offered as a dialect since neither MySQL nor SQLite accepts all of it
+legacy_dialect = "legacy"
+
 def clean_string(text):
     """
     Clean the input string by replacing characters that may cause problems in SQL queries.
@@ -15,70 +23,262 @@ def clean_string(text):
     cleaned_text = text.replace("\\", "\\\\").replace("'", "\\'")
     return cleaned_text
 
-def df_to_sql(df, table_name, drop_existing_table=False):
+def sql_values_column(values):
+    """
+    Render one DataFrame column as SQL literals, the same way `clean_string` is applied
+    cell by cell: strings are escaped and quoted, everything else is escaped unquoted.
+    """
+    column = pd.Series(values).astype(object)
+    inferred_type = pd.api.types.infer_dtype(column, skipna=False)
+    if inferred_type == "string":
+        is_string = pd.Series(True, index=column.index)
+    else:
+        is_string = column.map(lambda x: isinstance(x, str))
+    if inferred_type in ("bytes", "mixed"):
+        # astype(str) decodes bytes instead of returning their repr
+        text = column.map(str)
+    else:
+        text = column.astype(str)
+    text = text.str.replace("\\", "\\\\", regex=False).str.replace("'", "\\'", regex=False)
+    return text.where(~is_string, "'" + text + "'")
+
+def get_standard_literal_kind(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return "null"
+    if isinstance(value, (bool, np.bool_)):
+        return "bool"
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return "number" if np.isfinite(value) else "null"
+    return "string"
+
+def standard_sql_values_column(values, escape_backslashes=False):
     """
-    Convert a pandas DataFrame to SQL commands for creating a table and inserting data,
-    then execute these commands to test them.
+    Render one DataFrame column as standard SQL literals: strings (and dates) are quoted
+    with embedded quotes doubled, missing and non-finite values become NULL. MySQL also
+    reads backslashes in strings as escapes, so `escape_backslashes` doubles them.
+    """
+    column = pd.Series(values).astype(object)
+    inferred_type = pd.api.types.infer_dtype(column, skipna=True)
+    if inferred_type == "string":
+        kinds = pd.Series("string", index=column.index).where(column.notna(), "null")
+    else:
+        kinds = column.map(get_standard_literal_kind)
+
+    if inferred_type in ("bytes", "mixed"):
+        text = column.map(str)
+    else:
+        text = column.astype(str)
+    escaped = text.str.replace("\\", "\\\\", regex=False) if escape_backslashes else text
+    quoted = "'" + escaped.str.replace("'", "''", regex=False) + "'"
+
+    literals = text.where(kinds == "number", quoted)
+    literals = literals.where(kinds != "bool", np.where(text == "True", "TRUE", "FALSE"))
+    return literals.where(kinds != "null", "NULL")
+
+def quote_identifier(name, dialect):
+    if dialect == legacy_dialect:
+        return f'"{name}"'
+    if dialect == "mysql":
+        return "`" + str(name).replace("`", "``") + "`"
+    return '"' + str(name).replace('"', '""') + '"'
+
+def get_sql_type(df, col, dtype, dialect):
+    if dtype == 'int64':
+        return 'INTEGER'
+    elif dtype == 'float64':
+        return 'REAL'
+    elif dtype == 'bool':
+        return 'BOOLEAN'
+    elif dialect == legacy_dialect:
+        return 'TEXT'
+
+    # Object columns holding booleans or numbers plus missing values
+    values = pd.Series(df[col].to_numpy()).astype(object)
+    inferred_type = pd.api.types.infer_dtype(values, skipna=True)
+    if inferred_type == "boolean":
+        return 'BOOLEAN'
+    elif inferred_type == "integer":
+        return 'INTEGER'
+    elif inferred_type in ("floating", "mixed-integer-float", "decimal"):
+        return 'REAL'
+    elif dialect == "ansi":
+        # Standard SQL has no unbounded TEXT type, so size it on the rendered values
+        max_length = values.dropna().astype(str).str.len().max()
+        return f'VARCHAR({max(1, 0 if pd.isna(max_length) else int(max_length))})'
+    return 'TEXT'
+
+def sql_values_rows(df, dialect=legacy_dialect):
+    # iterrows() builds each row from df.values, so cells are cast from there the same way
+    values = df.values
+    if dialect == legacy_dialect:
+        cells = [sql_values_column(values[:, i]) for i in range(values.shape[1])]
+    else:
+        cells = [standard_sql_values_column(values[:, i], dialect == "mysql") for i in range(values.shape[1])]
+    return "    (" + cells[0].str.cat(cells[1:], sep=", ") + ")"
+
+def iter_sql_script(df, table_name, drop_existing_table=False, rows_per_insert=None, dialect=legacy_dialect):
+    """
+    Generate the SQL script for a pandas DataFrame piece by piece, so it can be written
+    to a file or a download stream without holding the whole script in memory.
 
     Args:
         df (pandas.DataFrame): The DataFrame to be converted to SQL.
         table_name (str): The name of the table to be created.
         drop_existing_table (bool, optional): If True, drop the existing table before creating a new one.
+        rows_per_insert (int, optional): The number of rows per INSERT statement. By default all rows
+            go into a single statement.
+        dialect (str, optional): One of `sql_dialects`, or `legacy_dialect` for the original output.
+            The dialects double embedded quotes and write missing values as NULL; "mysql" quotes
+            identifiers with backticks and also escapes backslashes.
 
-    Returns:
-        str: SQL commands as a string.
+    Yields:
+        str: Consecutive parts of the SQL script.
 
     Raises:
         ValueError: If the DataFrame is empty or has no columns.
     """
     if df.empty or len(df.columns) == 0:
         raise ValueError("The DataFrame is empty or has no columns.")
+    if dialect not in sql_dialects and dialect != legacy_dialect:
+        raise ValueError(f"Unsupported SQL dialect: {dialect}")
 
-    # SQL commands for database and table creation
-    sql_commands = []
+    if dialect != legacy_dialect:
+        table_name = quote_identifier(table_name, dialect)
 
     # Drop existing table if specified
     if drop_existing_table:
-        sql_commands.append("-- Drop the table if it already exists to avoid duplication errors")
-        sql_commands.append(f"DROP TABLE IF EXISTS {table_name};\n")
+        yield "-- Drop the table if it already exists to avoid duplication errors\n"
+        yield f"DROP TABLE IF EXISTS {table_name};\n\n"
 
     # Start with the CREATE TABLE command
     create_table = "-- Create a new table\n"
     create_table += f"CREATE TABLE {table_name} (\n"
     columns = []
     for col, dtype in zip(df.columns, df.dtypes):
-        # Clean column names to avoid problematic characters
-        if dtype == 'int64':
-            sql_type = 'INTEGER'
-        elif dtype == 'float64':
-            sql_type = 'REAL'
-        elif dtype == 'bool':
-            sql_type = 'BOOLEAN'
-        else:
-            sql_type = 'TEXT'
-        columns.append(f'    "{col}" {sql_type} NOT NULL')
+        sql_type = get_sql_type(df, col, dtype, dialect)
+        # Standard dialects write missing values as NULL, so only complete columns are NOT NULL
+        not_null = dialect == legacy_dialect or not df[col].isna().any()
+        columns.append(f'    {quote_identifier(col, dialect)} {sql_type}{" NOT NULL" if not_null else ""}')
     create_table += ',\n'.join(columns) + "\n);\n"
-    sql_commands.append(create_table)
+    yield create_table + "\n"
 
     # Add a comment before the INSERT INTO command
-    sql_commands.append("-- Insert records into the table")
-
-    # Now the INSERT INTO commands
-    column_names = ', '.join(f'\"{col}\"' for col in df.columns)
-    insert_into = f"INSERT INTO {table_name} ({column_names}) VALUES\n"
-    values_list = []
-    for _, row in df.iterrows():
-        values = ', '.join([f"'{clean_string(x)}'" if isinstance(x, str) else clean_string(str(x)) for x in row])
-        values_list.append(f"    ({values})")
-    insert_into += ',\n'.join(values_list) + ";\n"
-    sql_commands.append(insert_into)
+    yield "-- Insert records into the table\n"
+
+    # Now the INSERT INTO commands, one statement per batch of rows
+    column_names = ', '.join(quote_identifier(col, dialect) for col in df.columns)
+    batch_size = rows_per_insert or len(df)
+    for start in range(0, len(df), batch_size):
+        values_list = sql_values_rows(df.iloc[start:start + batch_size], dialect)
+        yield f"INSERT INTO {table_name} ({column_names}) VALUES\n"
+        yield ',\n'.join(values_list.tolist()) + ";\n\n"
 
     # Add a comment before the SELECT command
-    sql_commands.append("-- Select all records from the table to verify insertion")
-    sql_commands.append(f"SELECT * FROM {table_name};")
+    yield "-- Select all records from the table to verify insertion\n"
+    yield f"SELECT * FROM {table_name};"
+
+def write_sql_file(df, table_name, file, drop_existing_table=False, rows_per_insert=None, dialect=legacy_dialect):
+    """
+    Stream the SQL script of a pandas DataFrame into a text file object.
+
+    Returns:
+        int: The number of characters written.
+    """
+    written = 0
+    for part in iter_sql_script(df, table_name, drop_existing_table, rows_per_insert, dialect):
+        written += file.write(part)
+    return written
+
+def df_to_sql(df, table_name, drop_existing_table=False, rows_per_insert=None, dialect=legacy_dialect):
+    """
+    Convert a pandas DataFrame to SQL commands for creating a table and inserting data.
+
+    Args:
+        df (pandas.DataFrame): The DataFrame to be converted to SQL.
+        table_name (str): The name of the table to be created.
+        drop_existing_table (bool, optional): If True, drop the existing table before creating a new one.
+        rows_per_insert (int, optional): The number of rows per INSERT statement.
+        dialect (str, optional): One of `sql_dialects`, or `legacy_dialect`.
+
+    Returns:
+        str: SQL commands as a string.
+
+    Raises:
+        ValueError: If the DataFrame is empty or has no columns.
+    """
+    return "".join(iter_sql_script(df, table_name, drop_existing_table, rows_per_insert, dialect))
+
+def iter_sql_statements(sql_parts):
+    # Split on complete statements only, so string literals spanning lines stay intact
+    statement = []
+    for part in sql_parts:
+        for line in part.splitlines(keepends=True):
+            statement.append(line)
+            if line.rstrip().endswith(";") and sqlite3.complete_statement("".join(statement)):
+                yield "".join(statement)
+                statement = []
+    if "".join(statement).strip():
+        yield "".join(statement)
+
+def validate_sql_script(df, table_name, sql_parts):
+    """
+    Run a generated SQL script against an in-memory SQLite database in a single
+    transaction and check the inserted row count matches the DataFrame.
+
+    Args:
+        df (pandas.DataFrame): The DataFrame the script was generated from.
+        table_name (str): The (unquoted) name of the table the script creates.
+        sql_parts (iterable of str): The script, e.g. from `iter_sql_script` or an open file.
+
+    Returns:
+        dict: The validation report with "ok", "statements", "expected_rows", "inserted_rows",
+        "parse_seconds", "execute_seconds", "error" and "failing_statement".
+    """
+    report = {
+        "ok": False,
+        "statements": 0,
+        "expected_rows": len(df),
+        "inserted_rows": 0,
+        "parse_seconds": 0.0,
+        "execute_seconds": 0.0,
+        "error": "",
+        "failing_statement": "",
+    }
+    conn = sqlite3.connect(":memory:", isolation_level=None)
+    try:
+        conn.execute("BEGIN")
+        statements = iter_sql_statements(sql_parts)
+        while True:
+            started_at = time.perf_counter()
+            statement = next(statements, None)
+            report["parse_seconds"] += time.perf_counter() - started_at
+            if statement is None:
+                break
 
-    # Combine all SQL commands into one script
-    full_sql_script = '\n'.join(sql_commands)
+            started_at = time.perf_counter()
+            try:
+                conn.execute(statement)
+            except sqlite3.Error as e:
+                report["error"] = str(e)
+                report["failing_statement"] = statement[:2000]
+                conn.execute("ROLLBACK")
+                return report
+            finally:
+                report["execute_seconds"] += time.perf_counter() - started_at
+            report["statements"] += 1
 
-    # Return the SQL commands as a string
-    return full_sql_script
+        (report["inserted_rows"],) = conn.execute(
+            f"SELECT COUNT(*) FROM {quote_identifier(table_name, 'sqlite')}"
+        ).fetchone()
+        conn.execute("ROLLBACK")
+        report["ok"] = report["inserted_rows"] == report["expected_rows"]
+        if not report["ok"]:
+            report["error"] = (
+                f"Row count mismatch: expected {report['expected_rows']} rows, "
+                f"the script inserted {report['inserted_rows']}."
+            )
+    except sqlite3.Error as e:
+        report["error"] = str(e)
+    finally:
+        conn.close()
+    return report
@@ -2,77 +2,136 @@ import pandas as pd
 import numpy as np
 import streamlit as st
 
+from utils.profiling import profile_dataframe
+from utils.ingestion import read_table, table_formats
+from utils.ingest_cache import get_upload_key
+from utils.telemetry import timed
+
+ordinal_words = ["first", "second", "third", "fourth", "fifth", "sixth", "seventh", "eighth"]
+
 def split_dataframe(df, chunk_size):
     return [df.iloc[i:i + chunk_size] for i in range(0, len(df), chunk_size)]
 
+def get_dataframe_fingerprint(df):
+    # Cheap content hash used to tell whether derived outputs need rebuilding
+    column_hashes = pd.util.hash_pandas_object(pd.Series(df.columns.astype(str)), index=False).to_numpy()
+    row_hashes = pd.util.hash_pandas_object(df, index=True).to_numpy()
+    return f"{int(column_hashes.sum())}-{len(df)}-{int(row_hashes.sum())}"
+
+def stringify_column(column):
+    # Same as str(x) per cell, but done with a single pandas cast for the whole column
+    if pd.api.types.infer_dtype(column, skipna=False) in ("bytes", "mixed"):
+        # astype(str) decodes bytes instead of returning their repr
+        return column.map(str)
+    return column.astype(str)
+
 def df_to_markdown(df):
     df = df.replace(np.nan, '', regex=True)
     header = "| " + " | ".join(df.columns) + " |"
     separator = "|---" * len(df.columns) + "|"
-    rows = []
-    for _, row in df.iterrows():
-        formatted_row = "| " + " | ".join(str(x) if x != 'nan' else '-' for x in row) + " |"
-        rows.append(formatted_row)
-    return "\n".join([header, separator] + rows)
+    if len(df) == 0:
+        return "\n".join([header, separator])
+    if len(df.columns) == 0:
+        return "\n".join([header, separator] + ["|  |"] * len(df))
 
-def read_source1_file(st):
-    source_file_uploaded = st.sidebar.file_uploader(
-        "Step 1: Upload your first TPA Excel/CSV data file.", 
-        type=['csv','xlsx'],
-        accept_multiple_files=False,
-        key="source1FileUploader"
+    # iterrows() builds each row from df.values, so cells are cast from there the same way
+    values = df.values
+    cells = []
+    for i in range(values.shape[1]):
+        column = pd.Series(values[:, i]).astype(object)
+        cells.append(stringify_column(column).where(column != 'nan', '-'))
+
+    rows = "| " + cells[0].str.cat(cells[1:], sep=" | ") + " |"
+    return "\n".join([header, separator] + rows.tolist())
+
+def source_table_to_markdown(source_table_df, source_table_mode="table", profile_sample_values=3, profile_sample_rows=None):
+    if source_table_mode == "profile":
+        return df_to_markdown(profile_dataframe(source_table_df, profile_sample_values, profile_sample_rows))
+    return df_to_markdown(source_table_df)
+
+def load_source_table(source_file, source_table_mode="table", profile_sample_values=3, profile_sample_rows=None):
+    # A profile only needs the first rows, so large extracts are not read in full
+    nrows = profile_sample_rows if source_table_mode == "profile" and profile_sample_rows else None
+    source_table_df = read_table(source_file, nrows)
+    source_table_markdown = source_table_to_markdown(
+        source_table_df, source_table_mode, profile_sample_values, profile_sample_rows
     )
-    if source_file_uploaded is not None:
-        source_table_df = pd.read_excel(source_file_uploaded)
-        file_name = source_file_uploaded.name
+    return source_table_markdown, source_table_df
 
-        num_rows, num_columns = source_table_df.shape
-        
+def load_target_table(target_file, target_table_chunk_size, num_sources=2):
+    target_table_df = read_table(target_file)
 
-        return df_to_markdown(source_table_df), [file_name, num_rows, num_columns], source_table_df
-    else:
-        return "", [], pd.DataFrame()
+    # Extracting the necessary columns and adding new columns for mappings
+    target_table_clean_df = target_table_df[['Target Column Name', 'Target Column DataType']].copy()
+    for number in range(1, num_sources + 1):
+        target_table_clean_df[f'Source{number} Column Name'] = np.nan
+        target_table_clean_df[f'Source{number} Mapping'] = np.nan
+    target_table_chunks = split_dataframe(target_table_clean_df, target_table_chunk_size)
+
+    return [df_to_markdown(chunk) for chunk in target_table_chunks], target_table_df.shape, target_table_clean_df
 
-def read_source2_file(st):
+def read_source_file(st, label, key, source_table_mode, profile_sample_values, profile_sample_rows, cache, metrics=None):
     source_file_uploaded = st.sidebar.file_uploader(
-        "Step 2: Upload your second TPA Excel/CSV data file.", 
-        type=['csv','xlsx'],
+        label, 
+        type=table_formats,
         accept_multiple_files=False,
-        key="source2FileUploader"
+        key=key
     )
     if source_file_uploaded is not None:
-        source_table_df = pd.read_excel(source_file_uploaded)
+        def load():
+            # Only timed when the upload is actually parsed, not on cache hits
+            with timed(metrics, f"read {key.replace('FileUploader', '')}"):
+                return load_source_table(
+                    source_file_uploaded, source_table_mode, profile_sample_values, profile_sample_rows
+                )
+
+        if cache is not None:
+            cache_key = get_upload_key(
+                source_file_uploaded, "source", source_table_mode, profile_sample_values, profile_sample_rows
+            )
+            source_table_markdown, source_table_df = cache.get_or_load(cache_key, load)
+        else:
+            source_table_markdown, source_table_df = load()
         file_name = source_file_uploaded.name
 
-        num_rows, num_columns = source_table_df.shape
-        
+        num_rows = source_table_df.attrs.get("total_rows", len(source_table_df))
+        if not source_table_df.attrs.get("total_rows_exact", True):
+            num_rows = f"about {num_rows}"
+        num_columns = source_table_df.shape[1]
 
-        return df_to_markdown(source_table_df), [file_name, num_rows, num_columns], source_table_df
+        return source_table_markdown, [file_name, num_rows, num_columns], source_table_df
     else:
         return "", [], pd.DataFrame()
 
-def read_target_file(st, target_table_chunk_size):
+def read_numbered_source_file(st, number, source_table_mode="table", profile_sample_values=3, profile_sample_rows=None, cache=None, metrics=None):
+    ordinal = ordinal_words[number - 1] if number <= len(ordinal_words) else f"#{number}"
+    return read_source_file(
+        st, f"Step {number}: Upload your {ordinal} TPA Excel/CSV/Parquet data file.", f"source{number}FileUploader",
+        source_table_mode, profile_sample_values, profile_sample_rows, cache, metrics
+    )
+
+def read_target_file(st, target_table_chunk_size, cache=None, metrics=None, num_sources=2):
     target_file_uploaded = st.sidebar.file_uploader(
-        "Step 3: Upload your target Excel/CSV file.", 
-        type=['csv','xlsx'],
+        f"Step {num_sources + 1}: Upload your target Excel/CSV/Parquet file.", 
+        type=table_formats,
         accept_multiple_files=False,
         key="targetFileUploader"
     )
     if target_file_uploaded is not None:
-        target_table_df = pd.read_excel(target_file_uploaded)
+        def load():
+            with timed(metrics, "read target"):
+                return load_target_table(target_file_uploaded, target_table_chunk_size, num_sources)
+
+        if cache is not None:
+            cache_key = get_upload_key(target_file_uploaded, "target", target_table_chunk_size, num_sources)
+            target_table_markdowns, target_table_shape, target_table_clean_df = cache.get_or_load(cache_key, load)
+        else:
+            target_table_markdowns, target_table_shape, target_table_clean_df = load()
         file_name = target_file_uploaded.name
         
         # Get the number of rows and columns
-        num_rows, num_columns = target_table_df.shape
-
-        # Extracting the necessary columns and adding new columns for mappings
-        target_table_clean_df = target_table_df[['Target Column Name', 'Target Column DataType']].copy()
-        target_table_clean_df['Source1 Column Name'] = np.nan
-        target_table_clean_df['Source1 Mapping'] = np.nan
-        target_table_clean_df['Source2 Column Name'] = np.nan
-        target_table_clean_df['Source2 Mapping'] = np.nan
-        target_table_chunks = split_dataframe(target_table_clean_df, target_table_chunk_size)
+        num_rows, num_columns = target_table_shape
         
-        return [df_to_markdown(chunk) for chunk in target_table_chunks], file_name, [file_name, num_rows, num_columns], target_table_clean_df
+        return target_table_markdowns, file_name, [file_name, num_rows, num_columns], target_table_clean_df
     else:
-        return [], "", [], pd.DataFrame()
\ No newline at end of file
+        return [], "", [], pd.DataFrame()
@@ -0,0 +1,50 @@
+import pandas as pd
+
+key_columns = ['Target Column Name', 'Target Column DataType']
+
+def get_row_keys(df):
+    # Normalise whitespace so a reformatted workbook does not count as an edit
+    return (
+        df[key_columns[0]].astype(str).str.strip()
+        + "\x1f"
+        + df[key_columns[1]].astype(str).str.strip().str.lower()
+    )
+
+def diff_target_table(target_table_clean_df, previous_df):
+    """
+    Compare the uploaded target table with the mappings of the previous run.
+
+    Args:
+        target_table_clean_df (pandas.DataFrame): The target table as returned by `read_target_file`.
+        previous_df (pandas.DataFrame): The `combined_df` of the previous run.
+
+    Returns:
+        tuple: The target rows that are new or modified, and the previous mappings that
+        can be carried over unchanged.
+    """
+    if previous_df.empty:
+        return target_table_clean_df, previous_df
+
+    target_keys = get_row_keys(target_table_clean_df)
+    previous_keys = get_row_keys(previous_df)
+
+    changed_df = target_table_clean_df[~target_keys.isin(previous_keys)]
+    carried_mask = previous_keys.isin(target_keys) & ~previous_keys.duplicated()
+    carried_df = previous_df[carried_mask.values]
+    return changed_df, carried_df
+
+def merge_incremental_results(target_table_clean_df, carried_df, mapped_df):
+    """
+    Merge the carried-over mappings with the freshly mapped rows, in target table order.
+    Rows the model returned under a name that is not in the target table are kept at the end.
+    """
+    combined_df = pd.concat([carried_df, mapped_df], ignore_index=True)
+    if combined_df.empty:
+        return combined_df
+
+    target_keys = get_row_keys(target_table_clean_df)
+    positions = pd.Series(range(len(target_keys)), index=target_keys.values)
+    positions = positions[~positions.index.duplicated()]
+    order = get_row_keys(combined_df).map(positions).fillna(len(target_keys))
+
+    return combined_df.iloc[order.argsort(kind="stable")].reset_index(drop=True)
@@ -0,0 +1,213 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from openpyxl import load_workbook
+
+table_formats = ["csv", "xlsx", "parquet"]
+# Rows of a workbook turned into a DataFrame at once while streaming it
+xlsx_block_rows = 50000
+# Bytes read at once when counting the lines of a CSV file
+csv_count_block_bytes = 16 * 1024 * 1024
+
+def get_file_name(table_file):
+    return table_file if isinstance(table_file, (str, os.PathLike)) else getattr(table_file, "name", "")
+
+def get_table_format(table_file):
+    """
+    Detect the format of a path or uploaded file from its extension, falling back
+    to its first bytes (xlsx files are zip archives, Parquet files start with PAR1).
+
+    Returns:
+        str: One of `table_formats`.
+    """
+    extension = os.path.splitext(str(get_file_name(table_file)))[1].lower().lstrip(".")
+    if extension in ("xlsx", "xlsm"):
+        return "xlsx"
+    if extension in ("csv", "parquet"):
+        return extension
+    if isinstance(table_file, (str, os.PathLike)):
+        with open(table_file, "rb") as file:
+            magic = file.read(4)
+    else:
+        table_file.seek(0)
+        magic = table_file.read(4)
+        table_file.seek(0)
+    if magic.startswith(b"PK"):
+        return "xlsx"
+    if magic == b"PAR1":
+        return "parquet"
+    return "csv"
+
+def rewind(table_file):
+    # Uploads may already have been read (hashed, sniffed) before they are parsed
+    if hasattr(table_file, "seek"):
+        table_file.seek(0)
+    return table_file
+
+def convert_xlsx_cell(value):
+    # Same conversions as pandas.read_excel: whole floats become ints, blanks become NaN
+    if value is None or value == "":
+        return np.nan
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def xlsx_block_to_frame(rows, header):
+    block_df = pd.DataFrame([[convert_xlsx_cell(value) for value in row] for row in rows], columns=header)
+    return block_df.infer_objects()
+
+def convert_numeric_text(table_df):
+    # pandas.read_excel parses text cells that all hold numbers ("000123") as numbers
+    for col in table_df.columns[table_df.dtypes == object]:
+        if pd.api.types.infer_dtype(table_df[col], skipna=True) != "string":
+            continue
+        try:
+            table_df[col] = pd.to_numeric(table_df[col])
+        except (ValueError, TypeError):
+            pass
+    return table_df
+
+def get_unique_header(header):
+    # Repeated names get a ".1", ".2" suffix, like pandas.read_excel does
+    seen = {}
+    unique_header = []
+    for name in header:
+        name = str(name) if name is not None else f"Unnamed: {len(unique_header)}"
+        count = seen.get(name, 0)
+        seen[name] = count + 1
+        unique_header.append(f"{name}.{count}" if count else name)
+    return unique_header
+
+def read_xlsx(table_file, nrows=None):
+    """
+    Stream the first sheet of a workbook in openpyxl's read-only mode, building the
+    DataFrame block by block so only `xlsx_block_rows` rows of cells are held as
+    Python objects at a time.
+    """
+    workbook = load_workbook(rewind(table_file), read_only=True, data_only=True, keep_links=False)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return pd.DataFrame()
+        header = get_unique_header(header)
+
+        block_dfs, block = [], []
+        for count, row in enumerate(rows):
+            if nrows is not None and count >= nrows:
+                break
+            # Read-only sheets do not pad short rows
+            block.append(row + (None,) * (len(header) - len(row)) if len(row) < len(header) else row[:len(header)])
+            if len(block) == xlsx_block_rows:
+                block_dfs.append(xlsx_block_to_frame(block, header))
+                block = []
+        if block or not block_dfs:
+            block_dfs.append(xlsx_block_to_frame(block, header))
+    finally:
+        workbook.close()
+
+    # Trailing blank rows are dropped like pandas.read_excel does, then the dtypes they hid are restored
+    table_df = pd.concat(block_dfs, ignore_index=True) if len(block_dfs) > 1 else block_dfs[0]
+    not_blank = np.flatnonzero(table_df.notna().any(axis=1).to_numpy())
+    last_row = not_blank[-1] + 1 if len(not_blank) else 0
+    if last_row < len(table_df):
+        table_df = table_df.iloc[:last_row].infer_objects()
+    return convert_numeric_text(table_df)
+
+def read_csv(table_file, nrows=None):
+    """
+    Parse a CSV file with pyarrow. A head read stops at the first record batches
+    holding `nrows` rows instead of parsing the whole file.
+    """
+    # Empty strings are read as missing, like pandas.read_csv does
+    convert_options = pa_csv.ConvertOptions(strings_can_be_null=True)
+    if nrows is None:
+        return pa_csv.read_csv(rewind(table_file), convert_options=convert_options).to_pandas()
+
+    reader = pa_csv.open_csv(rewind(table_file), convert_options=convert_options)
+    batches, count = [], 0
+    for batch in reader:
+        batches.append(batch)
+        count += batch.num_rows
+        if count >= nrows:
+            break
+    return pa.Table.from_batches(batches, schema=reader.schema).slice(0, nrows).to_pandas()
+
+def read_parquet(table_file, nrows=None):
+    if nrows is None:
+        return pd.read_parquet(rewind(table_file), engine="pyarrow")
+    parquet_file = pq.ParquetFile(rewind(table_file))
+    batch = next(parquet_file.iter_batches(batch_size=max(1, nrows)), None)
+    if batch is None:
+        return parquet_file.schema_arrow.empty_table().to_pandas()
+    return batch.to_pandas()
+
+def count_table_rows(table_file, table_format):
+    """
+    Count the data rows of a table without loading it: from the Parquet metadata,
+    the workbook's dimensions, or the line breaks of a CSV file.
+
+    Returns:
+        tuple: The row count (None when it cannot be told cheaply) and whether it is exact.
+        Workbook dimensions also count blank or only formatted rows at the end, and CSV
+        line breaks those inside quoted values, so both are approximate.
+    """
+    if table_format == "parquet":
+        return pq.ParquetFile(rewind(table_file)).metadata.num_rows, True
+    if table_format == "xlsx":
+        workbook = load_workbook(rewind(table_file), read_only=True, data_only=True, keep_links=False)
+        try:
+            max_row = workbook.worksheets[0].max_row
+        finally:
+            workbook.close()
+        return (max_row - 1 if max_row else None), False
+
+    if isinstance(table_file, (str, os.PathLike)):
+        file = open(table_file, "rb")
+    else:
+        file = rewind(table_file)
+    try:
+        lines, last = 0, b"\n"
+        while True:
+            block = file.read(csv_count_block_bytes)
+            if not block:
+                break
+            lines += block.count(b"\n")
+            last = block[-1:]
+    finally:
+        if isinstance(table_file, (str, os.PathLike)):
+            file.close()
+        else:
+            rewind(table_file)
+    return max(0, lines + (last != b"\n") - 1), False
+
+def read_table(table_file, nrows=None):
+    """
+    Read a CSV, xlsx or Parquet table from a path or an uploaded file.
+
+    Args:
+        table_file (str or file): The path or file-like object (with a `name` when uploaded).
+        nrows (int, optional): Read only the header and the first `nrows` rows.
+
+    Returns:
+        pandas.DataFrame: The table. With `nrows`, `attrs["total_rows"]` holds the row
+        count of the whole table when it can be told without reading it, and
+        `attrs["total_rows_exact"]` whether that count is exact.
+    """
+    table_format = get_table_format(table_file)
+    reader = {"csv": read_csv, "xlsx": read_xlsx, "parquet": read_parquet}[table_format]
+    table_df = reader(table_file, nrows)
+    if nrows is not None:
+        if len(table_df) < nrows:
+            total_rows, exact = len(table_df), True
+        else:
+            total_rows, exact = count_table_rows(table_file, table_format)
+        # The head is a lower bound on any estimate
+        table_df.attrs["total_rows"] = max(total_rows or 0, len(table_df))
+        table_df.attrs["total_rows_exact"] = exact and total_rows is not None
+    rewind(table_file)
+    return table_df
@@ -0,0 +1,286 @@
+import ctypes
+import os
+import socket
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import orjson
+import pandas as pd
+
+
+# Jobs record the process running them, so only the jobs of a process that is gone are failed.
+# The token tells a restarted process apart from an earlier one that had the same pid.
+process_owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def is_process_alive(pid):
+    if os.name == "nt":
+        # Signals other than CTRL events terminate the process on Windows, so it is looked up instead
+        handle = ctypes.windll.kernel32.OpenProcess(0x100000, False, pid)  # SYNCHRONIZE
+        if not handle:
+            return False
+        try:
+            return ctypes.windll.kernel32.WaitForSingleObject(handle, 0) == 0x102  # WAIT_TIMEOUT
+        finally:
+            ctypes.windll.kernel32.CloseHandle(handle)
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def is_owner_gone(owner):
+    """
+    Whether the process that recorded `owner` has exited. Processes on other hosts
+    cannot be checked and count as running.
+    """
+    if owner == process_owner:
+        return False
+    host, _, rest = (owner or "").partition(":")
+    pid, _, _ = rest.partition(":")
+    if not pid.isdigit():
+        return True
+    if host != socket.gethostname():
+        return False
+    return int(pid) == os.getpid() or not is_process_alive(int(pid))
+
+
+class JobError(Exception):
+    """
+    Raised by a job to fail with a message meant for the user, keeping the rows
+    mapped before the failure as the job's result.
+    """
+    def __init__(self, message, partial_df=None):
+        super().__init__(message)
+        self.partial_df = partial_df
+
+
+def df_to_payload(df):
+    return orjson.dumps({"columns": df.columns.tolist(), "data": df.values.tolist()})
+
+
+def payload_to_df(payload):
+    payload = orjson.loads(payload)
+    return pd.DataFrame(payload["data"], columns=payload["columns"])
+
+
+class JobStore:
+    """
+    Keep the status, progress and result of every background mapping job in SQLite,
+    so a finished result can be fetched by its job id after the page is reloaded.
+
+    Jobs older than `ttl_seconds` are purged when a new job is created. Every job
+    records the process running it; jobs still queued or running when the store is
+    opened are marked failed if that process is gone. Other processes sharing the
+    file keep their jobs.
+
+    Args:
+        jobs_dir (str): The directory where the SQLite file is created.
+        ttl_seconds (int): How long a job and its result are kept.
+    """
+    def __init__(self, jobs_dir, ttl_seconds):
+        os.makedirs(jobs_dir, exist_ok=True)
+        self.path = os.path.join(jobs_dir, "jobs.sqlite3")
+        self.ttl_seconds = ttl_seconds
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " job_id TEXT PRIMARY KEY,"
+                " label TEXT NOT NULL,"
+                " status TEXT NOT NULL,"
+                " completed_chunks INTEGER NOT NULL DEFAULT 0,"
+                " total_chunks INTEGER NOT NULL DEFAULT 0,"
+                " error TEXT,"
+                " invalid_chunks TEXT,"
+                " result BLOB,"
+                " owner TEXT,"
+                " created_at REAL NOT NULL,"
+                " updated_at REAL NOT NULL)"
+            )
+            if "owner" not in [row[1] for row in conn.execute("PRAGMA table_info(jobs)")]:
+                conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            unfinished = conn.execute(
+                "SELECT job_id, owner FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchall()
+            conn.executemany(
+                "UPDATE jobs SET status = 'failed', error = ?, updated_at = ? WHERE job_id = ?",
+                [
+                    ("The app was restarted while the job was running.", time.time(), job_id)
+                    for job_id, owner in unfinished if is_owner_gone(owner)
+                ],
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def create_job(self, label):
+        job_id = uuid.uuid4().hex[:12]
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE updated_at < ?", (now - self.ttl_seconds,))
+            conn.execute(
+                "INSERT INTO jobs (job_id, label, status, owner, created_at, updated_at) VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, label, process_owner, now, now),
+            )
+        return job_id
+
+    def get_job_ids(self):
+        with self._connect() as conn:
+            return {job_id for (job_id,) in conn.execute("SELECT job_id FROM jobs")}
+
+    def update(self, job_id, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE jobs SET {assignments}, updated_at = ? WHERE job_id = ?",
+                (*fields.values(), time.time(), job_id),
+            )
+
+    def finish_job(self, job_id, result_df):
+        self.update(
+            job_id,
+            status="done",
+            result=df_to_payload(result_df),
+            invalid_chunks=orjson.dumps(result_df.attrs.get("invalid_chunks", [])).decode(),
+        )
+
+    def fail_job(self, job_id, error, partial_df=None):
+        # The rows mapped before the failure are kept as the job's result
+        result = df_to_payload(partial_df) if partial_df is not None and not partial_df.empty else None
+        self.update(job_id, status="failed", error=error, result=result)
+
+    def get_job(self, job_id):
+        """
+        Returns:
+            dict or None: The job's status and progress (without its result), None for unknown ids.
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT job_id, label, status, completed_chunks, total_chunks, error, invalid_chunks,"
+                " result IS NOT NULL, created_at, updated_at FROM jobs WHERE job_id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        keys = [
+            "job_id", "label", "status", "completed_chunks", "total_chunks", "error", "invalid_chunks",
+            "has_result", "created_at", "updated_at",
+        ]
+        job = dict(zip(keys, row))
+        job["invalid_chunks"] = orjson.loads(job["invalid_chunks"]) if job["invalid_chunks"] else []
+        job["has_result"] = bool(job["has_result"])
+        return job
+
+    def load_result(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT result FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None or row[0] is None:
+            return pd.DataFrame()
+        return payload_to_df(row[0])
+
+
+class Job:
+    """
+    The live state of a job, shared between its worker thread and the pages polling it.
+    Rows streamed so far, notices and the run metrics only live in memory; the status,
+    progress and result are written to the JobStore.
+    """
+    def __init__(self, job_id, store):
+        self.job_id = job_id
+        self.store = store
+        self.rows = []
+        self.notices = []
+        self.metrics = None
+        # What "Resume run" needs to send only the chunks this job did not finish
+        self.resume_run = None
+
+    def progress(self, count, total, res=None):
+        self.store.update(self.job_id, completed_chunks=count, total_chunks=total)
+
+    def show_rows(self, rows):
+        self.rows = rows
+
+    def notify(self, message):
+        self.notices.append(message)
+
+
+class JobRunner:
+    """
+    Run mapping jobs on a pool of background threads, so they keep going when the
+    page that started them reruns, reloads or disconnects. Jobs run side by side
+    up to `max_workers` at a time; the others wait in the queue.
+
+    The live state of a job is dropped once the store purges the job, and only the
+    last `max_resumable` failed jobs keep what "Resume run" needs.
+
+    Args:
+        store (JobStore): Where the jobs are recorded.
+        max_workers (int): The number of jobs running at once.
+        max_resumable (int): The number of failed jobs that stay resumable.
+    """
+    def __init__(self, store, max_workers, max_resumable):
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="mapping-job")
+        self.max_resumable = max_resumable
+        self.jobs = {}
+        self.failed_job_ids = deque()
+        self.lock = threading.Lock()
+
+    def submit(self, label, func):
+        """
+        Queue `func(job)`, which returns the job's result DataFrame.
+
+        Returns:
+            str: The id of the new job.
+        """
+        job_id = self.store.create_job(label)
+        job = Job(job_id, self.store)
+        stored_job_ids = self.store.get_job_ids()
+        with self.lock:
+            for expired_job_id in [job_id for job_id in self.jobs if job_id not in stored_job_ids]:
+                del self.jobs[expired_job_id]
+            self.jobs[job_id] = job
+        self.executor.submit(self.run, job, func)
+        return job_id
+
+    def run(self, job, func):
+        self.store.update(job.job_id, status="running")
+        try:
+            result_df = func(job)
+        except JobError as e:
+            self.store.fail_job(job.job_id, str(e), e.partial_df)
+            self.keep_resumable(job)
+        except Exception as e:
+            traceback.print_exc()
+            self.store.fail_job(job.job_id, str(e) or type(e).__name__, pd.DataFrame(job.rows))
+            self.keep_resumable(job)
+        else:
+            self.store.finish_job(job.job_id, result_df)
+        finally:
+            # Streamed rows are not needed once the result is stored
+            job.rows = []
+
+    def keep_resumable(self, job):
+        # The resume state holds the target and source tables, so older failed jobs let go of it
+        with self.lock:
+            self.failed_job_ids.append(job.job_id)
+            while len(self.failed_job_ids) > self.max_resumable:
+                old_job = self.jobs.get(self.failed_job_ids.popleft())
+                if old_job is not None:
+                    old_job.resume_run = None
+
+    def get(self, job_id):
+        """
+        Returns:
+            Job or None: The live state of a job started by this process.
+        """
+        with self.lock:
+            return self.jobs.get(job_id)
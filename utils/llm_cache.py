@@ -0,0 +1,151 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import orjson
+from langchain_core.messages import AIMessage
+
+
+class ResponseCache:
+    """
+    An on-disk, content-addressed cache of LLM responses stored in SQLite.
+
+    Entries older than `ttl_seconds` are ignored and purged, and the least recently
+    used entries are evicted once the cache holds more than `max_entries` responses.
+
+    Args:
+        cache_dir (str): The directory where the SQLite file is created.
+        ttl_seconds (int): How long a cached response stays valid.
+        max_entries (int): The maximum number of responses kept on disk.
+    """
+    def __init__(self, cache_dir, ttl_seconds, max_entries):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, "llm_responses.sqlite3")
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " content TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT content FROM responses WHERE key = ? AND created_at >= ?",
+                (key, now - self.ttl_seconds),
+            ).fetchone()
+            if row is not None:
+                conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        with self.lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return None if row is None else row[0]
+
+    def put(self, key, content):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, content, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, content, now, now),
+            )
+            self.evict(conn, now)
+
+    def evict(self, conn, now):
+        conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl_seconds,))
+        conn.execute(
+            "DELETE FROM responses WHERE key IN ("
+            " SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM responses")
+
+    def stats(self):
+        with self._connect() as conn:
+            (entries,) = conn.execute("SELECT COUNT(*) FROM responses").fetchone()
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": entries,
+            }
+
+
+def get_cache_key(model_name, prompt_template, temperature, input_vars):
+    payload = orjson.dumps(
+        {
+            "model": model_name,
+            "prompt": prompt_template,
+            "temperature": temperature,
+            "inputs": input_vars,
+        },
+        option=orjson.OPT_SORT_KEYS,
+    )
+    return hashlib.sha256(payload).hexdigest()
+
+
+def describe_chain(chain):
+    """
+    Returns:
+        tuple: The model name, prompt template and temperature of a prompt | ChatOpenAI
+        chain, the parts of its cache key that do not depend on the inputs.
+    """
+    prompt, llm = chain.first, chain.last
+    prompt_template = [[type(message).__name__, message.prompt.template] for message in prompt.messages]
+    return llm.model_name, prompt_template, llm.temperature
+
+
+class CachedChain:
+    """
+    Wrap the chain returned by `get_qa_chain` so identical prompts are answered
+    from the response cache instead of the OpenAI API.
+
+    Args:
+        chain: The prompt | ChatOpenAI chain to wrap.
+        cache (ResponseCache): The response cache to read from and write to.
+    """
+    def __init__(self, chain, cache):
+        self.chain = chain
+        self.cache = cache
+        self.model_name, self.prompt_template, self.temperature = describe_chain(chain)
+
+    def cache_key(self, input_vars):
+        return get_cache_key(self.model_name, self.prompt_template, self.temperature, input_vars)
+
+    def lookup(self, input_vars):
+        content = self.cache.get(self.cache_key(input_vars))
+        if content is None:
+            return None
+        return AIMessage(content=content, response_metadata={"cached": True})
+
+    def store(self, input_vars, res):
+        # Empty replies are never cached so they are retried on the next run
+        if res.content:
+            self.cache.put(self.cache_key(input_vars), res.content)
+
+    def invoke(self, input_vars):
+        res = self.lookup(input_vars)
+        if res is None:
+            res = self.chain.invoke(input_vars)
+            self.store(input_vars, res)
+        return res
@@ -0,0 +1,204 @@
+import os
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from utils.prematching import normalise_column_name, count_ngrams, get_idf, normalise_rows
+
+target_columns = ['Target Column Name', 'Target Column DataType']
+source_mapping_columns = ['Source1 Column Name', 'Source1 Mapping', 'Source2 Column Name', 'Source2 Mapping']
+memory_columns = ["target_key", "target_name", "target_datatype", "source1_name", "source1_mapping", "source2_name", "source2_mapping"]
+# Memory keys compared at once in a fuzzy lookup, bounding the score matrix
+fuzzy_block_size = 2048
+
+def clean_cell(value):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return "-"
+    value = str(value).strip()
+    return value if value and value.lower() != "nan" else "-"
+
+def get_referenced_columns(column_name):
+    # "ClaimType, LossType" references two source columns, "-" none
+    return [name.strip() for name in str(column_name).split(",") if name.strip() not in ("", "-")]
+
+def load_approved_mappings(mapping_file):
+    """
+    Read an approved mapping workbook, either an Excel export of this app (with its
+    title row) or a sheet like "Mapping Standardization.xlsx".
+
+    Returns:
+        pandas.DataFrame: The mappings with the target and source mapping columns.
+    """
+    raw_df = pd.read_excel(mapping_file, header=None)
+    header_rows = raw_df.index[raw_df.apply(lambda row: row.astype(str).str.strip().eq(target_columns[0]).any(), axis=1)]
+    if len(header_rows) == 0:
+        raise ValueError(f"No '{target_columns[0]}' header found in the mapping workbook.")
+    mapping_df = raw_df.iloc[header_rows[0] + 1:].reset_index(drop=True)
+    # Headers are matched ignoring repeated spaces ("Source2  Mapping")
+    mapping_df.columns = [" ".join(str(col).split()) for col in raw_df.iloc[header_rows[0]]]
+    for col in target_columns + source_mapping_columns:
+        if col not in mapping_df.columns:
+            mapping_df[col] = np.nan
+    return mapping_df[target_columns + source_mapping_columns]
+
+class MappingMemory:
+    """
+    A local knowledge base of approved target-to-source mappings, stored in SQLite and
+    indexed on the normalised target column name, so recurring layouts can be mapped
+    without the model.
+
+    Args:
+        memory_dir (str): The directory where the SQLite file is created.
+    """
+    def __init__(self, memory_dir):
+        os.makedirs(memory_dir, exist_ok=True)
+        self.path = os.path.join(memory_dir, "mapping_memory.sqlite3")
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS mappings ("
+                " target_key TEXT NOT NULL,"
+                " target_name TEXT NOT NULL,"
+                " target_datatype TEXT NOT NULL,"
+                " source1_name TEXT NOT NULL,"
+                " source1_mapping TEXT NOT NULL,"
+                " source2_name TEXT NOT NULL,"
+                " source2_mapping TEXT NOT NULL,"
+                " approved_at REAL NOT NULL,"
+                " PRIMARY KEY (target_key, target_datatype, source1_name, source1_mapping, source2_name, source2_mapping))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS mappings_target_key ON mappings (target_key)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def save(self, mapping_df):
+        """
+        Store the rows of `mapping_df` that map anything (a source column or a mapping rule).
+
+        Returns:
+            int: The number of mappings saved.
+        """
+        cells = mapping_df[target_columns + source_mapping_columns].map(clean_cell)
+        cells = cells[(cells[source_mapping_columns] != "-").any(axis=1)]
+        cells = cells[cells['Target Column Name'] != "-"]
+        if cells.empty:
+            return 0
+
+        now = time.time()
+        rows = [
+            (normalise_column_name(row[0]), *row, now)
+            for row in cells.itertuples(index=False, name=None)
+        ]
+        with self._connect() as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO mappings ({', '.join(memory_columns)}, approved_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        return len(rows)
+
+    def fetch(self, conn, target_keys):
+        rows = []
+        keys = list(target_keys)
+        # Stay below SQLite's limit on bound parameters
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            rows += conn.execute(
+                f"SELECT {', '.join(memory_columns)}, approved_at FROM mappings"
+                f" WHERE target_key IN ({', '.join('?' * len(batch))})",
+                batch,
+            ).fetchall()
+        return pd.DataFrame(rows, columns=memory_columns + ["approved_at"])
+
+    def find_fuzzy_keys(self, conn, target_keys, min_score, num_features):
+        """
+        Returns:
+            dict: The closest memory key of every target key scoring at least `min_score`.
+        """
+        memory_keys = [key for (key,) in conn.execute("SELECT DISTINCT target_key FROM mappings")]
+        if not memory_keys or not target_keys:
+            return {}
+
+        target_counts = count_ngrams(target_keys, num_features)
+        memory_counts = count_ngrams(memory_keys, num_features)
+        idf = get_idf(memory_counts)
+        target_vectors = normalise_rows(target_counts * idf)
+        best_scores = np.zeros(len(target_keys), dtype=np.float32)
+        best_keys = np.full(len(target_keys), -1)
+        for start in range(0, len(memory_keys), fuzzy_block_size):
+            scores = target_vectors @ normalise_rows(memory_counts[start:start + fuzzy_block_size] * idf).T
+            block_best = scores.argmax(axis=1)
+            block_scores = scores[np.arange(len(target_keys)), block_best]
+            improved = block_scores > best_scores
+            best_scores[improved] = block_scores[improved]
+            best_keys[improved] = block_best[improved] + start
+        return {
+            target_key: memory_keys[best_key]
+            for target_key, best_key, score in zip(target_keys, best_keys, best_scores)
+            if best_key >= 0 and score >= min_score
+        }
+
+    def resolve(self, target_df, source_columns, fuzzy_min_score, num_features):
+        """
+        Fill the target rows that have an approved mapping in memory whose source
+        columns all exist in the current source tables.
+
+        Exact hits on the normalised target name come first; the remaining rows are
+        matched to the closest remembered name when it scores at least `fuzzy_min_score`.
+        Among several remembered mappings, the one with the same datatype and the most
+        recent approval wins.
+
+        Args:
+            target_df (pandas.DataFrame): The target rows to resolve.
+            source_columns (list): The column names of each source table.
+
+        Returns:
+            tuple: The resolved rows (in the output layout) and the unresolved target rows.
+        """
+        if target_df.empty:
+            return target_df.iloc[0:0], target_df
+
+        targets = pd.DataFrame({
+            "row": np.arange(len(target_df)),
+            "target_key": target_df['Target Column Name'].map(normalise_column_name).values,
+            "datatype": target_df['Target Column DataType'].astype(str).str.strip().str.lower().values,
+        })
+        with self._connect() as conn:
+            candidates = self.fetch(conn, targets["target_key"].unique())
+            missing_keys = sorted(set(targets["target_key"]) - set(candidates["target_key"]))
+            fuzzy_keys = self.find_fuzzy_keys(conn, missing_keys, fuzzy_min_score, num_features)
+            if fuzzy_keys:
+                candidates = pd.concat([candidates, self.fetch(conn, set(fuzzy_keys.values()))], ignore_index=True)
+        if candidates.empty:
+            return target_df.iloc[0:0], target_df
+
+        # Every mapping is only valid if the current sources have the columns it references
+        for number, columns in enumerate(source_columns, start=1):
+            available = set(str(col).strip() for col in columns)
+            candidates = candidates[candidates[f"source{number}_name"].map(
+                lambda name: all(col in available for col in get_referenced_columns(name))
+            )]
+
+        targets["memory_key"] = targets["target_key"].map(lambda key: fuzzy_keys.get(key, key))
+        matches = targets.merge(
+            candidates.drop_duplicates().rename(columns={"target_key": "memory_key"}), on="memory_key"
+        )
+        if matches.empty:
+            return target_df.iloc[0:0], target_df
+        matches["same_datatype"] = matches["target_datatype"].str.strip().str.lower() == matches["datatype"]
+        matches = matches.sort_values(["row", "same_datatype", "approved_at"], ascending=[True, False, False])
+        matches = matches.drop_duplicates("row")
+
+        resolved_df = target_df.iloc[matches["row"].values][target_columns].reset_index(drop=True)
+        resolved_df['Source1 Column Name'] = matches["source1_name"].values
+        resolved_df['Source1 Mapping'] = matches["source1_mapping"].values
+        resolved_df['Source2 Column Name'] = matches["source2_name"].values
+        resolved_df['Source2 Mapping'] = matches["source2_mapping"].values
+        remaining_df = target_df[~np.isin(np.arange(len(target_df)), matches["row"].values)]
+        return resolved_df, remaining_df
+
+    def stats(self):
+        with self._connect() as conn:
+            (entries,) = conn.execute("SELECT COUNT(*) FROM mappings").fetchone()
+        return {"entries": entries}
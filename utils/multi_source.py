@@ -0,0 +1,142 @@
+import numpy as np
+import pandas as pd
+
+from utils.constants import model_context_windows
+from utils.file_handling import df_to_markdown
+from utils.incremental import get_row_keys
+from utils.processing import (
+    target_columns,
+    get_source_columns,
+    get_mapping_columns,
+    get_source_input_vars,
+    get_qa_prompt,
+    get_chunk_source,
+)
+from utils.token_budget import count_prompt_tokens, split_target_frames
+
+def fits_in_context(qa_prompt, source_input_vars, ai_model_name, max_output_tokens, min_target_tokens):
+    # Sources given per chunk are measured by their largest chunk
+    source_input_vars = {
+        name: max(markdown, key=len) if isinstance(markdown, list) else markdown
+        for name, markdown in source_input_vars.items()
+    }
+    prompt_tokens = count_prompt_tokens(qa_prompt, {**source_input_vars, "target_table": ""}, ai_model_name)
+    context_window = model_context_windows.get(ai_model_name, model_context_windows["gpt-3.5-turbo"])
+    return prompt_tokens + max_output_tokens + min_target_tokens <= context_window
+
+def get_source_target_df(target_rows_df, source_indexes):
+    # The target rows with only the output columns of these sources, renumbered from Source1
+    columns = target_columns + [column for k in source_indexes for column in get_source_columns(k + 1)]
+    source_target_df = target_rows_df.reindex(columns=columns)
+    source_target_df.columns = get_mapping_columns(len(source_indexes))
+    return source_target_df
+
+def plan_mapping_requests(
+    target_rows_df, source_table_markdowns, ai_model_name, max_output_tokens, target_table_chunk_size,
+    token_budgeting=True, structured_output=False, min_target_tokens=0, prematch_sources=None
+):
+    """
+    Split the target rows into the requests sent to the model for any number of source tables.
+
+    Every request holds all the source tables when their prompt still leaves `min_target_tokens`
+    of the context window for target rows. Otherwise the requests fan out per source table:
+    every target chunk is mapped against each source table on its own, as the only source of a
+    one-source prompt, and `merge_fan_out_results` joins the replies back into one wide table.
+
+    Args:
+        target_rows_df (pandas.DataFrame): The target rows to map.
+        source_table_markdowns (list): The rendered table of each source.
+        prematch_sources (callable, optional): Called with a source index and the target chunk
+            DataFrames, returns that source's markdown for every chunk (see pre-matching).
+
+    Returns:
+        dict: The plan, with "num_sources", "fan_out", the "source_table_markdowns" and
+        "target_table_markdowns" to pass to `process_target_table`, and "request_sources",
+        the source index of every request when fanned out.
+    """
+    num_sources = len(source_table_markdowns)
+    fan_out = num_sources > 1 and not fits_in_context(
+        get_qa_prompt(num_sources, structured_output), get_source_input_vars(source_table_markdowns),
+        ai_model_name, max_output_tokens, min_target_tokens
+    )
+    groups = [[k] for k in range(num_sources)] if fan_out else [list(range(num_sources))]
+    plan = {
+        "num_sources": num_sources,
+        "fan_out": fan_out,
+        "source_table_markdowns": [[] for _ in groups[0]],
+        "target_table_markdowns": [],
+        "request_sources": [],
+    }
+    for group in groups:
+        group_markdowns = [source_table_markdowns[k] for k in group]
+        chunk_dfs = split_target_frames(
+            get_source_target_df(target_rows_df, group),
+            get_qa_prompt(len(group), structured_output),
+            get_source_input_vars(group_markdowns),
+            ai_model_name,
+            max_output_tokens,
+            target_table_chunk_size,
+            token_budgeting,
+            len(group),
+        )
+        if prematch_sources is not None:
+            group_markdowns = [prematch_sources(k, chunk_dfs) for k in group]
+
+        plan["target_table_markdowns"] += [df_to_markdown(chunk_df) for chunk_df in chunk_dfs]
+        plan["request_sources"] += [group[0]] * len(chunk_dfs)
+        for j, markdown in enumerate(group_markdowns):
+            if fan_out:
+                # Fanned-out requests each carry their own source table
+                plan["source_table_markdowns"][j] += [get_chunk_source(markdown, i) for i in range(len(chunk_dfs))]
+            else:
+                plan["source_table_markdowns"][j] = markdown
+    return plan
+
+def get_occurrence_keys(df):
+    # Repeated target names are told apart by their occurrence
+    row_keys = get_row_keys(df)
+    return row_keys + "\x1e" + row_keys.groupby(row_keys).cumcount().astype(str)
+
+def merge_fan_out_results(target_rows_df, combined_df, plan):
+    """
+    Join the replies of fanned-out requests (one source each) into one mapping table with
+    the columns of every source, in the order of `target_rows_df`. Target rows a source's
+    replies left out are filled with "-".
+
+    Returns:
+        pandas.DataFrame: The wide mapping table.
+    """
+    merged_df = target_rows_df[target_columns].reset_index(drop=True)
+    merged_df["row_key"] = get_occurrence_keys(merged_df)
+    boundaries = np.cumsum([0] + combined_df.attrs.get("chunk_rows", []))
+    for k in range(plan["num_sources"]):
+        source_df = pd.concat(
+            [combined_df.iloc[boundaries[i]:boundaries[i + 1]]
+             for i, source in enumerate(plan["request_sources"]) if source == k]
+            or [pd.DataFrame(columns=get_mapping_columns(1))],
+            ignore_index=True,
+        )
+        source_df = source_df.rename(columns=dict(zip(get_source_columns(1), get_source_columns(k + 1))))
+        source_df["row_key"] = get_occurrence_keys(source_df)
+        merged_df = merged_df.merge(
+            source_df.drop_duplicates("row_key")[["row_key"] + get_source_columns(k + 1)], on="row_key", how="left"
+        )
+
+    merged_df = merged_df.drop(columns="row_key")
+    source_columns = merged_df.columns[len(target_columns):]
+    merged_df[source_columns] = merged_df[source_columns].fillna("-")
+    merged_df.attrs["invalid_chunks"] = combined_df.attrs.get("invalid_chunks", [])
+    return merged_df
+
+def merge_fan_out_chunks(target_rows_df, chunk_dfs, plan):
+    """
+    Same as `merge_fan_out_results` for some of the requests only, e.g. the checkpointed
+    chunks of a failed run.
+
+    Args:
+        chunk_dfs (dict): The parsed replies keyed by request index.
+    """
+    combined_df = pd.concat(list(chunk_dfs.values()), ignore_index=True)
+    combined_df.attrs["chunk_rows"] = [len(chunk_df) for chunk_df in chunk_dfs.values()]
+    request_sources = [plan["request_sources"][i] for i in chunk_dfs]
+    return merge_fan_out_results(target_rows_df, combined_df, {**plan, "request_sources": request_sources})
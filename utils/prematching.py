@@ -0,0 +1,159 @@
+import re
+import zlib
+
+import numpy as np
+import pandas as pd
+
+from utils.profiling import infer_column_types
+
+ngram_sizes = (2, 3, 4)
+# How much matching sample values can lift a weak name match
+sample_value_weight = 0.3
+# Part of the final score that comes from datatype compatibility
+datatype_weight = 0.15
+
+def normalise_column_name(name):
+    # "PolicyExperationDate" / "policy_experation_date" -> "policy experation date"
+    name = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", str(name))
+    name = re.sub(r"([A-Z]+)([A-Z][a-z])", r"\1 \2", name)
+    return " ".join(re.sub(r"[^0-9a-z]+", " ", name.lower()).split())
+
+def get_ngram_features(text, num_features):
+    text = f" {text} "
+    return [
+        zlib.crc32(text[i:i + n].encode("utf-8")) % num_features
+        for n in ngram_sizes
+        for i in range(len(text) - n + 1)
+    ]
+
+def count_ngrams(texts, num_features):
+    """
+    Hash the character n-grams of every text into a dense count matrix. crc32 is
+    used instead of hash() so the features are the same in every process.
+    """
+    doc_ids, feature_ids = [], []
+    for i, text in enumerate(texts):
+        features = get_ngram_features(text, num_features)
+        doc_ids.extend([i] * len(features))
+        feature_ids.extend(features)
+    counts = np.zeros((len(texts), num_features), dtype=np.float32)
+    np.add.at(counts, (np.array(doc_ids, dtype=np.int64), np.array(feature_ids, dtype=np.int64)), 1)
+    return counts
+
+def get_idf(*count_matrices):
+    counts = np.vstack(count_matrices)
+    document_frequency = (counts > 0).sum(axis=0)
+    return np.log((1 + len(counts)) / (1 + document_frequency)).astype(np.float32) + 1
+
+def normalise_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+def get_datatype_family(datatype):
+    datatype = str(datatype).lower()
+    if re.search(r"date|time", datatype):
+        return "datetime"
+    if re.search(r"bool|bit", datatype):
+        return "boolean"
+    if re.search(r"int|float|decimal|numeric|number|money|real|double", datatype):
+        return "number"
+    return "text"
+
+class SourceColumnIndex:
+    """
+    TF-IDF vectors (hashed character n-grams) of the columns of one source table,
+    built once and scored against any number of target rows.
+
+    Args:
+        source_df (pandas.DataFrame): The source table.
+        num_features (int): The number of hashed n-gram features.
+        sample_values (int): The distinct sample values added to each column's vector.
+    """
+    def __init__(self, source_df, num_features, sample_values=3):
+        self.columns = source_df.columns.astype(str).tolist()
+        self.num_features = num_features
+        self.datatype_families = np.array([get_datatype_family(t) for t in infer_column_types(source_df).values])
+
+        name_counts = count_ngrams([normalise_column_name(c) for c in self.columns], num_features)
+        value_counts = count_ngrams([
+            " ".join(source_df[col].dropna().astype(str).drop_duplicates().head(sample_values).str.lower())
+            for col in source_df.columns
+        ], num_features)
+        self.idf = get_idf(name_counts)
+        self.name_vectors = normalise_rows(name_counts * self.idf)
+        self.value_vectors = normalise_rows(value_counts * self.idf)
+
+    def score(self, target_names, target_datatypes):
+        """
+        Returns:
+            numpy.ndarray: A (target rows x source columns) matrix of scores between 0 and 1.
+        """
+        target_vectors = normalise_rows(
+            count_ngrams([normalise_column_name(name) for name in target_names], self.num_features) * self.idf
+        )
+        name_scores = target_vectors @ self.name_vectors.T
+        value_scores = target_vectors @ self.value_vectors.T
+        # An exact name match scores 1 whatever the sample values are
+        name_scores += sample_value_weight * value_scores * (1 - name_scores)
+
+        target_families = np.array([get_datatype_family(t) for t in target_datatypes])
+        same_family = target_families[:, None] == self.datatype_families[None, :]
+        # A text target can hold any source column, but text sources are the likelier match
+        compatible = np.where(same_family, 1.0, np.where(target_families[:, None] == "text", 0.5, 0.0))
+        return name_scores * (1 - datatype_weight) + compatible * datatype_weight
+
+def get_candidate_columns(index, target_df, top_k):
+    """
+    The union of the `top_k` best scoring source columns of every row of `target_df`,
+    in the source table's column order.
+    """
+    if len(index.columns) == 0 or target_df.empty:
+        return []
+    scores = index.score(target_df['Target Column Name'], target_df['Target Column DataType'])
+    top_k = min(top_k, scores.shape[1])
+    best = np.argpartition(-scores, top_k - 1, axis=1)[:, :top_k]
+    return [index.columns[i] for i in np.unique(best)]
+
+def prematch_source_markdowns(
+    source_df, target_chunk_dfs, source_table_to_markdown, top_k, num_features, sample_values=3
+):
+    """
+    Render, for every target chunk, the source table restricted to the candidate
+    columns of that chunk's rows.
+
+    Args:
+        source_df (pandas.DataFrame): The source table.
+        target_chunk_dfs (list): The target chunks as DataFrames.
+        source_table_to_markdown (callable): Renders a source DataFrame for the prompt.
+        top_k (int): The candidate source columns kept per target row.
+        num_features (int): The number of hashed n-gram features.
+
+    Returns:
+        list: One source markdown per chunk.
+    """
+    index = SourceColumnIndex(source_df, num_features, sample_values)
+    return [
+        source_table_to_markdown(source_df[get_candidate_columns(index, chunk_df, top_k)])
+        for chunk_df in target_chunk_dfs
+    ]
+
+def match_offline(target_clean_df, source_dfs, min_score, num_features, sample_values=3):
+    """
+    Fill the source column names of every target row whose best match scores at
+    least `min_score`, without calling the model. Mappings are left as "-".
+
+    Returns:
+        pandas.DataFrame: The target table with the Source1/Source2 columns filled.
+    """
+    combined_df = target_clean_df.copy()
+    for number, source_df in enumerate(source_dfs, start=1):
+        matched = pd.Series("-", index=combined_df.index, dtype=object)
+        if not source_df.empty and not combined_df.empty:
+            index = SourceColumnIndex(source_df, num_features, sample_values)
+            scores = index.score(combined_df['Target Column Name'], combined_df['Target Column DataType'])
+            best = scores.argmax(axis=1)
+            confident = scores[np.arange(len(best)), best] >= min_score
+            matched[confident] = np.array(index.columns, dtype=object)[best[confident]]
+        combined_df[f'Source{number} Column Name'] = matched
+        combined_df[f'Source{number} Mapping'] = "-"
+    return combined_df
@@ -0,0 +1,53 @@
+import numpy as np
+
+from utils.file_handling import stringify_column
+
+
+def filter_rows(df, columns, search):
+    """
+    Find the rows of a table where any of `columns` contains `search`.
+
+    Args:
+        df (pandas.DataFrame): The table to search.
+        columns (list): The columns searched.
+        search (str): The text looked for, literally and ignoring case. Empty matches every row.
+
+    Returns:
+        numpy.ndarray: The positions of the matching rows.
+    """
+    search = search.strip()
+    if not search or not columns:
+        return np.arange(len(df))
+
+    matched = np.zeros(len(df), dtype=bool)
+    for col in columns:
+        # Each column is searched with a single vectorised pass instead of cell by cell
+        cells = stringify_column(df[col].astype(object)).where(df[col].notna(), "")
+        matched |= cells.str.contains(search, case=False, regex=False).to_numpy()
+    return np.flatnonzero(matched)
+
+
+def count_pages(num_rows, page_size):
+    return max(1, -(-num_rows // page_size))
+
+
+def get_page(df, rows, columns, page, page_size):
+    """
+    Returns:
+        pandas.DataFrame: The `columns` of the rows on `page` (counted from 1), the only
+        part of the table that is rendered.
+    """
+    start = (page - 1) * page_size
+    return df.iloc[rows[start:start + page_size]][columns]
+
+
+def read_text_preview(path, max_chars):
+    """
+    Read the start of a text file without loading the rest of it.
+
+    Returns:
+        tuple: The first `max_chars` characters and whether the file is longer.
+    """
+    with open(path, encoding="utf-8") as text_file:
+        text = text_file.read(max_chars + 1)
+    return text[:max_chars], len(text) > max_chars
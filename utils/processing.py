@@ -2,104 +2,543 @@ from langchain.prompts import ChatPromptTemplate
 from langchain_openai.chat_models import ChatOpenAI
 import pandas as pd
 from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.utils import get_column_letter
 from openpyxl.utils.dataframe import dataframe_to_rows
-from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
+from openpyxl.styles import Font, Alignment, Border, Side, PatternFill, NamedStyle
 from datetime import datetime
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import queue
 import time
+import re
+
+import orjson
 
 import streamlit as st
 
-def get_qa_chain(openai_api_key, ai_model_name, model_max_tokens):
-    qa_system_prompt = "Analyze the provided data tables to augment the target table with the specified columns. Ensure the output strictly adheres to the requested format, including only the required information in the output."
+from utils.rate_limit import estimate_tokens, invoke_with_backoff, stream_with_backoff
+from utils.llm_cache import CachedChain
+from utils.coalescing import get_request_key
+
+target_columns = ['Target Column Name', 'Target Column DataType']
+# Spelled out in the prompt, larger counts are written as digits
+number_words = {1: "one", 2: "two", 3: "three", 4: "four", 5: "five", 6: "six", 7: "seven", 8: "eight"}
+
+def get_source_columns(number):
+    return [f'Source{number} Column Name', f'Source{number} Mapping']
+
+def get_mapping_columns(num_sources=2):
+    """
+    The columns of the mapping table: the target name and datatype, then the column
+    name and mapping of every source table.
+    """
+    return target_columns + [column for number in range(1, num_sources + 1) for column in get_source_columns(number)]
 
-    qa_input_prompt = """Imagine you are a business Analyst who is an expert in Data Migration Projects. Your client has provided with some claims data that is managed by two TPA's. The first TPA stores the data in this format.
+mapping_columns = get_mapping_columns(2)
 
-    **Source1 Table:**
-    {source1_table}
+def get_source_input_vars(source_table_markdowns):
+    return {f"source{number}_table": markdown for number, markdown in enumerate(source_table_markdowns, start=1)}
 
-    **Source2 Table:**
-    {source2_table}
+def get_qa_prompt(num_sources=2, structured_output=False):
+    """
+    Build the prompt of the QA chain for `num_sources` source tables, with one
+    "source<N>_table" variable per source table and one for the target table.
+    """
+    qa_system_prompt = "Analyze the provided data tables to augment the target table with the specified columns. Ensure the output strictly adheres to the requested format, including only the required information in the output."
+
+    tpa_count = f"{number_words.get(num_sources, num_sources)} TPA's. The first TPA" if num_sources > 1 else "one TPA. The TPA"
+    source_tables = "".join(
+        f"""
+
+    **Source{number} Table:**
+    {{source{number}_table}}"""
+        for number in range(1, num_sources + 1)
+    )
+    source_columns = [f'"Source{number} Column Name"' for number in range(1, num_sources + 1)]
+    source_columns = " and ".join([", ".join(source_columns[:-1]), source_columns[-1]] if num_sources > 1 else source_columns)
+    qa_input_prompt = f"""Imagine you are a business Analyst who is an expert in Data Migration Projects. Your client has provided with some claims data that is managed by {tpa_count} stores the data in this format.{source_tables}
 
-    Now you need to map the source data to target and fill the column "Source1 Column Name" and "Source2 Column Name" based on target column "Target Column Name".
+    Now you need to map the source data to target and fill the column {source_columns} based on target column "Target Column Name".
 
     **Target Table:**
-    {target_table}"""
-    
-    qa_prompt = ChatPromptTemplate.from_messages([
+    {{target_table}}"""
+
+    if structured_output:
+        # Braces are doubled so the prompt template does not read them as variables
+        row_keys = ", ".join(f'"{column}"' for column in get_mapping_columns(num_sources))
+        qa_input_prompt += f"""
+
+    Return only a JSON object of the form {{{{"rows": [...]}}}} with one object per row of the target table, in the same order. Every object must have the keys {row_keys}, and use "-" when there is no mapping."""
+
+    return ChatPromptTemplate.from_messages([
         ("system", qa_system_prompt),
         ("human", qa_input_prompt),
     ])
 
+def get_qa_chain(openai_api_key, ai_model_name, model_max_tokens, structured_output=False, num_sources=2):
+    model_kwargs = {
+        "top_p": 1,
+        "frequency_penalty": 0,
+        "presence_penalty": 0,
+    }
+    if structured_output:
+        model_kwargs["response_format"] = {"type": "json_object"}
+    qa_prompt = get_qa_prompt(num_sources, structured_output)
+
     return qa_prompt | ChatOpenAI(
         model=ai_model_name, 
         streaming=True,
+        # Report token usage on streamed responses too
+        stream_usage=True,
         temperature=0.3, 
         max_tokens=model_max_tokens, 
         openai_api_key=openai_api_key, 
-        model_kwargs={
-            "top_p": 1,
-            "frequency_penalty": 0,
-            "presence_penalty": 0,
-        }
+        # Retries are handled by utils.rate_limit so 429s can pause every worker
+        max_retries=0,
+        model_kwargs=model_kwargs,
     )
 
 # utils/processing.py
 
+separator_cell = re.compile(r":?-+:?")
+
+def get_table_cells(line):
+    """
+    Split a markdown table line into its cells, keeping empty cells in place.
+
+    Returns:
+        list or None: The stripped cells, or None when the line is not a table line
+        (prose, code fences or blank lines around the table).
+    """
+    line = line.strip()
+    if "|" not in line or line.startswith("```"):
+        return None
+    if line.startswith("|"):
+        line = line[1:]
+    if line.endswith("|"):
+        line = line[:-1]
+    return [cell.strip() for cell in line.split("|")]
+
+def is_separator_row(cells):
+    return all(separator_cell.fullmatch(cell) for cell in cells)
+
+def is_header_row(cells):
+    return cells[0] == target_columns[0]
+
+def get_mapping_row(cells, columns=mapping_columns):
+    # Missing and empty cells are both shown as "-"
+    cells = cells[:len(columns)]
+    cells += [""] * (len(columns) - len(cells))
+    return {column: cell or "-" for column, cell in zip(columns, cells)}
+
+def parse_llm_line(line, columns=mapping_columns):
+    return get_mapping_row(get_table_cells(line) or [], columns)
+
+class StreamedRowParser:
+    """
+    Turn a (possibly streamed) markdown table reply into rows as soon as each line is
+    complete. Lines outside the table, separator lines and the header are skipped; the
+    header being the first table line when a separator follows it.
+    """
+    def __init__(self, on_row, columns=mapping_columns):
+        self.on_row = on_row
+        self.columns = columns
+        self.reset()
+
+    def reset(self):
+        # A retried stream starts the reply over, so nothing of the cut-off one is kept
+        self.buffer = ""
+        self.table_lines = 0
+        self.pending_cells = None
+
+    def feed(self, text):
+        self.buffer += text
+        while "\n" in self.buffer:
+            line, self.buffer = self.buffer.split("\n", 1)
+            self.emit(line)
+
+    def close(self):
+        self.emit(self.buffer)
+        self.buffer = ""
+        self.flush_pending()
+
+    def flush_pending(self):
+        if self.pending_cells is not None:
+            self.on_row(get_mapping_row(self.pending_cells, self.columns))
+            self.pending_cells = None
+
+    def emit(self, line):
+        cells = get_table_cells(line)
+        if cells is None:
+            return
+        self.table_lines += 1
+        if is_separator_row(cells):
+            # The line held back before the separator was the header
+            self.pending_cells = None
+        elif is_header_row(cells):
+            self.flush_pending()
+        elif self.table_lines == 1:
+            self.pending_cells = cells
+        else:
+            self.flush_pending()
+            self.on_row(get_mapping_row(cells, self.columns))
+
+def parse_markdown_response(data, columns=mapping_columns):
+    rows = []
+    parser = StreamedRowParser(rows.append, columns)
+    parser.feed(data)
+    parser.close()
+    return rows
+
+def parse_json_response(data, columns=mapping_columns):
+    """
+    Parse a structured (JSON) reply of the form {"rows": [...]} into mapping rows.
+
+    Raises:
+        ValueError: If the reply is not valid JSON or holds no list of rows.
+    """
+    text = data.strip()
+    start = min((i for i in (text.find("{"), text.find("[")) if i >= 0), default=-1)
+    end = max(text.rfind("}"), text.rfind("]"))
+    if start < 0 or end < start:
+        raise ValueError("The reply holds no JSON")
+    payload = orjson.loads(text[start:end + 1])
+    if isinstance(payload, dict):
+        payload = payload.get("rows", next((v for v in payload.values() if isinstance(v, list)), None))
+    if not isinstance(payload, list):
+        raise ValueError("The JSON reply holds no list of rows")
+
+    # Keys are matched ignoring case, spaces and underscores
+    normalise = lambda key: str(key).lower().replace(" ", "").replace("_", "")
+    rows = []
+    for item in payload:
+        item = {normalise(key): value for key, value in item.items()} if isinstance(item, dict) else {}
+        cells = [item.get(normalise(column)) for column in columns]
+        rows.append(get_mapping_row(["" if cell is None else str(cell).strip() for cell in cells], columns))
+    return rows
+
+def parse_llm_response(data, structured_output=False, columns=mapping_columns):
+    """
+    Parse the model's reply into a DataFrame of mapping rows. Structured replies are
+    read as JSON and fall back to the markdown parser when they are not valid JSON.
+    """
+    rows = None
+    if structured_output:
+        try:
+            rows = parse_json_response(data, columns)
+        except ValueError:
+            # orjson.JSONDecodeError is a ValueError too
+            rows = None
+    if rows is None:
+        rows = parse_markdown_response(data, columns)
+    return pd.DataFrame(rows, columns=columns)
+
+def get_chunk_source(source_table_markdown, i):
+    if isinstance(source_table_markdown, list):
+        return source_table_markdown[i]
+    return source_table_markdown
+
+def count_markdown_rows(markdown):
+    # Chunks are rendered by df_to_markdown: a header, a separator and one line per row
+    return max(0, len(markdown.split("\n")) - 2)
+
 def process_target_table(
-    source1_table_markdown,
-    source2_table_markdown, 
+    source_table_markdowns,
     target_table_markdowns, 
     llm,
-    target_table_chunk_size
+    target_table_chunk_size,
+    max_workers=1,
+    rate_limiter=None,
+    model_max_tokens=0,
+    max_retries=0,
+    progress_callback=None,
+    rows_callback=None,
+    structured_output=False,
+    max_invalid_retries=0,
+    checkpoint_store=None,
+    run_id=None,
+    metrics=None,
+    coalescer=None,
 ):
-    combined_df = pd.DataFrame()
-    progress_text = "Please wait..., this may take a moment depending on file size and content."
-    progress_bar = st.progress(0, text=progress_text)
+    """
+    Map every target chunk with the LLM chain and combine the parsed results in chunk order.
+
+    Progress goes to `progress_callback(completed_chunks, total_chunks, res)` when given,
+    `res` being the chain's response for the chunk that just finished. Without a callback
+    a Streamlit progress bar is drawn and returned, otherwise None is returned in its place.
 
-    count = 1
-    for markdown in target_table_markdowns:
+    When `rows_callback` is given the responses are streamed, and it is called from the
+    calling thread with every row parsed so far (in chunk order) whenever new rows arrive.
+
+    `source_table_markdowns` holds one entry per source table of the chain's prompt, which
+    sets the output columns. An entry may also be a list with one markdown per chunk, e.g.
+    the candidate source columns picked by pre-matching.
+
+    A reply that does not have one row per target row of its chunk is requested again, up
+    to `max_invalid_retries` times, without touching the other chunks. Invalid replies are
+    never cached; chunks still invalid after the retries keep their parsed rows and are
+    listed (1-based) in `combined_df.attrs["invalid_chunks"]`.
+    `combined_df.attrs["chunk_rows"]` holds the number of rows parsed from each chunk.
+
+    With a `checkpoint_store`, every chunk is saved under `run_id` as soon as it completes,
+    and the chunks the store already holds for that run are not requested again.
+
+    With `metrics` (a RunMetrics), every chunk's latency, queue waits, retries and token
+    usage are recorded.
+
+    With a `coalescer` (a RequestCoalescer), a chunk whose identical request is already in
+    flight, e.g. from another session, waits for that response instead of sending its own.
+    """
+    columns = get_mapping_columns(len(source_table_markdowns))
+    progress_bar = None
+    if progress_callback is None:
+        progress_text = "Please wait..., this may take a moment depending on file size and content."
+        progress_bar = st.progress(0, text=progress_text)
+
+        def progress_callback(count, total, res):
+            progress_num = count / total
+            progress_bar.progress(1 if progress_num > 1 else progress_num, text=progress_text)
+
+    # Streamed rows are handed from the worker threads to the calling thread through a queue
+    row_events = queue.Queue()
+    streamed_rows = {}
+    # JSON replies cannot be split into rows until they are complete
+    stream_rows = rows_callback is not None and not structured_output
+
+    chain = llm.chain if isinstance(llm, CachedChain) else llm
+
+    def send_chunk(i, input_vars, num_tokens, stats):
+        if not stream_rows:
+            return invoke_with_backoff(chain, input_vars, rate_limiter, num_tokens, max_retries, stats)
+        parser = StreamedRowParser(lambda row: row_events.put((i, row)), columns)
+
+        def reset_rows():
+            parser.reset()
+            row_events.put((i, None))
+
+        res = stream_with_backoff(
+            chain, input_vars, rate_limiter, num_tokens, max_retries,
+            on_text=parser.feed,
+            on_reset=reset_rows,
+            stats=stats,
+        )
+        parser.close()
+        return res
+
+    def request_chunk(i, input_vars, num_tokens, stats):
+        """
+        Returns:
+            tuple: The response and whether it was shared from an identical request in flight.
+        """
+        if coalescer is None:
+            return send_chunk(i, input_vars, num_tokens, stats), False
+        return coalescer.run(
+            get_request_key(chain, input_vars), lambda: send_chunk(i, input_vars, num_tokens, stats)
+        )
+
+    def map_chunk(i, markdown, submitted_at):
+        started_at = time.perf_counter()
         input_vars = {
-            "source1_table": source1_table_markdown,
-            "source2_table": source2_table_markdown,
+            **get_source_input_vars(get_chunk_source(source, i) for source in source_table_markdowns),
             "target_table": markdown,
         }
-        res = llm.invoke(input_vars)
-        data = res.content
-        lines = data.split('\n')[2:]
-        rows = []
-        for line in lines:
-            columns = [x.strip() for x in line.split('|') if x.strip()]
-            row = {
-                'Target Column Name': columns[0] if len(columns) >= 1 else "-",
-                'Target Column DataType': columns[1] if len(columns) >= 2 else "-",
-                'Source1 Column Name': columns[2] if len(columns) >= 3 else "-",
-                'Source1 Mapping': columns[3] if len(columns) >= 4 else "-",
-                'Source2 Column Name': columns[4] if len(columns) >= 5 else "-",
-                'Source2 Mapping': columns[5] if len(columns) == 6 else "-",
-            }
-            rows.append(row)
-        
-        df = pd.DataFrame(rows)
-        
-        combined_df = pd.concat([combined_df, df], ignore_index=True)
-        count += 1
-        progress_num = count / (len(target_table_markdowns))
-        progress_bar.progress(1 if progress_num > 1 else progress_num, text=progress_text)
-
-        # Sleep for openai rate limiting
-        time.sleep(1)
-    
+        # OpenAI counts max_tokens against the tokens-per-minute limit up front
+        num_tokens = estimate_tokens("".join(input_vars.values())) + model_max_tokens
+        expected_rows = count_markdown_rows(markdown)
+        stats = {"prompt_tokens": 0, "completion_tokens": 0, "invalid_replies": 0, "cached": False, "coalesced": False}
+
+        for attempt in range(max_invalid_retries + 1):
+            # Cache hits skip the rate limiter entirely, but a retry always asks the model again
+            res = llm.lookup(input_vars) if isinstance(llm, CachedChain) and attempt == 0 else None
+            fresh = res is None
+            shared = False
+            if fresh:
+                res, shared = request_chunk(i, input_vars, num_tokens, stats)
+                if shared:
+                    # The tokens were paid for by the request it was shared from
+                    stats["coalesced"] = True
+                else:
+                    usage = getattr(res, "usage_metadata", None) or {}
+                    stats["prompt_tokens"] += usage.get("input_tokens", 0)
+                    stats["completion_tokens"] += usage.get("output_tokens", 0)
+            else:
+                stats["cached"] = True
+            chunk_df = parse_llm_response(res.content, structured_output, columns)
+            # Shared responses arrive whole, their rows were not streamed
+            if not (fresh and stream_rows and not shared):
+                for row in chunk_df.to_dict("records"):
+                    row_events.put((i, row))
+
+            valid = len(chunk_df) == expected_rows
+            if valid:
+                if fresh and not shared and isinstance(llm, CachedChain):
+                    llm.store(input_vars, res)
+                break
+            stats["invalid_replies"] += 1
+            if attempt < max_invalid_retries:
+                row_events.put((i, None))
+
+        if checkpoint_store is not None:
+            checkpoint_store.save_chunk(run_id, i, chunk_df, valid=valid)
+        if metrics is not None:
+            metrics.record_call(
+                chunk=i + 1,
+                rows=len(chunk_df),
+                seconds=time.perf_counter() - started_at,
+                pool_wait_seconds=started_at - submitted_at,
+                **stats,
+            )
+        return chunk_df, res, valid
+
+    def drain_row_events():
+        changed = False
+        while not row_events.empty():
+            i, row = row_events.get_nowait()
+            if row is None:
+                # The chunk's reply is being requested again from scratch
+                streamed_rows.pop(i, None)
+            else:
+                streamed_rows.setdefault(i, []).append(row)
+            changed = True
+        if changed and rows_callback is not None:
+            rows_callback([row for i in sorted(streamed_rows) for row in streamed_rows[i]])
+
+    # Chunks may finish out of order, so results are slotted back by chunk index
+    chunk_dfs = [None] * len(target_table_markdowns)
+    invalid_chunks = []
+    # Chunks checkpointed by an earlier attempt of the run are reused as they are
+    completed_chunks = checkpoint_store.load_chunks(run_id) if checkpoint_store is not None else {}
+    for i, chunk_df in completed_chunks.items():
+        if i < len(chunk_dfs):
+            chunk_dfs[i] = chunk_df
+            if metrics is not None:
+                metrics.record_call(chunk=i + 1, rows=len(chunk_df), resumed=True)
+            for row in chunk_df.to_dict("records"):
+                row_events.put((i, row))
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            executor.submit(map_chunk, i, markdown, time.perf_counter()): i
+            for i, markdown in enumerate(target_table_markdowns)
+            if chunk_dfs[i] is None
+        }
+        pending = set(futures)
+        count = len(target_table_markdowns) - len(futures)
+        drain_row_events()
+        try:
+            while pending:
+                done, pending = wait(pending, timeout=0.25, return_when=FIRST_COMPLETED)
+                drain_row_events()
+                for future in done:
+                    chunk_dfs[futures[future]], res, valid = future.result()
+                    if not valid:
+                        invalid_chunks.append(futures[future] + 1)
+                    count += 1
+                    progress_callback(count, len(target_table_markdowns), res)
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+        finally:
+            drain_row_events()
+
+    if len(chunk_dfs) == 0:
+        return pd.DataFrame(), progress_bar
+
+    combined_df = pd.concat(chunk_dfs, ignore_index=True)
+    combined_df.attrs["invalid_chunks"] = sorted(invalid_chunks)
+    combined_df.attrs["chunk_rows"] = [len(chunk_df) for chunk_df in chunk_dfs]
     return combined_df, progress_bar
 
 
 def get_column_width(text, min_header_weight):
     return max(len(text), min_header_weight) * 1.1
 
+def get_excel_column_widths(text_df, min_header_weight, max_header_weight):
+    # Same result as growing each width cell by cell, computed once per column
+    widths = []
+    for i, col in enumerate(text_df.columns):
+        width = get_column_width(str(col), min_header_weight)
+        cell_widths = text_df.iloc[:, i].str.len().clip(lower=min_header_weight) * 1.1
+        if (cell_widths > max_header_weight).any():
+            width = max_header_weight
+        elif (cell_widths < max_header_weight).any():
+            width = max(width, cell_widths[cell_widths < max_header_weight].max())
+        widths.append(width)
+    return widths
+
+def build_fast_excel_workbook(
+    combined_df, excel_title_height, excel_header_height, 
+    excel_data_height, max_header_weight, min_header_weight
+):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.sheet_view.showGridLines = False
+
+    # Shared named styles instead of new style objects per cell
+    thin_border = Side(style='thin', color='D9D9D9')
+    cell_border = Border(left=thin_border, right=thin_border, top=thin_border, bottom=thin_border)
+    wb.add_named_style(NamedStyle(
+        name="mapping_title",
+        font=Font(bold=True, size=20),
+        alignment=Alignment(horizontal='left', vertical='center'),
+    ))
+    wb.add_named_style(NamedStyle(
+        name="mapping_header",
+        font=Font(bold=True, color="FFFFFF", size=12),
+        fill=PatternFill(start_color="404040", end_color="404040", fill_type="solid"),
+        alignment=Alignment(horizontal='center', vertical='center'),
+        border=cell_border,
+    ))
+    wb.add_named_style(NamedStyle(
+        name="mapping_data",
+        font=Font(color="000000"),
+        alignment=Alignment(horizontal='left', vertical='center', indent=1),
+        border=cell_border,
+    ))
+
+    def styled_row(values, style):
+        row = []
+        for value in values:
+            cell = WriteOnlyCell(ws, value=value)
+            cell.style = style
+            row.append(cell)
+        return row
+
+    # Rows where every cell is None or '' are left out, as in the regular export
+    text_df = combined_df.astype(str)
+    blank_cells = (combined_df.isna() & text_df.eq('None')) | combined_df.eq('')
+    keep_rows = ~blank_cells.all(axis=1)
+    data_df = combined_df[keep_rows]
+
+    # Column and row dimensions have to be set before any row is written in write-only mode
+    for i, width in enumerate(get_excel_column_widths(text_df[keep_rows], min_header_weight, max_header_weight)):
+        ws.column_dimensions[get_column_letter(i+1)].width = width
+    ws.row_dimensions[1].height = excel_title_height
+    ws.row_dimensions[2].height = excel_header_height
+    ws.sheet_format.defaultRowHeight = excel_data_height
+    ws.sheet_format.customHeight = True
+
+    ws.append(styled_row(['CMT Data: '], "mapping_title"))
+    ws.append(styled_row(combined_df.columns.tolist(), "mapping_header"))
+    for row in data_df.itertuples(index=False):
+        ws.append(styled_row(row, "mapping_data"))
+    return wb
+
 def create_excel_file(
     combined_df, session_state, excel_title_height, excel_header_height, 
-    excel_data_height, max_header_weight, min_header_weight, target_filename
+    excel_data_height, max_header_weight, min_header_weight, target_filename,
+    fast_export=False
 ):
+    if fast_export:
+        wb = build_fast_excel_workbook(
+            combined_df, excel_title_height, excel_header_height,
+            excel_data_height, max_header_weight, min_header_weight
+        )
+        save_excel_file(wb, session_state, target_filename)
+        return
+
     wb = Workbook()
     ws = wb.active
     ws.sheet_view.showGridLines = False
@@ -139,7 +578,7 @@ def create_excel_file(
         cell.font = header_font
         cell.alignment = header_alignment
         cell.border = header_border
-        ws.column_dimensions[chr(65+i)].width = get_column_width(headers[i], min_header_weight)
+        ws.column_dimensions[get_column_letter(i+1)].width = get_column_width(headers[i], min_header_weight)
     ws.row_dimensions[2].height = excel_header_height
 
     # Add data rows from DataFrame and style them
@@ -155,13 +594,16 @@ def create_excel_file(
             ws_cell.border = data_border
             ws_cell.alignment = data_alignment
             ws_cell.font = data_font
-            current_width = ws.column_dimensions[chr(65+c_idx)].width
+            current_width = ws.column_dimensions[get_column_letter(c_idx+1)].width
             cell_width = get_column_width(str(cell), min_header_weight)
             if float(cell_width) > float(current_width) and float(cell_width) < max_header_weight:
-                ws.column_dimensions[chr(65+c_idx)].width = cell_width
+                ws.column_dimensions[get_column_letter(c_idx+1)].width = cell_width
             elif float(cell_width) > max_header_weight:
-                ws.column_dimensions[chr(65+c_idx)].width = max_header_weight
+                ws.column_dimensions[get_column_letter(c_idx+1)].width = max_header_weight
+
+    save_excel_file(wb, session_state, target_filename)
 
+def save_excel_file(wb, session_state, target_filename):
     # Format and save the workbook with a datetime stamp in the filename
     current_time = datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
     if target_filename and target_filename != "":
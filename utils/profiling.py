@@ -0,0 +1,38 @@
+import pandas as pd
+
+def infer_column_types(df):
+    dtypes = df.infer_objects().dtypes.astype(str)
+    # Object columns are refined (string, datetime, mixed, ...) since "object" tells the model nothing
+    for col in dtypes.index[dtypes == "object"]:
+        dtypes[col] = pd.api.types.infer_dtype(df[col], skipna=True)
+    return dtypes
+
+def profile_dataframe(df, sample_values=3, sample_rows=None):
+    """
+    Reduce a source table to one line per column.
+
+    Args:
+        df (pandas.DataFrame): The source table.
+        sample_values (int): The number of distinct example values kept per column.
+        sample_rows (int, optional): Profile a random sample of this many rows instead of the whole table.
+
+    Returns:
+        pandas.DataFrame: The column profile with name, inferred dtype, null %, distinct count and sample values.
+    """
+    if sample_rows and len(df) > sample_rows:
+        df = df.sample(n=sample_rows, random_state=0)
+
+    null_pct = (df.isna().mean() * 100).round(1)
+    distinct_count = df.nunique(dropna=True)
+    samples = pd.Series({
+        col: ", ".join(df[col].dropna().drop_duplicates().head(sample_values).astype(str))
+        for col in df.columns
+    }, dtype=object)
+
+    return pd.DataFrame({
+        "Column Name": df.columns.astype(str),
+        "DataType": infer_column_types(df).values,
+        "Null %": null_pct.values,
+        "Distinct Count": distinct_count.values,
+        "Sample Values": samples.values,
+    })
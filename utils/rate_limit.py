@@ -0,0 +1,231 @@
+import threading
+import time
+import random
+from contextlib import contextmanager
+
+import openai
+
+
+class TokenBucket:
+    """
+    A token bucket that refills continuously up to its capacity.
+
+    Args:
+        capacity (float): The maximum number of units the bucket can hold.
+        refill_per_second (float): How many units are added back every second.
+    """
+    def __init__(self, capacity, refill_per_second):
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self.available = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated_at
+        self.available = min(self.capacity, self.available + elapsed * self.refill_per_second)
+        self.updated_at = now
+
+    def wait_time(self, amount):
+        # A single request larger than the whole bucket is let through once the bucket is full
+        amount = min(float(amount), self.capacity)
+        if self.available >= amount:
+            return 0.0
+        return (amount - self.available) / self.refill_per_second
+
+    def consume(self, amount):
+        self.available -= min(float(amount), self.capacity)
+
+
+class RateLimiter:
+    """
+    Schedule LLM calls so they respect both the requests-per-minute and the
+    tokens-per-minute limits of the OpenAI account.
+
+    Args:
+        requests_per_minute (int): The allowed number of requests per minute.
+        tokens_per_minute (int): The allowed number of tokens per minute.
+        max_concurrency (int, optional): The most requests in flight at once, across
+            every run sharing the limiter.
+    """
+    def __init__(self, requests_per_minute, tokens_per_minute, max_concurrency=None):
+        self.requests = TokenBucket(requests_per_minute, requests_per_minute / 60.0)
+        self.tokens = TokenBucket(tokens_per_minute, tokens_per_minute / 60.0)
+        self.paused_until = 0.0
+        self.slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self.lock = threading.Lock()
+
+    def acquire(self, num_tokens):
+        """
+        Block until a request costing `num_tokens` tokens can be sent.
+
+        Returns:
+            float: The number of seconds spent waiting.
+        """
+        started_at = time.monotonic()
+        while True:
+            with self.lock:
+                self.requests.refill()
+                self.tokens.refill()
+                now = time.monotonic()
+                wait = max(
+                    self.paused_until - now,
+                    self.requests.wait_time(1),
+                    self.tokens.wait_time(num_tokens),
+                )
+                if wait <= 0:
+                    self.requests.consume(1)
+                    self.tokens.consume(num_tokens)
+                    return time.monotonic() - started_at
+            time.sleep(wait)
+
+    @contextmanager
+    def slot(self):
+        """
+        Hold one of the `max_concurrency` request slots while the request is in flight.
+
+        Yields:
+            float: The number of seconds spent waiting for the slot.
+        """
+        if self.slots is None:
+            yield 0.0
+            return
+        started_at = time.monotonic()
+        self.slots.acquire()
+        try:
+            yield time.monotonic() - started_at
+        finally:
+            self.slots.release()
+
+    def pause(self, seconds):
+        # Every worker holds off after a 429, not just the one that received it
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def estimate_tokens(text):
+    # Rough estimate of ~4 characters per token for English text
+    return len(text) // 4 + 1
+
+
+def get_retry_after(error):
+    """
+    Read the retry delay (in seconds) sent by the OpenAI API with a 429 response.
+
+    Returns:
+        float or None: The delay in seconds, or None when the response has no retry header.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000.0
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+def is_retryable_error(error):
+    return isinstance(error, (
+        openai.RateLimitError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.InternalServerError,
+    ))
+
+
+def get_backoff_delay(error, attempt, rate_limiter):
+    delay = get_retry_after(error)
+    if delay is None:
+        delay = min(60.0, 2 ** attempt) + random.uniform(0, 1)
+    if rate_limiter is not None and isinstance(error, openai.RateLimitError):
+        rate_limiter.pause(delay)
+        return 0.0
+    return delay
+
+
+def record_wait(stats, rate_limiter, num_tokens):
+    if rate_limiter is None:
+        return
+    waited = rate_limiter.acquire(num_tokens)
+    if stats is not None:
+        stats["rate_limit_wait_seconds"] = stats.get("rate_limit_wait_seconds", 0.0) + waited
+
+
+@contextmanager
+def request_slot(stats, rate_limiter):
+    if rate_limiter is None:
+        yield
+        return
+    with rate_limiter.slot() as waited:
+        if stats is not None:
+            stats["rate_limit_wait_seconds"] = stats.get("rate_limit_wait_seconds", 0.0) + waited
+        yield
+
+
+def record_retry(stats):
+    if stats is not None:
+        stats["retries"] = stats.get("retries", 0) + 1
+
+
+def invoke_with_backoff(llm, input_vars, rate_limiter, num_tokens, max_retries, stats=None):
+    """
+    Invoke the LLM chain through the rate limiter, retrying rate limit and
+    transient API errors with exponential backoff.
+
+    Args:
+        llm: The LLM chain to invoke.
+        input_vars (dict): The prompt variables.
+        rate_limiter (RateLimiter): The shared rate limiter, or None to send right away.
+        num_tokens (int): The estimated number of tokens the request will consume.
+        max_retries (int): The maximum number of retries before the error is raised.
+        stats (dict, optional): Accumulates "rate_limit_wait_seconds" and "retries".
+
+    Returns:
+        The response of the LLM chain.
+    """
+    attempt = 0
+    while True:
+        record_wait(stats, rate_limiter, num_tokens)
+        try:
+            with request_slot(stats, rate_limiter):
+                return llm.invoke(input_vars)
+        except Exception as e:
+            if not is_retryable_error(e) or attempt >= max_retries:
+                raise
+            record_retry(stats)
+            time.sleep(get_backoff_delay(e, attempt, rate_limiter))
+            attempt += 1
+
+
+def stream_with_backoff(llm, input_vars, rate_limiter, num_tokens, max_retries, on_text, on_reset, stats=None):
+    """
+    Stream the LLM chain's response through the rate limiter, passing every piece of
+    text to `on_text` as it arrives. When a retryable error interrupts the stream,
+    `on_reset` is called before the request is sent again from scratch.
+
+    Returns:
+        The aggregated response message of the LLM chain.
+    """
+    attempt = 0
+    while True:
+        record_wait(stats, rate_limiter, num_tokens)
+        try:
+            res = None
+            with request_slot(stats, rate_limiter):
+                for piece in llm.stream(input_vars):
+                    res = piece if res is None else res + piece
+                    if piece.content:
+                        on_text(piece.content)
+            return res
+        except Exception as e:
+            if not is_retryable_error(e) or attempt >= max_retries:
+                raise
+            on_reset()
+            record_retry(stats)
+            time.sleep(get_backoff_delay(e, attempt, rate_limiter))
+            attempt += 1
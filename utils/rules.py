@@ -0,0 +1,270 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+from utils.mapping_memory import clean_cell, get_referenced_columns
+from utils.prematching import normalise_column_name, get_datatype_family
+from utils.profiling import infer_column_types
+from utils.processing import target_columns, get_mapping_columns
+
+# Records where every output row came from: a rule, the mapping memory or the model
+origin_column = "Mapped By"
+# An optional column of a standardization sheet, a regular expression matched against target names
+pattern_column = "Target Column Pattern"
+# Normalised headers of the two columns of a column definition sheet
+definition_name_headers = {"field name", "column name", "source column name", "field", "column"}
+definition_text_headers = {"description", "definition", "column description", "field description"}
+# Rows searched for the header of a sheet
+max_header_row = 10
+
+def find_header_row(raw_df, is_header):
+    for i in range(min(max_header_row, len(raw_df))):
+        if is_header([" ".join(str(cell).split()) for cell in raw_df.iloc[i]]):
+            return i
+    return None
+
+def read_standard_sheet(raw_df, header_row):
+    standard_df = raw_df.iloc[header_row + 1:].reset_index(drop=True)
+    # Headers are matched ignoring repeated spaces ("Source2  Mapping")
+    standard_df.columns = [" ".join(str(col).split()) for col in raw_df.iloc[header_row]]
+    standard_df = standard_df.loc[:, ~standard_df.columns.duplicated()]
+    for col in target_columns + [pattern_column]:
+        if col not in standard_df.columns:
+            standard_df[col] = np.nan
+    return standard_df
+
+def read_definition_sheet(raw_df, header_row):
+    header = [normalise_column_name(cell) for cell in raw_df.iloc[header_row]]
+    name_col = next(i for i, name in enumerate(header) if name in definition_name_headers)
+    text_col = next(i for i, name in enumerate(header) if name in definition_text_headers)
+    return pd.DataFrame({
+        "field_name": raw_df.iloc[header_row + 1:, name_col].map(clean_cell).values,
+        "description": raw_df.iloc[header_row + 1:, text_col].map(clean_cell).values,
+    })
+
+def is_definition_header(header):
+    names = {normalise_column_name(cell) for cell in header}
+    return bool(names & definition_name_headers) and bool(names & definition_text_headers)
+
+def map_distinct(series, func):
+    # Target tables repeat datatypes and often names, so each distinct value is converted once
+    values = series.astype(str)
+    distinct = values.unique()
+    return values.map(dict(zip(distinct, map(func, distinct))))
+
+def are_compatible(target_families, source_families):
+    # Text holds anything, other families only match themselves (an integer column is no date)
+    return (target_families == source_families) | (target_families == "text") | (source_families == "text")
+
+class RuleSet:
+    """
+    Deterministic mapping rules read from mapping standardization sheets (approved
+    target rows with their source columns) and column definition sheets (a source field
+    name and its description), kept as lookup tables the target rows are merged against.
+
+    Rules are tried in this order, each on the rows the previous ones left:
+        1. a standardization row with the same target name ("exact"), or the same
+           normalised name ("alias"), or whose Target Column Pattern matches ("regex");
+        2. for every source table, a column with the same name ("exact"), or the same
+           normalised name or definition ("alias").
+    A rule only applies when the datatypes are compatible and the source columns it
+    references exist in the current source tables.
+
+    Args:
+        standard_df (pandas.DataFrame): The rows of the standardization sheets.
+        definitions_df (pandas.DataFrame): The "field_name" and "description" of every defined column.
+    """
+    def __init__(self, standard_df, definitions_df):
+        standard_df = standard_df.copy()
+        standard_df["target_name"] = standard_df['Target Column Name'].map(clean_cell)
+        standard_df["target_key"] = standard_df["target_name"].map(normalise_column_name)
+        standard_df["rule_family"] = standard_df['Target Column DataType'].map(get_datatype_family)
+        standard_df["pattern"] = standard_df[pattern_column].map(clean_cell)
+        self.standard_df = standard_df[(standard_df["target_name"] != "-") | (standard_df["pattern"] != "-")]
+        for pattern in self.standard_df["pattern"][self.standard_df["pattern"] != "-"]:
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise ValueError(f"Invalid {pattern_column} '{pattern}': {e}")
+        self.definitions_df = definitions_df[
+            (definitions_df["field_name"] != "-") & (definitions_df["description"] != "-")
+        ]
+
+    def get_standard_rules(self, source_columns):
+        """
+        The standardization rows in the layout of `len(source_columns)` source tables,
+        keeping only those whose source columns all exist in the current sources.
+        """
+        mapping_columns = get_mapping_columns(len(source_columns))
+        if self.standard_df.empty or any(col not in self.standard_df.columns for col in mapping_columns[2:]):
+            return pd.DataFrame(columns=mapping_columns[2:] + ["target_name", "target_key", "rule_family", "pattern"])
+
+        rules = self.standard_df.copy()
+        rules[mapping_columns[2:]] = rules[mapping_columns[2:]].map(clean_cell)
+        for number, columns in enumerate(source_columns, start=1):
+            available = set(str(col).strip() for col in columns)
+            rules = rules[rules[f'Source{number} Column Name'].map(
+                lambda name: all(col in available for col in get_referenced_columns(name))
+            )]
+        return rules[mapping_columns[2:] + ["target_name", "target_key", "rule_family", "pattern"]]
+
+    def get_column_lookup(self, source_df):
+        """
+        Returns:
+            pandas.DataFrame: The "key" every column of `source_df` can be found by, with its
+            "column", datatype "family" and rule "kind". Keys shared by several columns are
+            ambiguous and left out.
+        """
+        columns = pd.Series(source_df.columns.astype(str), dtype=object)
+        families = pd.Series(
+            [get_datatype_family(t) for t in infer_column_types(source_df).values], index=columns.values, dtype=object
+        )
+        definitions = self.definitions_df[self.definitions_df["field_name"].isin(set(columns))]
+        lookup = pd.concat([
+            pd.DataFrame({"key": columns.str.strip(), "column": columns, "kind": "exact"}),
+            pd.DataFrame({"key": columns.map(normalise_column_name), "column": columns, "kind": "alias"}),
+            pd.DataFrame({
+                "key": definitions["description"].map(normalise_column_name).values,
+                "column": definitions["field_name"].values,
+                "kind": "alias",
+            }),
+        ], ignore_index=True).drop_duplicates()
+        lookup = lookup[lookup["key"] != ""]
+        lookup = lookup[~lookup.duplicated(["kind", "key"], keep=False)]
+        lookup["family"] = lookup["column"].map(families)
+        return lookup
+
+    def match_standard_rules(self, targets, rules):
+        """
+        Returns:
+            pandas.DataFrame: The rule of every target row one applies to, with its "kind".
+        """
+        matches = []
+        remaining = targets
+        for kind, key, other_key in (("exact", "target_name", "target_key"), ("alias", "target_key", "target_name")):
+            kind_rules = rules[~rules[key].isin(["-", ""])].drop(columns=other_key)
+            kind_matches = remaining.merge(kind_rules, on=key)
+            kind_matches = kind_matches[are_compatible(kind_matches["target_family"], kind_matches["rule_family"])]
+            kind_matches = kind_matches.drop_duplicates("row").assign(kind=kind)
+            matches.append(kind_matches)
+            remaining = remaining[~remaining["row"].isin(kind_matches["row"])]
+
+        # Patterns are few, each is matched against all remaining names at once
+        for _, rule in rules[rules["pattern"] != "-"].iterrows():
+            if remaining.empty:
+                break
+            matched = remaining["target_name"].str.fullmatch(rule["pattern"], case=False)
+            matched &= are_compatible(remaining["target_family"], rule["rule_family"])
+            if matched.any():
+                pattern_matches = remaining[matched].assign(**rule.drop(["target_name", "target_key"]).to_dict(), kind="regex")
+                matches.append(pattern_matches)
+                remaining = remaining[~matched]
+        return pd.concat(matches, ignore_index=True)
+
+    def match_source_columns(self, targets, source_dfs):
+        """
+        Returns:
+            pandas.DataFrame: The target rows found in every source table, with the
+            matched source columns and the weakest rule "kind" used.
+        """
+        matched = targets[["row"]]
+        for number, source_df in enumerate(source_dfs, start=1):
+            lookup = self.get_column_lookup(source_df)
+            source_matches = pd.concat([
+                targets.merge(lookup[lookup["kind"] == "exact"], left_on="target_name", right_on="key"),
+                targets.merge(lookup[lookup["kind"] == "alias"], left_on="target_key", right_on="key"),
+            ], ignore_index=True)
+            source_matches = source_matches[are_compatible(source_matches["target_family"], source_matches["family"])]
+            source_matches = source_matches.drop_duplicates("row")
+            matched = matched.merge(
+                source_matches[["row", "column", "kind"]].rename(
+                    columns={"column": f'Source{number} Column Name', "kind": f"kind{number}"}
+                ),
+                on="row",
+            )
+            matched[f'Source{number} Mapping'] = "-"
+
+        kind_columns = [f"kind{number}" for number in range(1, len(source_dfs) + 1)]
+        matched["kind"] = np.where((matched[kind_columns] == "exact").all(axis=1), "exact", "alias")
+        return matched.drop(columns=kind_columns)
+
+    def resolve(self, target_df, source_dfs):
+        """
+        Fill the target rows the rules apply to, with one merge per rule kind over all rows.
+
+        Args:
+            target_df (pandas.DataFrame): The target rows to resolve.
+            source_dfs (list): The DataFrame of each source table.
+
+        Returns:
+            tuple: The resolved rows (in the output layout, with the rule in `origin_column`)
+            and the unresolved target rows.
+        """
+        mapping_columns = get_mapping_columns(len(source_dfs))
+        if target_df.empty or not source_dfs:
+            return pd.DataFrame(columns=mapping_columns + [origin_column]), target_df
+
+        names = map_distinct(target_df['Target Column Name'], clean_cell)
+        targets = pd.DataFrame({
+            "row": np.arange(len(target_df)),
+            "target_name": names.values,
+            "target_key": map_distinct(names, normalise_column_name).values,
+            "target_family": map_distinct(target_df['Target Column DataType'], get_datatype_family).values,
+        })
+        targets = targets[targets["target_name"] != "-"]
+
+        standard_matches = self.match_standard_rules(
+            targets, self.get_standard_rules([source_df.columns for source_df in source_dfs])
+        )
+        remaining = targets[~targets["row"].isin(standard_matches["row"])]
+        column_matches = self.match_source_columns(remaining, source_dfs)
+        matches = pd.concat(
+            [standard_matches[["row", "kind"] + mapping_columns[2:]], column_matches[["row", "kind"] + mapping_columns[2:]]],
+            ignore_index=True,
+        ).sort_values("row")
+
+        resolved_df = target_df.iloc[matches["row"].values][target_columns].reset_index(drop=True)
+        resolved_df[mapping_columns[2:]] = matches[mapping_columns[2:]].values
+        resolved_df[origin_column] = ("rule (" + matches["kind"] + ")").values
+        remaining_df = target_df[~np.isin(np.arange(len(target_df)), matches["row"].values)]
+        return resolved_df, remaining_df
+
+def load_rules(rule_files):
+    """
+    Read the standardization and column definition sheets of every workbook. A sheet
+    with a "Target Column Name" header is a standardization sheet; one with a field
+    name and a description column is a definition sheet; other sheets are skipped.
+
+    Args:
+        rule_files (list): Paths or uploaded files of xlsx workbooks.
+
+    Returns:
+        RuleSet: The rules of all the workbooks, or None when there are no workbooks.
+
+    Raises:
+        ValueError: If a workbook has neither kind of sheet.
+    """
+    if not rule_files:
+        return None
+    standard_dfs, definition_dfs = [], []
+    for rule_file in rule_files:
+        sheets = pd.read_excel(rule_file, sheet_name=None, header=None, dtype=object)
+        found = False
+        for raw_df in sheets.values():
+            header_row = find_header_row(raw_df, lambda header: target_columns[0] in header)
+            if header_row is not None:
+                standard_dfs.append(read_standard_sheet(raw_df, header_row))
+                found = True
+                continue
+            header_row = find_header_row(raw_df, is_definition_header)
+            if header_row is not None:
+                definition_dfs.append(read_definition_sheet(raw_df, header_row))
+                found = True
+        if not found:
+            name = getattr(rule_file, "name", rule_file)
+            raise ValueError(f"No mapping standardization or column definition sheet found in {name}.")
+
+    standard_df = pd.concat(standard_dfs, ignore_index=True) if standard_dfs else pd.DataFrame(columns=target_columns + [pattern_column])
+    definitions_df = pd.concat(definition_dfs, ignore_index=True) if definition_dfs else pd.DataFrame(columns=["field_name", "description"])
+    return RuleSet(standard_df, definitions_df)
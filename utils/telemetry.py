@@ -0,0 +1,141 @@
+import csv
+import io
+import math
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+import orjson
+
+call_fields = [
+    "chunk", "rows", "seconds", "pool_wait_seconds", "rate_limit_wait_seconds", "retries",
+    "invalid_replies", "prompt_tokens", "completion_tokens", "cached", "resumed", "coalesced",
+]
+
+
+class RunMetrics:
+    """
+    Collect the timings of a mapping run: one span per pipeline stage and one record
+    per chunk sent to the model (latency, queue waits, retries and token usage).
+
+    Chunks answered from the cache, a checkpoint or a shared in-flight request are
+    left out of the latency figures.
+
+    Recording is a perf_counter call and a list append under a lock, so it is left on.
+
+    Args:
+        ai_model_name (str): The model of the run, used to price its tokens.
+        token_prices (dict): USD per million (input, output) tokens of every model.
+    """
+    def __init__(self, ai_model_name="", token_prices=None):
+        self.ai_model_name = ai_model_name
+        self.token_prices = token_prices or {}
+        self.started_at = time.time()
+        self.spans = []
+        self.calls = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        started_at = time.perf_counter()
+        try:
+            yield attributes
+        finally:
+            seconds = time.perf_counter() - started_at
+            with self.lock:
+                self.spans.append({"stage": name, "seconds": seconds, **attributes})
+
+    def record_call(self, **call):
+        with self.lock:
+            self.calls.append({field: call.get(field, 0) for field in call_fields})
+
+    def get_stage_totals(self):
+        totals = {}
+        with self.lock:
+            for span in self.spans:
+                stage = totals.setdefault(span["stage"], {"stage": span["stage"], "count": 0, "seconds": 0.0, "max_seconds": 0.0})
+                stage["count"] += 1
+                stage["seconds"] += span["seconds"]
+                stage["max_seconds"] = max(stage["max_seconds"], span["seconds"])
+        return list(totals.values())
+
+    def summary(self):
+        with self.lock:
+            calls = list(self.calls)
+        sent = [call for call in calls if not call["cached"] and not call["resumed"] and not call["coalesced"]]
+        latencies = sorted(call["seconds"] for call in sent)
+        prompt_tokens = sum(call["prompt_tokens"] for call in calls)
+        completion_tokens = sum(call["completion_tokens"] for call in calls)
+        input_price, output_price = self.token_prices.get(self.ai_model_name, (0.0, 0.0))
+        return {
+            "model": self.ai_model_name,
+            "chunks": len(calls),
+            "cached_chunks": sum(1 for call in calls if call["cached"]),
+            "resumed_chunks": sum(1 for call in calls if call["resumed"]),
+            "coalesced_chunks": sum(1 for call in calls if call["coalesced"]),
+            "rows": sum(call["rows"] for call in calls),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "estimated_cost_usd": round((prompt_tokens * input_price + completion_tokens * output_price) / 1e6, 6),
+            "retries": sum(call["retries"] for call in calls),
+            "invalid_replies": sum(call["invalid_replies"] for call in calls),
+            "pool_wait_seconds": sum(call["pool_wait_seconds"] for call in calls),
+            "rate_limit_wait_seconds": sum(call["rate_limit_wait_seconds"] for call in calls),
+            "mean_call_seconds": sum(latencies) / len(latencies) if latencies else 0.0,
+            "p95_call_seconds": latencies[math.ceil(0.95 * len(latencies)) - 1] if latencies else 0.0,
+        }
+
+    def to_dict(self):
+        with self.lock:
+            calls = list(self.calls)
+        return {
+            "started_at": self.started_at,
+            "summary": self.summary(),
+            "stages": self.get_stage_totals(),
+            "calls": calls,
+        }
+
+
+def report_to_json(runs):
+    """
+    Args:
+        runs (list): One dict per run, a "run" name plus the output of `RunMetrics.to_dict`.
+    """
+    return orjson.dumps({"runs": runs}, option=orjson.OPT_INDENT_2)
+
+
+def report_to_csv(runs):
+    # One line per stage, then one line per chunk call, of every run
+    report_file = io.StringIO()
+    writer = csv.writer(report_file)
+    fields = [field for field in call_fields if field != "seconds"]
+    writer.writerow(["run", "kind", "name", "count", "seconds", "max_seconds"] + fields)
+    for run in runs:
+        for stage in run["stages"]:
+            writer.writerow(
+                [run["run"], "stage", stage["stage"], stage["count"], f"{stage['seconds']:.6f}", f"{stage['max_seconds']:.6f}"]
+                + [""] * len(fields)
+            )
+        for call in run["calls"]:
+            writer.writerow(
+                [run["run"], "call", f"chunk {call['chunk']}", 1, f"{call['seconds']:.6f}", ""]
+                + [call[field] for field in fields]
+            )
+    return report_file.getvalue()
+
+
+def write_report(path, runs):
+    # The format follows the file extension: .csv, anything else is JSON
+    if path.lower().endswith(".csv"):
+        with open(path, "w", newline="", encoding="utf-8") as report_file:
+            report_file.write(report_to_csv(runs))
+    else:
+        with open(path, "wb") as report_file:
+            report_file.write(report_to_json(runs))
+
+
+def timed(metrics, name, **attributes):
+    # Lets call sites time a stage whether or not metrics are being collected
+    if metrics is None:
+        return nullcontext(attributes)
+    return metrics.span(name, **attributes)
@@ -0,0 +1,135 @@
+import warnings
+from functools import lru_cache
+
+import tiktoken
+
+from utils.file_handling import df_to_markdown, split_dataframe
+from utils.rate_limit import estimate_tokens
+from utils.constants import (
+    model_context_windows,
+    mapping_tokens_per_source,
+    max_target_rows_per_chunk,
+)
+
+# Each chat message carries a few tokens of framing on top of its content
+tokens_per_message = 4
+
+class ContextWindowError(ValueError):
+    """
+    Raised when the source tables alone do not fit in the model's context window,
+    before any request is sent.
+    """
+
+@lru_cache(maxsize=None)
+def get_encoding(ai_model_name):
+    try:
+        return tiktoken.encoding_for_model(ai_model_name)
+    except Exception as e:
+        # Unknown model, or the BPE file cannot be downloaded (offline deployments)
+        warnings.warn(f"No tokenizer for {ai_model_name} ({e}), token budgets use an approximate count.")
+        return None
+
+def count_tokens(text, ai_model_name):
+    encoding = get_encoding(ai_model_name)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+def count_tokens_batch(texts, ai_model_name):
+    encoding = get_encoding(ai_model_name)
+    if encoding is None:
+        return [estimate_tokens(text) for text in texts]
+    return [len(tokens) for tokens in encoding.encode_batch(texts, disallowed_special=())]
+
+def count_prompt_tokens(qa_prompt, input_vars, ai_model_name):
+    messages = qa_prompt.format_messages(**input_vars)
+    return sum(count_tokens(message.content, ai_model_name) + tokens_per_message for message in messages)
+
+def plan_target_chunks(
+    target_table_df, qa_prompt, source_input_vars, ai_model_name,
+    context_window, max_output_tokens, mapping_tokens_per_row, max_rows_per_chunk
+):
+    """
+    Pack as many target rows per chunk as fit in the model's context window.
+
+    The prompt (with the source tables) and the reserved `max_output_tokens` are subtracted
+    from the context window, and every chunk is kept small enough that its expected output,
+    estimated as the row itself plus `mapping_tokens_per_row`, fits in `max_output_tokens`.
+
+    Args:
+        target_table_df (pandas.DataFrame): The target rows to send to the model.
+        qa_prompt (ChatPromptTemplate): The prompt of the QA chain.
+        source_input_vars (dict): The prompt variables except "target_table".
+        ai_model_name (str): The OpenAI model name, used to pick the tokenizer.
+        context_window (int): The context window of the model in tokens.
+        max_output_tokens (int): The max_tokens the chain is configured with.
+        mapping_tokens_per_row (int): The expected tokens the model adds to each row.
+        max_rows_per_chunk (int): An upper bound on the rows in a single chunk.
+
+    Returns:
+        list: The target table chunks as DataFrames.
+
+    Raises:
+        ContextWindowError: If the source tables alone do not fit in the context window.
+    """
+    if target_table_df.empty:
+        return []
+
+    base_tokens = count_prompt_tokens(qa_prompt, {**source_input_vars, "target_table": ""}, ai_model_name)
+    header_tokens = count_tokens(df_to_markdown(target_table_df.iloc[0:0]), ai_model_name)
+    input_budget = context_window - max_output_tokens - base_tokens - header_tokens
+    # Safety margin for the model repeating the header and any framing text
+    output_budget = int(max_output_tokens * 0.9) - header_tokens
+    if input_budget <= 0 or output_budget <= 0:
+        raise ContextWindowError(
+            f"The source tables need {base_tokens} tokens and do not fit in the "
+            f"{context_window} token context window of {ai_model_name}. "
+            "Try the Column Profile source table payload."
+        )
+
+    # Render every row once (without header) to measure it
+    row_lines = df_to_markdown(target_table_df).split("\n")[2:]
+    row_tokens = count_tokens_batch(row_lines, ai_model_name)
+
+    chunks = []
+    start, input_used, output_used = 0, 0, 0
+    for i, tokens in enumerate(row_tokens):
+        row_input = tokens + 1
+        row_output = tokens + 1 + mapping_tokens_per_row
+        rows_in_chunk = i - start
+        if rows_in_chunk > 0 and (
+            input_used + row_input > input_budget
+            or output_used + row_output > output_budget
+            or rows_in_chunk >= max_rows_per_chunk
+        ):
+            chunks.append(target_table_df.iloc[start:i])
+            start, input_used, output_used = i, 0, 0
+        input_used += row_input
+        output_used += row_output
+    chunks.append(target_table_df.iloc[start:])
+    return chunks
+
+def split_target_frames(
+    target_table_df, qa_prompt, source_input_vars, ai_model_name,
+    max_output_tokens, target_table_chunk_size, token_budgeting=True, num_sources=2
+):
+    """
+    Split the target rows into the chunks sent to the model, either packed by token
+    budget or in fixed groups of `target_table_chunk_size` rows. Every reply row grows
+    with the `num_sources` source tables of the request, and so does its token estimate.
+
+    Returns:
+        list: The target table chunks as DataFrames.
+    """
+    if token_budgeting:
+        return plan_target_chunks(
+            target_table_df,
+            qa_prompt,
+            source_input_vars,
+            ai_model_name,
+            model_context_windows.get(ai_model_name, model_context_windows["gpt-3.5-turbo"]),
+            max_output_tokens,
+            mapping_tokens_per_source * num_sources,
+            max_target_rows_per_chunk,
+        )
+    return split_dataframe(target_table_df, target_table_chunk_size)